@@ -0,0 +1,268 @@
+import os
+import math
+import time
+import sqlite3
+import asyncio
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, asynccontextmanager
+
+from metrics import ADMISSIONS
+
+
+class AdmissionRejected(Exception):
+    """A generation was shed. reason is 'client_rate', 'global_rate', 'queue_full' or 'deadline'."""
+
+    def __init__(self, reason, retry_after_seconds):
+        super().__init__(f"Generation rejected ({reason})")
+        self.reason = reason
+        self.retry_after_seconds = retry_after_seconds
+
+
+class TokenBucket:
+    """Allows `burst` events at once, refilling at `rate_per_second`."""
+
+    def __init__(self, rate_per_second, burst):
+        self.rate_per_second = rate_per_second
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        if now > self.updated_at: # A bucket created after `now` was taken has nothing to add
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate_per_second)
+            self.updated_at = now
+
+    def seconds_until_available(self, now):
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate_per_second
+
+    def take(self):
+        self.tokens -= 1
+
+
+class LocalTokenBuckets:
+    """
+    Token buckets in this process's memory, keyed by name (e.g. "client:<ip>" or "global").
+    take() checks a list of limits, each (reason, key, rate_per_second, burst), and takes a
+    token from every bucket only if all have one; otherwise it returns (reason, seconds until
+    that bucket has a token). At most max_keys buckets are kept, least recently used first out.
+    """
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict() # key -> TokenBucket, least recently used first
+        self._lock = threading.Lock()
+
+    def _bucket(self, key, rate_per_second, burst):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate_per_second, burst)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def take(self, limits):
+        now = time.monotonic()
+        with self._lock:
+            buckets = [(reason, self._bucket(key, rate_per_second, burst)) for reason, key, rate_per_second, burst in limits]
+            for reason, bucket in buckets: # Check every bucket before taking from any
+                wait_seconds = bucket.seconds_until_available(now)
+                if wait_seconds:
+                    return reason, wait_seconds
+            for _, bucket in buckets:
+                bucket.take()
+        return None
+
+
+class SQLiteTokenBuckets:
+    """
+    Token buckets shared by every process using the same SQLite file, e.g. all gunicorn workers
+    on a node (with the database in the cache directory) or all nodes (held by the shared
+    cache server). Same interface as LocalTokenBuckets. A bucket is stored only until it has
+    refilled completely, after which a missing row reads as full, so the table stays small.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connection().execute("""CREATE TABLE IF NOT EXISTS buckets (
+            key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL, full_at REAL NOT NULL)""")
+        self._connection().execute("CREATE INDEX IF NOT EXISTS buckets_full_at ON buckets (full_at)")
+
+    def _connection(self):
+        """One connection per thread, reopened after a fork (connections must not cross processes)."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def take(self, limits):
+        now = time.time() # Wall clock: the one clock every process, and every node, agrees on
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE") # Serializes check-and-take across processes
+        try:
+            connection.execute("DELETE FROM buckets WHERE full_at <= ?", (now,))
+            buckets, rejection = [], None
+            for reason, key, rate_per_second, burst in limits: # Check every bucket before taking from any
+                bucket = TokenBucket(rate_per_second, burst)
+                row = connection.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+                bucket.tokens, bucket.updated_at = row if row is not None else (bucket.burst, now)
+                wait_seconds = bucket.seconds_until_available(now)
+                if wait_seconds:
+                    rejection = (reason, wait_seconds)
+                    break
+                buckets.append((key, bucket))
+            else:
+                for key, bucket in buckets:
+                    bucket.take()
+                    full_at = now + (bucket.burst - bucket.tokens) / bucket.rate_per_second
+                    connection.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated_at, full_at) VALUES (?, ?, ?, ?)",
+                                       (key, bucket.tokens, now, full_at))
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return rejection
+
+
+class AdmissionController:
+    """
+    Gate in front of LLM generations. At most max_concurrent generations run at once in this
+    process; up to max_queue more wait for a slot until their deadline, and anything beyond
+    that is rejected immediately rather than left to time out. Optional token buckets limit
+    the rate of generations per client (e.g. IP address) and overall; a rate of 0 disables one.
+    The buckets are kept in `buckets` (LocalTokenBuckets by default; pass SQLiteTokenBuckets or
+    shared_cache.SharedTokenBuckets to share the limits between processes).
+    Rejections raise AdmissionRejected with a suggested Retry-After.
+    """
+
+    def __init__(self, max_concurrent=8, max_queue=32, queue_timeout_seconds=10.0, client_rate_per_minute=0,
+                 client_burst=10, global_rate_per_minute=0, global_burst=60, retry_after_seconds=5, max_clients=10000,
+                 buckets=None):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max_queue
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self.client_rate_per_second = client_rate_per_minute / 60.0
+        self.client_burst = client_burst
+        self.global_rate_per_second = global_rate_per_minute / 60.0
+        self.global_burst = global_burst
+        self.retry_after_seconds = retry_after_seconds
+        self.buckets = buckets or LocalTokenBuckets(max_keys=max_clients + 1)
+        self.active = 0
+        self.waiting = 0
+        self._condition = threading.Condition()
+
+    def _reject(self, reason, retry_after_seconds=None):
+        ADMISSIONS.inc(outcome=f"rejected_{reason}")
+        raise AdmissionRejected(reason, max(1, math.ceil(retry_after_seconds or self.retry_after_seconds)))
+
+    def _check_capacity(self, deadline):
+        """Rejects if no slot is free and the queue is full or the deadline has passed. Call with the condition held."""
+        if self.active < self.max_concurrent:
+            return
+        if self.waiting >= self.max_queue:
+            self._reject("queue_full")
+        if deadline <= time.monotonic():
+            self._reject("deadline")
+
+    def _rate_limits(self, client):
+        limits = []
+        if client is not None and self.client_rate_per_second:
+            limits.append(("client_rate", f"client:{client}", self.client_rate_per_second, self.client_burst))
+        if self.global_rate_per_second:
+            limits.append(("global_rate", "global", self.global_rate_per_second, self.global_burst))
+        return limits
+
+    def _take_tokens(self, limits):
+        """Takes a token from every bucket in limits, or raises. Call without the condition held: shared buckets do I/O."""
+        if limits and (rejection := self.buckets.take(limits)) is not None:
+            self._reject(*rejection)
+
+    def _enter(self, deadline):
+        """
+        Admits immediately (True), queues (False, with self.waiting incremented) or raises.
+        Call with the condition held.
+        """
+        self._check_capacity(deadline)
+        if self.active < self.max_concurrent:
+            self.active += 1
+            ADMISSIONS.inc(outcome="admitted")
+            return True
+        self.waiting += 1
+        return False
+
+    def acquire(self, client=None, deadline=None):
+        """
+        Blocks until a generation slot is free. deadline is a time.monotonic() value (default:
+        now + queue timeout), or math.inf to wait as long as it takes.
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.queue_timeout_seconds
+        with self._condition:
+            self._check_capacity(deadline) # Shed before spending rate-limit tokens
+        self._take_tokens(self._rate_limits(client))
+        with self._condition:
+            if self._enter(deadline):
+                return
+            try:
+                while self.active >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._reject("deadline")
+                    self._condition.wait(None if remaining == math.inf else remaining)
+                self.active += 1
+                ADMISSIONS.inc(outcome="admitted_after_wait")
+            finally:
+                self.waiting -= 1
+
+    async def async_acquire(self, client=None, deadline=None, poll_interval=0.05):
+        """Like acquire, but waits on the event loop (polling, like app.py's async single-flight lock)."""
+        if deadline is None:
+            deadline = time.monotonic() + self.queue_timeout_seconds
+        with self._condition:
+            self._check_capacity(deadline)
+        limits = self._rate_limits(client)
+        if limits:
+            await asyncio.to_thread(self._take_tokens, limits)
+        with self._condition:
+            if self._enter(deadline):
+                return
+        try:
+            while True:
+                with self._condition:
+                    if self.active < self.max_concurrent:
+                        self.active += 1
+                        ADMISSIONS.inc(outcome="admitted_after_wait")
+                        return
+                    if time.monotonic() >= deadline:
+                        self._reject("deadline")
+                await asyncio.sleep(poll_interval)
+        finally:
+            with self._condition:
+                self.waiting -= 1
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+    @contextmanager
+    def admit(self, client=None, deadline=None):
+        self.acquire(client, deadline)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def async_admit(self, client=None, deadline=None):
+        await self.async_acquire(client, deadline)
+        try:
+            yield
+        finally:
+            self.release()
@@ -1,29 +1,47 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context, g, has_request_context
+from werkzeug.exceptions import HTTPException
 import subprocess
 import os
 import sys
 import re
+import math
+import html
+import hmac
 import json # Required if page.py direct call output needs parsing, though not for current plan
+import time
+import threading
+from contextlib import contextmanager
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl # POSIX advisory locks, shared across gunicorn worker processes
+except ImportError:
+    fcntl = None # e.g. Windows: single-flight falls back to per-process locking
 
 # Import the function directly from page.py
-from page import generate_llm_content, generate_content_from_ai_search
+from page import generate_llm_content, generate_content_from_ai_search, stream_llm_content, report_main_content, extract_internal_links
+from page import LLM_MODEL, canonical_page_path, content_fingerprint, ai_search_fingerprint
+from page_cache import PageCache
+from html_pipeline import ContentPipeline, clean_html
+from cache_store import FileCacheStore, SQLiteCacheStore, copy_entries
+from shared_cache import SharedCacheClient, SharedCacheStore, SharedLog, SharedTokenBuckets
+from index_template import CompiledTemplate
+from menu_index import MenuIndex
+from search_index import SearchIndex, query_key
+from prefetch import Prefetcher
+from admission import AdmissionController, AdmissionRejected, SQLiteTokenBuckets
+from http_cache import CompressedBodyCache, cached_response, make_etag
+from metrics import Gauge, CACHE_LOOKUPS, HTTP_REQUEST_SECONDS, SEARCH_DEDUP, span, render_metrics
+from site_config import config # Loaded and validated once per process, shared with page.py
 
 # --- CONFIGURATION LOADING --- START ---
-CONFIG_FILE_PATH = os.path.join(os.path.dirname(__file__), 'config.json')
-config = {}
-try:
-    with open(CONFIG_FILE_PATH, 'r') as f:
-        config = json.load(f)
-except FileNotFoundError:
-    print(f"app.py Warning: {CONFIG_FILE_PATH} not found. Using empty config.", file=sys.stderr)
-except json.JSONDecodeError as e:
-    print(f"app.py Error decoding {CONFIG_FILE_PATH}: {e}. Using empty config.", file=sys.stderr)
-except Exception as e:
-    print(f"app.py An unexpected error occurred loading {CONFIG_FILE_PATH}: {e}. Using empty config.", file=sys.stderr)
-
 APP_CONFIG = {
     "company_name": config.get("website_profile", {}).get("company_name", "Web App"),
-    "base_url": config.get("base_url", "")
+    "base_url": config.get("base_url", ""),
+    # When enabled, SSR does not block on generating uncached pages; the browser streams them from /stream_page_data.
+    # Off by default: clients that don't run JavaScript (crawlers) would only ever get the loading shell.
+    "stream_page_data": config.get("stream_page_data", False)
 }
 # --- CONFIGURATION LOADING --- END ---
 
@@ -39,11 +57,126 @@ SKIPPED_PATHS = [
 ]
 
 # Cache directory for LLM-generated content snippets
-CONTENT_CACHE_DIR = os.path.join(os.path.dirname(__file__), 'cache')
+CONTENT_CACHE_DIR = os.environ.get("CONTENT_CACHE_DIR") or os.path.join(os.path.dirname(__file__), 'cache') # Overridable so benchmarks never touch the real cache
 if not os.path.exists(CONTENT_CACHE_DIR):
     os.makedirs(CONTENT_CACHE_DIR)
     print(f"Created content cache directory: {CONTENT_CACHE_DIR}", file=sys.stderr)
 
+# Lock files used to coalesce concurrent cache misses for the same path (see single_flight_lock)
+SINGLE_FLIGHT_LOCK_DIR = os.path.join(CONTENT_CACHE_DIR, '.locks')
+os.makedirs(SINGLE_FLIGHT_LOCK_DIR, exist_ok=True)
+# How long a request waits for another worker's generation before giving up and generating itself
+SINGLE_FLIGHT_WAIT_SECONDS = config.get("single_flight_wait_seconds", 120)
+SINGLE_FLIGHT_POLL_INTERVAL = 0.05
+
+# Superseded generations are kept here, keyed by fingerprint, so a config rollback is instant
+CACHE_GENERATIONS_DIR = os.path.join(CONTENT_CACHE_DIR, '.generations')
+KEEP_GENERATIONS = config.get("keep_generations", True)
+
+# Freshness policy: pages older than their TTL (0 = never expire) are served stale while a
+# background worker regenerates them. page_ttl_seconds maps path prefixes to per-page TTLs.
+CACHE_TTL_SECONDS = config.get("cache_ttl_seconds", 0)
+PAGE_TTL_SECONDS = sorted(config.get("page_ttl_seconds", {}).items(), key=lambda item: len(item[0]), reverse=True)
+STALE_WHILE_REVALIDATE = config.get("stale_while_revalidate", True)
+REFRESH_RETRY_SECONDS = config.get("refresh_retry_seconds", 300) # Back-off after a failed background refresh
+REFRESH_EXECUTOR = ThreadPoolExecutor(max_workers=config.get("refresh_workers", 2), thread_name_prefix="refresh")
+
+# Shared cache tier (see shared_cache.py): when set, every node reads and writes pages, the menu
+# index and past AI searches through one server, so a page is generated once for the whole fleet
+SHARED_CACHE_URL = os.environ.get("SHARED_CACHE_URL") or config.get("shared_cache_url")
+SHARED_CACHE_REVALIDATE_SECONDS = config.get("shared_cache_revalidate_seconds", 2)
+SHARED_CACHE_CLIENT = SharedCacheClient(SHARED_CACHE_URL, timeout=config.get("shared_cache_timeout_seconds", 2)) if SHARED_CACHE_URL else None
+
+def shared_log(name):
+    """The named log on the shared cache server, or None to keep it in CONTENT_CACHE_DIR."""
+    return SharedLog(SHARED_CACHE_CLIENT, name, SHARED_CACHE_REVALIDATE_SECONDS) if SHARED_CACHE_CLIENT else None
+
+# Where generated snippets are stored: a file per page in CONTENT_CACHE_DIR or one SQLite file, behind
+# the shared cache if there is one (the local store then keeps pages generated while it is unreachable)
+if config.get("cache_store", "files") == "sqlite":
+    CACHE_STORE = SQLiteCacheStore(config.get("cache_sqlite_path") or os.path.join(CONTENT_CACHE_DIR, 'cache.sqlite3'))
+    if CACHE_STORE.is_empty(): # First run: bring over pages already cached as files
+        copied = copy_entries(FileCacheStore(CONTENT_CACHE_DIR, CACHE_GENERATIONS_DIR), CACHE_STORE)
+        print(f"app.py Imported {copied} cached pages from {CONTENT_CACHE_DIR} into {CACHE_STORE.db_path}.", file=sys.stderr)
+else:
+    CACHE_STORE = FileCacheStore(CONTENT_CACHE_DIR, CACHE_GENERATIONS_DIR)
+if SHARED_CACHE_CLIENT:
+    CACHE_STORE = SharedCacheStore(SHARED_CACHE_CLIENT, revalidate_seconds=SHARED_CACHE_REVALIDATE_SECONDS, fallback=CACHE_STORE)
+
+# Admission control for LLM generations (see admission.py): a per-process concurrency cap with a
+# bounded wait queue, plus optional per-client and global rate limits. Shed requests get BUSY_HTML.
+# The rate limits hold for the whole site: their buckets are shared by this node's workers through
+# SQLite in CONTENT_CACHE_DIR, and by every node through the shared cache server if there is one.
+GENERATION_CLIENT_RATE_PER_MINUTE = config.get("generation_client_rate_per_minute", 0)
+GENERATION_GLOBAL_RATE_PER_MINUTE = config.get("generation_global_rate_per_minute", 0)
+RATE_LIMIT_BUCKETS = None
+if GENERATION_CLIENT_RATE_PER_MINUTE or GENERATION_GLOBAL_RATE_PER_MINUTE:
+    RATE_LIMIT_BUCKETS = SQLiteTokenBuckets(os.path.join(CONTENT_CACHE_DIR, '.admission_buckets.sqlite3'))
+    if SHARED_CACHE_CLIENT:
+        RATE_LIMIT_BUCKETS = SharedTokenBuckets(SHARED_CACHE_CLIENT, fallback=RATE_LIMIT_BUCKETS)
+ADMISSION = AdmissionController(
+    max_concurrent=config.get("generation_max_concurrent", 8),
+    max_queue=config.get("generation_queue_size", 32),
+    queue_timeout_seconds=config.get("generation_queue_timeout_seconds", 10),
+    client_rate_per_minute=GENERATION_CLIENT_RATE_PER_MINUTE,
+    client_burst=config.get("generation_client_burst", 10),
+    global_rate_per_minute=GENERATION_GLOBAL_RATE_PER_MINUTE,
+    global_burst=config.get("generation_global_burst", 60),
+    retry_after_seconds=config.get("generation_retry_after_seconds", 5),
+    buckets=RATE_LIMIT_BUCKETS)
+TRUST_FORWARDED_FOR = config.get("trust_forwarded_for", False) # Only behind a proxy that sets X-Forwarded-For
+
+# In-memory LRU of post-processed snippets in front of CACHE_STORE, revalidated by its entry signature
+PAGE_CACHE = PageCache(max_bytes=config.get("page_cache_max_bytes", 32 * 1024 * 1024))
+
+# index.html is compiled once into static segments plus slots; config-derived values are folded in up front
+INDEX_HTML_PATH = os.path.join(os.path.dirname(__file__), 'index.html')
+INDEX_TEMPLATE = CompiledTemplate(
+    INDEX_HTML_PATH,
+    markers={
+        "{{INITIAL_PAGE_TITLE}}": "page_title",
+        "{{COMPANY_NAME_H1}}": "company_name",
+        "{{COMPANY_NAME_FOOTER}}": "company_name",
+        "{{SITE_CONFIG_JSON}}": "site_config_json",
+        "<!-- MAIN_CONTENT_SSR -->\n            <p>Loading page content...</p> <!-- This will be overwritten by SSR or client-side JS -->": "main_content"
+    },
+    constants={
+        "company_name": APP_CONFIG.get("company_name", "Web App"),
+        "site_config_json": json.dumps({"companyName": APP_CONFIG.get("company_name", "Web App")})
+    }
+)
+try:
+    INDEX_TEMPLATE.compile()
+except Exception as e:
+    print(f"app.py Error compiling index.html template at startup: {e}. Will retry on first request.", file=sys.stderr)
+
+# HTTP caching: validators on every cacheable response, compressed variants built once per version
+HTTP_CACHE_CONTROL = "public, max-age={}, stale-while-revalidate={}".format(
+    config.get("http_cache_max_age", 60), config.get("http_stale_while_revalidate", 600))
+COMPRESSED_BODIES = CompressedBodyCache(max_bytes=config.get("compressed_cache_max_bytes", 16 * 1024 * 1024))
+
+# AI search dedup: repeat searches reuse the page already generated. Near-duplicate matching is opt-in:
+# word and trigram similarity can't tell "not installation" from "installation", so it misroutes some queries
+AI_SEARCH_DEDUP = config.get("ai_search_dedup", True)
+AI_SEARCH_SIMILARITY_THRESHOLD = config.get("ai_search_similarity_threshold", 0) # 0 matches exact repeats only
+
+# Prometheus-style metrics, summed over all gunicorn workers (see metrics.py), served at /metrics when enabled. They include
+# LLM spend and traffic, so scrapers must send metrics_token as a bearer token; without one, only
+# direct (unproxied) requests from this host are answered.
+METRICS_ENDPOINT = config.get("metrics_endpoint", False)
+METRICS_TOKEN = config.get("metrics_token")
+Gauge("site_page_cache_bytes", "Bytes held by the in-memory page cache.", lambda: PAGE_CACHE.stats()["bytes"])
+Gauge("site_page_cache_entries", "Entries held by the in-memory page cache.", lambda: PAGE_CACHE.stats()["entries"])
+Gauge("site_compressed_bodies_bytes", "Bytes held by the compressed response body cache.", lambda: COMPRESSED_BODIES.current_bytes)
+Gauge("site_generations_active", "LLM generations currently admitted.", lambda: ADMISSION.active)
+Gauge("site_generations_waiting", "Requests queued for an LLM generation slot.", lambda: ADMISSION.waiting)
+
+# Shown in place of main content when SSR leaves an uncached page to be streamed by the client
+STREAMING_PLACEHOLDER_HTML = '<p class="loading-text">Loading page content...</p>'
+# Shown instead of waiting when a generation is shed by admission control
+BUSY_HTML = ('<h2>This page is on its way</h2>'
+             '<p class="info-text">We are writing a lot of pages right now. Please try again in a few seconds.</p>')
+
 # Determine the correct python interpreter path for the venv
 # This assumes app.py is in the project root alongside the venv directory
 VENV_PYTHON = os.path.join(os.path.dirname(__file__), 'venv', 'bin', 'python')
@@ -54,6 +187,10 @@ if not os.path.exists(VENV_PYTHON):
     VENV_PYTHON = 'python' # Fallback to just 'python', hoping it's the venv one or PATH is set
     print(f"Warning: venv python interpreter not found at default location. Falling back to '{VENV_PYTHON}'. Ensure it's the correct one.", file=sys.stderr)
 
+def normalize_path(path_param):
+    """Normalizes a request path to '/' or '/segment/...' without a trailing slash."""
+    return ('/' + path_param.strip('/')) if path_param and path_param != '/' else '/'
+
 def sanitize_path_to_filename(path):
     """Converts a URL path to a safe filename."""
     if not path or path == '/':
@@ -70,54 +207,563 @@ def sanitize_path_to_cache_filename(path_str):
         filename_base = 'index'
     else:
         filename_base = path_str.strip('/').replace('/', '_')
-    filename_base = re.sub(r'[^a-zA-Z0-9_\-]', '', filename_base)
+    filename_base = re.sub(r'[^a-zA-Z0-9_\-]', '', filename_base) or 'index' # e.g. '/.' is the homepage, as canonical_page_path has it
     return f"{filename_base}_content.html"
 
+def client_address(remote_addr, forwarded_for=None):
+    """The address per-client rate limits apply to: the first X-Forwarded-For hop if trusted, else the peer."""
+    if TRUST_FORWARDED_FOR and forwarded_for:
+        return forwarded_for.split(',')[0].strip()
+    return remote_addr
+
+def generation_deadline():
+    """
+    When the current request stops queueing for a generation slot: generation_queue_timeout_seconds
+    after it arrived (the ASGI server may pass an earlier one). Outside a request (background
+    refreshes, warm_cache.py) there is no visitor waiting, so generations queue until a slot frees.
+    """
+    if not has_request_context():
+        return math.inf
+    if "site.generation_deadline" in request.environ:
+        return request.environ["site.generation_deadline"]
+    waited_seconds = time.perf_counter() - g.request_start if "request_start" in g else 0.0
+    return time.monotonic() + ADMISSION.queue_timeout_seconds - waited_seconds
+
+class GenerationAlreadyAttempted(Exception):
+    """The async serving mode already tried to generate this request's page and got nothing."""
+
+@contextmanager
+def admitted_generation(wait=True):
+    """
+    Holds an admission slot around one LLM generation; raises AdmissionRejected when shed.
+    Under asgi_app.py, a request whose generation was already attempted on the event loop
+    ("site.generation_attempt" in environ) is not generated again here.
+    """
+    if has_request_context() and "site.generation_attempt" in request.environ:
+        attempt = request.environ["site.generation_attempt"]
+        if isinstance(attempt, AdmissionRejected):
+            raise attempt
+        raise GenerationAlreadyAttempted("The async server already tried to generate this page.")
+    client = client_address(request.remote_addr, request.headers.get("X-Forwarded-For")) if has_request_context() else None
+    with ADMISSION.admit(client, generation_deadline() if wait else time.monotonic()):
+        yield
+
+def busy_headers(rejection):
+    return {"Cache-Control": "no-store", "Retry-After": str(rejection.retry_after_seconds)}
+
+_process_flight_locks = {} # cache_filename -> [lock, number of callers using it]
+_process_flight_locks_guard = threading.Lock()
+
+@contextmanager
+def single_flight_lock(cache_filename, wait_seconds=None):
+    """
+    Holds an exclusive lock for one cache entry while its content is generated.
+    Yields True if the lock was acquired, or False if waiting timed out.
+    wait_seconds=0 only tries once, for callers that have something better to do than wait.
+    """
+    if wait_seconds is None:
+        wait_seconds = SINGLE_FLIGHT_WAIT_SECONDS
+    if fcntl is None:
+        with _process_flight_locks_guard:
+            entry = _process_flight_locks.setdefault(cache_filename, [threading.Lock(), 0])
+            entry[1] += 1
+        lock = entry[0]
+        acquired = lock.acquire(blocking=wait_seconds > 0, timeout=wait_seconds if wait_seconds > 0 else -1)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                lock.release()
+            with _process_flight_locks_guard: # Forget the lock once nobody uses it, so crawled paths don't pile up
+                entry[1] -= 1
+                if not entry[1]:
+                    del _process_flight_locks[cache_filename]
+        return
+
+    lock_path = single_flight_lock_path(cache_filename)
+    deadline = time.monotonic() + wait_seconds
+    while (lock_file := try_lock_file(lock_path)) is None and time.monotonic() < deadline:
+        time.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+    try:
+        yield lock_file is not None
+    finally:
+        if lock_file is not None:
+            release_lock_file(lock_file, lock_path)
+
+def single_flight_lock_path(cache_filename):
+    return os.path.join(SINGLE_FLIGHT_LOCK_DIR, cache_filename + '.lock')
+
+def try_flock(lock_file):
+    """Takes an exclusive flock on an open file without blocking. Returns whether it was acquired."""
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+# Lock files are removed when released, or cache/.locks would keep one per path or query ever
+# missed. flock locks belong to the open file description, so every caller opens its own handle,
+# and the kernel drops the lock if the holder dies, so a crashed worker never wedges a path.
+def try_lock_file(lock_path):
+    """
+    Opens and flocks lock_path without blocking. Returns the open, locked file, or None if
+    another process holds the lock.
+    """
+    while True:
+        lock_file = open(lock_path, 'a')
+        if not try_flock(lock_file):
+            lock_file.close()
+            return None
+        try:
+            if os.path.samestat(os.fstat(lock_file.fileno()), os.stat(lock_path)):
+                return lock_file
+        except FileNotFoundError:
+            pass
+        # The previous holder removed this file between our open and flock; lock its replacement
+        lock_file.close()
+
+def release_lock_file(lock_file, lock_path):
+    """Removes the lock file while still holding it, so later callers create a fresh one, then unlocks it."""
+    try:
+        os.unlink(lock_path)
+    except FileNotFoundError:
+        pass
+    finally:
+        lock_file.close()
+
+def apply_site_placeholders(normalized_path, content):
+    """Substitutes site-wide placeholders into a content snippet."""
+    if normalized_path == '/': # Only the index page content uses {{SITE_BASE_URL}}
+        content = content.replace("{{SITE_BASE_URL}}", APP_CONFIG.get("base_url", ""))
+    return content
+
+def is_cache_entry_current(normalized_path, metadata):
+    """
+    True if an entry was generated under the current model, prompt and website profile. It is
+    checked against the path it was generated for, which differs from normalized_path when
+    several paths share a cache file (e.g. /a/b and /a_b).
+    """
+    if metadata is None:
+        return True # Legacy entry written before metadata existed; keep serving it
+    if metadata.get("source") == "ai_search" and metadata.get("query"):
+        expected_fingerprint = ai_search_fingerprint(metadata["query"])
+    else:
+        expected_fingerprint = content_fingerprint(metadata.get("path", normalized_path))
+    return metadata.get("fingerprint") == expected_fingerprint
+
+# A cache entry as held in PAGE_CACHE: post-processed content plus what HTTP validators need
+CachedPage = namedtuple('CachedPage', ['content', 'metadata', 'digest', 'last_modified'])
+
+def load_cached_page(normalized_path, cache_content_filename):
+    """PageCache loader: returns (CachedPage, size_bytes), or (None, 0) if the entry is missing or corrupt."""
+    stored_entry = CACHE_STORE.read(cache_content_filename)
+    if stored_entry is None:
+        return None, 0
+    content = apply_site_placeholders(normalized_path, stored_entry.content)
+    metadata = stored_entry.metadata
+    last_modified = metadata.get("generated_at", stored_entry.stored_at) if metadata else stored_entry.stored_at
+    return CachedPage(content, metadata, make_etag(content), last_modified), len(content.encode('utf-8'))
+
+def get_cached_page(normalized_path, revalidate=False):
+    """
+    Returns the CachedPage for a path through PAGE_CACHE (one signature check when already in memory), or None.
+    revalidate skips any signature the store memoized, e.g. to see a page another process just wrote.
+    """
+    return PAGE_CACHE.get(normalized_path, sanitize_path_to_cache_filename(normalized_path),
+                          load=lambda cache_content_filename: load_cached_page(normalized_path, cache_content_filename),
+                          signature=lambda cache_content_filename: CACHE_STORE.signature(cache_content_filename, revalidate))
+
+def peek_cached_page(normalized_path, revalidate=False):
+    """Like get_cached_page, but returns None instead of raising on read errors."""
+    try:
+        return get_cached_page(normalized_path, revalidate)
+    except Exception:
+        return None
+
+def content_validators(normalized_path, content):
+    """Returns (digest, last_modified) for served content, reusing the cached entry's precomputed digest."""
+    cached_page = peek_cached_page(normalized_path)
+    if cached_page is not None and cached_page.content == content:
+        return cached_page.digest, cached_page.last_modified
+    return make_etag(content), None
+
+def ttl_for_path(normalized_path):
+    """Returns the TTL in seconds for a path (longest matching page_ttl_seconds prefix, else cache_ttl_seconds)."""
+    for prefix, ttl_seconds in PAGE_TTL_SECONDS:
+        prefix = normalize_path(prefix)
+        if normalized_path == prefix or normalized_path.startswith(prefix.rstrip('/') + '/'):
+            return ttl_seconds
+    return CACHE_TTL_SECONDS
+
+def is_cache_entry_expired(normalized_path, metadata):
+    if not metadata or "generated_at" not in metadata:
+        return False # Legacy entries have no generation time and never expire
+    ttl_seconds = ttl_for_path(normalized_path)
+    return bool(ttl_seconds) and time.time() - metadata["generated_at"] > ttl_seconds
+
+def lookup_cached_page(normalized_path, log_prefix="app.py", revalidate=False):
+    """
+    Returns (content, is_fresh) for a path. content is "" on a miss or read error. An entry is
+    fresh if it was generated under the current config and has not outlived its TTL.
+    """
+    with span("cache_lookup"):
+        try:
+            cached_page = get_cached_page(normalized_path, revalidate)
+        except Exception as e:
+            CACHE_LOOKUPS.inc(result="error")
+            cached_page = PAGE_CACHE.peek(normalized_path)
+            if cached_page is not None: # A store outage is not a reason to pay for the page again
+                print(f"{log_prefix} Error reading content cache for '{normalized_path}': {e}. Serving the copy in memory.", file=sys.stderr)
+                return cached_page.content, True
+            print(f"{log_prefix} Error reading content cache for '{normalized_path}': {e}. Will try to regenerate.", file=sys.stderr)
+            return "", False
+        if cached_page is None:
+            CACHE_LOOKUPS.inc(result="miss")
+            return "", False
+        metadata = cached_page.metadata
+        is_fresh = is_cache_entry_current(normalized_path, metadata) and not is_cache_entry_expired(normalized_path, metadata)
+    CACHE_LOOKUPS.inc(result="hit" if is_fresh else "stale")
+    return cached_page.content, is_fresh
+
+def read_cached_content(normalized_path, log_prefix="app.py", revalidate=False):
+    """
+    Returns the cached snippet for a path with placeholders applied, or "" on a miss or read error.
+    Stale entries (expired, or generated under a different model/prompt/profile) are returned
+    immediately while a background refresh is scheduled; with stale_while_revalidate off they
+    count as misses. Pass revalidate=True after waiting on a single-flight lock, so a page
+    another process generated meanwhile is seen even through a memoizing (shared) store.
+    """
+    content, is_fresh = lookup_cached_page(normalized_path, log_prefix, revalidate)
+    if is_fresh or not content.strip():
+        return content
+    if STALE_WHILE_REVALIDATE:
+        schedule_background_refresh(normalized_path)
+        return content
+    return ""
+
+_refreshing_paths = set()
+_refresh_retry_after = {}
+_refresh_guard = threading.Lock()
+
+def schedule_background_refresh(normalized_path):
+    """Queues a stale page for regeneration, at most once at a time per path in this process."""
+    now = time.monotonic()
+    with _refresh_guard:
+        if normalized_path in _refreshing_paths or _refresh_retry_after.get(normalized_path, 0) > now:
+            return
+        _refreshing_paths.add(normalized_path)
+    REFRESH_EXECUTOR.submit(refresh_cached_page, normalized_path)
+
+def refresh_cached_page(normalized_path, wait_seconds=0, log_prefix="app.py (Refresh)"):
+    """
+    Regenerates a stale page through generate_llm_content. If generation fails the stale copy
+    stays in place (and keeps being served) and the path is not retried for a while.
+    Returns True if the page is fresh afterwards.
+    """
+    try:
+        with single_flight_lock(sanitize_path_to_cache_filename(normalized_path), wait_seconds=wait_seconds) as acquired:
+            if not acquired:
+                return False # Another worker is already regenerating this page
+            cached_page = peek_cached_page(normalized_path, revalidate=True)
+            metadata = cached_page.metadata if cached_page is not None else None
+            is_current = cached_page is not None and is_cache_entry_current(normalized_path, metadata)
+            if is_current and not is_cache_entry_expired(normalized_path, metadata):
+                return True
+            # An archived generation can only stand in for one made under a different config, not an expired one
+            if not is_current and restore_archived_generation(normalized_path, log_prefix):
+                return True
+            with admitted_generation():
+                new_content = apply_site_placeholders(normalized_path, generate_llm_content(normalized_path))
+            if not new_content.strip():
+                print(f"{log_prefix} Regeneration of '{normalized_path}' returned no content. Keeping the stale copy.", file=sys.stderr)
+                with _refresh_guard:
+                    _refresh_retry_after[normalized_path] = time.monotonic() + REFRESH_RETRY_SECONDS
+                return False
+            save_content_to_cache(normalized_path, new_content)
+            with _refresh_guard:
+                _refresh_retry_after.pop(normalized_path, None)
+            return True
+    except Exception as e:
+        print(f"{log_prefix} Error refreshing '{normalized_path}': {e}. Keeping the stale copy.", file=sys.stderr)
+        with _refresh_guard:
+            _refresh_retry_after[normalized_path] = time.monotonic() + REFRESH_RETRY_SECONDS
+        return False
+    finally:
+        with _refresh_guard:
+            _refreshing_paths.discard(normalized_path)
+
+def save_content_to_cache(normalized_path, content, metadata=None, outline=None):
+    """
+    Atomically writes a generated snippet with its metadata and registers its canonical path
+    in the menu index. metadata defaults to a page generated from the path's own prompt. outline is
+    the (title, links) a ContentPipeline recorded while cleaning the content; without it they
+    are parsed from content. Both are kept in the metadata for page_title_for and page_links.
+    """
+    cache_content_filename = sanitize_path_to_cache_filename(normalized_path)
+    if outline is None and not (metadata and "links" in metadata):
+        pipeline = clean_html(content)
+        outline = (pipeline.title, pipeline.links)
+    normalized_path = canonical_page_path(normalized_path)
+    metadata = {
+        "path": normalized_path,
+        "source": "page",
+        "model": LLM_MODEL,
+        "generated_at": time.time(),
+        **({"title": outline[0], "links": outline[1]} if outline is not None else {}),
+        **(metadata or {"fingerprint": content_fingerprint(normalized_path)})
+    }
+    if KEEP_GENERATIONS:
+        CACHE_STORE.archive(cache_content_filename, metadata["fingerprint"])
+    CACHE_STORE.write(cache_content_filename, content, metadata)
+    MENU_INDEX.add(cache_content_filename, normalized_path)
+
+def restore_archived_generation(normalized_path, log_prefix="app.py"):
+    """
+    If an unexpired generation matching the current config was archived (e.g. the config was
+    rolled back), puts it back in place and returns its content. Returns "" if there is none.
+    """
+    if not KEEP_GENERATIONS:
+        return ""
+    try:
+        archived_entry = CACHE_STORE.read_archived(sanitize_path_to_cache_filename(normalized_path), content_fingerprint(normalized_path))
+        if archived_entry is None or is_cache_entry_expired(normalized_path, archived_entry.metadata):
+            return ""
+        save_content_to_cache(normalized_path, archived_entry.content, metadata=archived_entry.metadata)
+    except Exception as e:
+        print(f"{log_prefix} Error restoring archived generation for '{normalized_path}': {e}", file=sys.stderr)
+        return ""
+    print(f"{log_prefix} Restored archived generation {archived_entry.metadata.get('fingerprint')} for '{normalized_path}'.", file=sys.stderr)
+    return apply_site_placeholders(normalized_path, archived_entry.content)
+
+def get_or_generate_content(normalized_path, log_prefix="app.py"):
+    """
+    Returns the content snippet for a path, generating and caching it on a miss.
+    Concurrent misses for the same path are coalesced: the first request calls the LLM
+    while the others wait on its lock and then read the freshly cached result.
+    Raises AdmissionRejected if the generation is shed.
+    """
+    main_html_content = read_cached_content(normalized_path, log_prefix)
+    if main_html_content.strip():
+        return main_html_content
+
+    with single_flight_lock(sanitize_path_to_cache_filename(normalized_path)) as acquired:
+        if acquired:
+            # Another worker may have generated the page while we were waiting for the lock
+            main_html_content = read_cached_content(normalized_path, log_prefix, revalidate=True) or restore_archived_generation(normalized_path, log_prefix)
+            if main_html_content.strip():
+                return main_html_content
+        else:
+            print(f"{log_prefix} Timed out waiting for in-flight generation of '{normalized_path}'. Generating independently.", file=sys.stderr)
+
+        try:
+            with admitted_generation():
+                main_html_content = generate_llm_content(normalized_path)
+            # If index page is regenerated by LLM, it should use {{SITE_BASE_URL}} as per updated prompt
+            # So, if it's the index page, replace placeholder after generation
+            main_html_content = apply_site_placeholders(normalized_path, main_html_content)
+        except AdmissionRejected:
+            raise # Callers answer with BUSY_HTML
+        except GenerationAlreadyAttempted:
+            return "" # asgi_app.py already reported the failure
+        except Exception as e:
+            print(f"{log_prefix} Exception calling generate_llm_content for '{normalized_path}': {e}", file=sys.stderr)
+            return "" # Empty on error
+
+        if not main_html_content.strip():
+            return "" # Explicitly set to empty if LLM returns nothing
+
+        try:
+            save_content_to_cache(normalized_path, main_html_content)
+        except Exception as e:
+            print(f"{log_prefix} Error writing content to cache for '{normalized_path}': {e}", file=sys.stderr)
+    return main_html_content
+
+def format_sse_event(event_name, payload):
+    """Formats one server-sent event with a JSON payload."""
+    return f"event: {event_name}\ndata: {json.dumps(payload)}\n\n"
+
+def cleaned_chunk_event(pipeline, delta):
+    """
+    Feeds a streamed delta through the page's ContentPipeline and returns the 'chunk' event
+    for the sanitized HTML it completed, or None if there is none yet. The event carries
+    "replace": true when the HTML replaces what was sent so far (the <main> of a full page began).
+    """
+    chunk_html = pipeline.feed(delta)
+    if pipeline.replaced:
+        return format_sse_event("chunk", {"html": chunk_html, "replace": True})
+    return format_sse_event("chunk", {"html": chunk_html}) if chunk_html else None
+
+def stream_page_events(normalized_path, log_prefix="app.py (Stream)"):
+    """
+    Yields server-sent events for a page: on a cache miss, a 'chunk' event with the sanitized
+    HTML of each generated token batch, then a single 'done' event with the cleaned content and the menu.
+    The cleaned content is written to the cache once the stream ends.
+    """
+    main_html_content = read_cached_content(normalized_path, log_prefix)
+    busy = False
+    if not main_html_content.strip():
+        with single_flight_lock(sanitize_path_to_cache_filename(normalized_path), wait_seconds=0) as acquired:
+            if acquired:
+                main_html_content = read_cached_content(normalized_path, log_prefix, revalidate=True) or restore_archived_generation(normalized_path, log_prefix)
+                if not main_html_content.strip():
+                    pipeline = ContentPipeline()
+                    try:
+                        with admitted_generation():
+                            for delta in stream_llm_content(normalized_path):
+                                chunk_event = cleaned_chunk_event(pipeline, delta)
+                                if chunk_event:
+                                    yield chunk_event
+                        pipeline.close()
+                    except AdmissionRejected:
+                        busy, pipeline = True, None
+                    except Exception as e:
+                        print(f"{log_prefix} Error streaming content for '{normalized_path}': {e}", file=sys.stderr)
+                        pipeline = None
+                    main_html_content = apply_site_placeholders(normalized_path, report_main_content(pipeline, normalized_path)) if pipeline else ""
+                    if main_html_content.strip():
+                        try:
+                            save_content_to_cache(normalized_path, main_html_content, outline=(pipeline.title, pipeline.links))
+                        except Exception as e:
+                            print(f"{log_prefix} Error writing content to cache for '{normalized_path}': {e}", file=sys.stderr)
+        if not acquired:
+            # Another worker is already generating this path; wait for its result instead of paying twice
+            try:
+                main_html_content = get_or_generate_content(normalized_path, log_prefix)
+            except AdmissionRejected:
+                busy = True
+
+    if busy:
+        main_html_content = BUSY_HTML
+    else:
+        prefetch_linked_pages(normalized_path, main_html_content)
+    yield format_sse_event("done", {
+        "main_content_html": main_html_content.strip(),
+        "menu_items": get_menu_items_from_cache(normalized_path)
+    })
+
 def path_to_display_name(path_str):
     """Converts a path to a human-readable name for the menu."""
     if not path_str or path_str == '/':
         return "Home"
     return path_str.strip('/').replace('_', ' ').replace('-',' ').title()
 
+# Persistent menu index, appended to whenever a page is written to the cache
+MENU_INDEX = MenuIndex(CONTENT_CACHE_DIR, display_name=path_to_display_name, list_files=CACHE_STORE.filenames,
+                       log=shared_log("menu_index"))
+
+# Past AI searches and the pages that answered them; cached pages are matched by their menu name
+SEARCH_INDEX = SearchIndex(CONTENT_CACHE_DIR, page_text=path_to_display_name, similarity_threshold=AI_SEARCH_SIMILARITY_THRESHOLD,
+                           log=shared_log("search_index"))
+
+def warm_process_caches():
+    """
+    Loads the menu and search indexes and as many cached pages as fit in PAGE_CACHE into memory.
+    Run in the gunicorn master before it forks (see gunicorn.conf.py), so every worker starts
+    warm and shares those pages copy-on-write. Returns the number of pages loaded.
+    """
+    cached_paths = MENU_INDEX.paths()
+    loaded = 0
+    for cached_path in cached_paths:
+        if PAGE_CACHE.stats()["bytes"] >= PAGE_CACHE.max_bytes:
+            break
+        if peek_cached_page(cached_path) is not None:
+            loaded += 1
+    if AI_SEARCH_DEDUP:
+        SEARCH_INDEX.warm(cached_paths)
+    return loaded
+
+def page_links(normalized_path, content):
+    """The internal links of a page: recorded in its metadata when it was saved, else parsed from content."""
+    cached_page = peek_cached_page(normalized_path)
+    if cached_page is not None and cached_page.content == content and "links" in (cached_page.metadata or {}):
+        return cached_page.metadata["links"]
+    return extract_internal_links(content)
+
+def page_title_for(normalized_path):
+    """<title> text for a page: the title recorded when it was generated, else its menu name."""
+    cached_page = peek_cached_page(normalized_path)
+    title = (cached_page.metadata or {}).get("title") if cached_page is not None else None
+    return APP_CONFIG.get("company_name", "Web App") + " - " + (html.escape(title) if title else path_to_display_name(normalized_path))
+
+def prefetchable_path(link):
+    """Returns the normalized page path for an internal link worth prefetching, or None (skipped paths, assets, API routes)."""
+    normalized_path = normalize_path(link)
+    if normalized_path in SKIPPED_PATHS or '.' in normalized_path.rsplit('/', 1)[-1]:
+        return None
+    try:
+        endpoint, _ = app.url_map.bind('').match(normalized_path)
+    except HTTPException:
+        return None
+    return normalized_path if endpoint == 'serve_index' else None
+
+def prefetch_page(normalized_path, log_prefix="app.py (Prefetch)"):
+    """
+    Generates and caches a page ahead of its first request. Returns True if it called the LLM.
+    Gives way immediately if a request is already generating the page.
+    """
+    with single_flight_lock(sanitize_path_to_cache_filename(normalized_path), wait_seconds=0) as acquired:
+        if not acquired or peek_cached_page(normalized_path, revalidate=True) is not None or restore_archived_generation(normalized_path, log_prefix):
+            return False
+        try:
+            with admitted_generation(wait=False): # Only spare capacity; never queue behind visitors
+                main_html_content = apply_site_placeholders(normalized_path, generate_llm_content(normalized_path))
+        except AdmissionRejected:
+            return False
+        if main_html_content.strip():
+            save_content_to_cache(normalized_path, main_html_content)
+        return True
+
+# Optional speculative prefetch: after a page is served, generate the uncached pages it links to
+# (best-ranked first) in the background, within a per-process budget of generations per hour
+PREFETCH_LINKS = config.get("prefetch_links", False)
+PREFETCHER = Prefetcher(page_links, accept=prefetchable_path,
+                        is_cached=lambda path: peek_cached_page(path) is not None, generate=prefetch_page,
+                        top_k=config.get("prefetch_top_k", 3), max_queue=config.get("prefetch_queue_size", 32),
+                        workers=config.get("prefetch_workers", 1), budget_per_hour=config.get("prefetch_budget_per_hour", 60))
+
+def prefetch_linked_pages(normalized_path, main_html_content):
+    """Hands a served page to the prefetcher, if enabled. Never raises into the request."""
+    if not PREFETCH_LINKS or not main_html_content.strip():
+        return
+    try:
+        PREFETCHER.page_served(normalized_path, main_html_content)
+    except Exception as e:
+        print(f"app.py Error scheduling prefetch for '{normalized_path}': {e}", file=sys.stderr)
+
 def get_menu_items_from_cache(current_path):
-    """Scans the content cache directory and builds a list of menu items."""
-    menu = []
+    """Returns the precomputed menu from the menu index, with the current path flagged."""
     # Ensure current path is represented, even if not cached yet (will be after LLM call)
     # This makes it appear in the menu on first load.
-    current_path_normalized = ('/' + current_path.strip('/')) if current_path and current_path != '/' else '/'
-    
-    # Temporary set to track paths to avoid duplicates from different sanitization stages
-    processed_paths_for_menu = {current_path_normalized}
-    menu.append({
-        "name": path_to_display_name(current_path_normalized),
-        "path": current_path_normalized,
-        "is_current": True
-    })
-
-    for filename in os.listdir(CONTENT_CACHE_DIR):
-        if filename.endswith("_content.html"):
-            # Infer original path from filename
-            original_path_base = filename[:-len("_content.html")]
-            if original_path_base == 'index':
-                original_path = '/'
-            else:
-                original_path = '/' + original_path_base.replace('_', '/')
-            
-            if original_path not in processed_paths_for_menu:
-                menu.append({
-                    "name": path_to_display_name(original_path),
-                    "path": original_path,
-                    "is_current": False
-                })
-                processed_paths_for_menu.add(original_path)
-    
-    menu.sort(key=lambda x: (x['path'] != '/', x['name']))
-    return menu
+    current_path_normalized = normalize_path(current_path)
+    with span("menu_build"):
+        return MENU_INDEX.menu_for(current_path_normalized)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    if "request_start" in g: # Streamed bodies are timed up to their first byte
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - g.request_start,
+                                     endpoint=request.endpoint or "none", status=response.status_code)
+    return response
+
+def metrics_request_allowed():
+    if METRICS_TOKEN:
+        return hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}")
+    return request.remote_addr in ("127.0.0.1", "::1") and "X-Forwarded-For" not in request.headers
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if not METRICS_ENDPOINT or not metrics_request_allowed():
+        return jsonify({"error": "Not found."}), 404
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4', headers={"Cache-Control": "no-store"})
 
 @app.route('/get_page_data')
 def get_page_data_endpoint():
     path_param = request.args.get('path', '/')
-    normalized_path = ('/' + path_param.strip('/')) if path_param and path_param != '/' else '/'
+    normalized_path = normalize_path(path_param)
 
     if normalized_path in SKIPPED_PATHS:
         # For skipped paths, return empty content but ensure menu still loads if needed.
@@ -128,50 +774,116 @@ def get_page_data_endpoint():
             "menu_items": get_menu_items_from_cache(normalized_path)
         })
 
-    cache_content_filename = sanitize_path_to_cache_filename(normalized_path)
-    cache_content_filepath = os.path.join(CONTENT_CACHE_DIR, cache_content_filename)
+    if request.args.get('cached_only') == '1':
+        # The browser client asks here first, so cached pages get ETags and compression, and
+        # streams from /stream_page_data only on a miss
+        main_html_content = read_cached_content(normalized_path, log_prefix="app.py (API)")
+        if not main_html_content.strip():
+            return Response(status=204, headers={"Cache-Control": "no-cache"})
+    else:
+        try:
+            main_html_content = get_or_generate_content(normalized_path, log_prefix="app.py (API)")
+        except AdmissionRejected as rejection:
+            return Response(json.dumps({"main_content_html": BUSY_HTML, "menu_items": get_menu_items_from_cache(normalized_path)}),
+                            status=503, mimetype='application/json', headers=busy_headers(rejection))
+    prefetch_linked_pages(normalized_path, main_html_content)
+
+    def render_body():
+        menu_items = get_menu_items_from_cache(normalized_path)
+        return json.dumps({
+            "main_content_html": main_html_content.strip(),
+            "menu_items": menu_items
+        })
 
-    main_html_content = ""
+    if not main_html_content.strip():
+        return Response(render_body(), mimetype='application/json', headers={"Cache-Control": "no-cache"})
+    digest, last_modified = content_validators(normalized_path, main_html_content)
+    return cached_response(render_body, make_etag(normalized_path, digest, MENU_INDEX.version), COMPRESSED_BODIES,
+                           HTTP_CACHE_CONTROL, mimetype='application/json', last_modified=last_modified)
 
-    if os.path.exists(cache_content_filepath):
-        try:
-            with open(cache_content_filepath, 'r', encoding='utf-8') as f:
-                main_html_content = f.read()
-            if normalized_path == '/': # Only replace for the index page content
-                main_html_content = main_html_content.replace("{{SITE_BASE_URL}}", APP_CONFIG.get("base_url", ""))
-            # print(f"app.py (API): Served content for '{normalized_path}' from cache.", file=sys.stderr)
-        except Exception as e:
-            print(f"app.py (API) Error reading content cache for '{normalized_path}': {e}. Will try to regenerate.", file=sys.stderr)
-            main_html_content = ""
+@app.route('/stream_page_data')
+def stream_page_data_endpoint():
+    path_param = request.args.get('path', '/')
+    normalized_path = normalize_path(path_param)
 
-    if not main_html_content.strip(): # If cache miss or cache read failed and main_html_content is empty
-        # print(f"app.py (API): Content cache miss or empty for '{normalized_path}'. Calling page.generate_llm_content.", file=sys.stderr)
-        try:
-            main_html_content = generate_llm_content(normalized_path)
-            # If index page is regenerated by LLM, it should use {{SITE_BASE_URL}} as per updated prompt
-            # So, if it's the index page, replace placeholder after generation
-            if normalized_path == '/' and "{{SITE_BASE_URL}}" in main_html_content:
-                main_html_content = main_html_content.replace("{{SITE_BASE_URL}}", APP_CONFIG.get("base_url", ""))
+    if normalized_path in SKIPPED_PATHS:
+        events = iter([format_sse_event("done", {"main_content_html": "", "menu_items": get_menu_items_from_cache(normalized_path)})])
+    else:
+        events = stream_page_events(normalized_path)
 
-            if main_html_content.strip():
-                try:
-                    with open(cache_content_filepath, 'w', encoding='utf-8') as f:
-                        f.write(main_html_content)
-                    # print(f"app.py (API): Saved generated content for '{normalized_path}' to cache.", file=sys.stderr)
-                except Exception as e:
-                    print(f"app.py (API) Error writing content to cache for '{normalized_path}': {e}", file=sys.stderr)
-            else:
-                main_html_content = "" # Ensure empty if LLM provides no content
-        except Exception as e:
-            print(f"app.py (API) Exception calling generate_llm_content for '{normalized_path}': {e}", file=sys.stderr)
-            main_html_content = "" # Ensure empty on error
-    
-    menu_items = get_menu_items_from_cache(normalized_path)
+    return Response(stream_with_context(events), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no" # Stop nginx-style proxies from buffering the stream
+    })
 
-    return jsonify({
+def find_cached_search_result(query, log_prefix="app.py (AI Search)", revalidate=False):
+    """
+    Returns the /ai_search response payload for a query an already-cached page answers, or None.
+    Shared by the Flask endpoint and the async serving mode. Pass revalidate=True after
+    waiting on the search's single-flight lock.
+    """
+    if not AI_SEARCH_DEDUP:
+        return None
+    match = SEARCH_INDEX.lookup(query, MENU_INDEX.paths(), revalidate=revalidate)
+    if match is None:
+        return None
+    matched_path, _ = match
+    main_html_content = read_cached_content(matched_path, log_prefix, revalidate)
+    if not main_html_content.strip():
+        return None # Page was removed or invalidated since; answer the search afresh
+    SEARCH_DEDUP.inc()
+    prefetch_linked_pages(matched_path, main_html_content)
+    return {
+        "new_path": matched_path,
         "main_content_html": main_html_content.strip(),
+        "menu_items": get_menu_items_from_cache(matched_path)
+    }
+
+def ai_search_lock_name(query):
+    """Single-flight lock name for a search, so identical concurrent searches make one LLM call."""
+    return f"search_{query_key(query)}"
+
+def build_ai_search_response(query, ai_result):
+    """
+    Caches the page produced by an AI search and returns (response_payload, status_code).
+    Shared by the Flask endpoint and the async serving mode.
+    """
+    if "error" in ai_result:
+        print(f"app.py (AI Search): Error from AI generation: {ai_result.get('details', ai_result['error'])}", file=sys.stderr)
+        return {"error": "Failed to generate content from AI.", "details": ai_result.get('details', ai_result['error'])}, 500
+
+    new_url_path = ai_result.get("url_path")
+    generated_content = ai_result.get("content")
+
+    if not new_url_path or not generated_content:
+        print(f"app.py (AI Search): AI did not return valid url_path or content for query '{query}'. Response: {ai_result}", file=sys.stderr)
+        return {"error": "AI response missing url_path or content."}, 500
+    
+    # Ensure new_url_path starts with a slash (and is normalized like every other cached path)
+    new_url_path = normalize_path(new_url_path)
+        
+    # Sanitize and cache the new content
+    try:
+        save_content_to_cache(new_url_path, generated_content, metadata={
+            "source": "ai_search",
+            "query": query,
+            "fingerprint": ai_search_fingerprint(query)
+        })
+        # print(f"app.py (AI Search): Saved AI-generated content for path '{new_url_path}' to cache.", file=sys.stderr)
+        if AI_SEARCH_DEDUP:
+            SEARCH_INDEX.record(query, new_url_path)
+    except Exception as e:
+        print(f"app.py (AI Search) Error writing content to cache for new path '{new_url_path}': {e}", file=sys.stderr)
+        # Continue, as the content is still available to be sent to the user
+
+    prefetch_linked_pages(new_url_path, generated_content)
+    menu_items = get_menu_items_from_cache(new_url_path) # Get menu items, including the new one
+
+    return {
+        "new_path": new_url_path,
+        "main_content_html": generated_content.strip(),
         "menu_items": menu_items
-    })
+    }, 200
 
 @app.route('/ai_search')
 def ai_search_endpoint():
@@ -180,43 +892,18 @@ def ai_search_endpoint():
         return jsonify({"error": "Search query cannot be empty."}), 400
 
     try:
-        ai_result = generate_content_from_ai_search(query)
-
-        if "error" in ai_result:
-            print(f"app.py (AI Search): Error from AI generation: {ai_result.get('details', ai_result['error'])}", file=sys.stderr)
-            return jsonify({"error": "Failed to generate content from AI.", "details": ai_result.get('details', ai_result['error'])}), 500
-
-        new_url_path = ai_result.get("url_path")
-        generated_content = ai_result.get("content")
-
-        if not new_url_path or not generated_content:
-            print(f"app.py (AI Search): AI did not return valid url_path or content for query '{query}'. Response: {ai_result}", file=sys.stderr)
-            return jsonify({"error": "AI response missing url_path or content."}), 500
-        
-        # Ensure new_url_path starts with a slash
-        if not new_url_path.startswith('/'):
-            new_url_path = '/' + new_url_path
-            
-        # Sanitize and cache the new content
-        cache_content_filename = sanitize_path_to_cache_filename(new_url_path)
-        cache_content_filepath = os.path.join(CONTENT_CACHE_DIR, cache_content_filename)
-        
-        try:
-            with open(cache_content_filepath, 'w', encoding='utf-8') as f:
-                f.write(generated_content)
-            # print(f"app.py (AI Search): Saved AI-generated content for path '{new_url_path}' to cache.", file=sys.stderr)
-        except Exception as e:
-            print(f"app.py (AI Search) Error writing content to cache for new path '{new_url_path}': {e}", file=sys.stderr)
-            # Continue, as the content is still available to be sent to the user
-
-        menu_items = get_menu_items_from_cache(new_url_path) # Get menu items, including the new one
-
-        return jsonify({
-            "new_path": new_url_path,
-            "main_content_html": generated_content.strip(),
-            "menu_items": menu_items
-        })
-
+        cached_payload = find_cached_search_result(query)
+        if cached_payload is not None:
+            return jsonify(cached_payload)
+        with single_flight_lock(ai_search_lock_name(query)) as acquired:
+            if acquired and (cached_payload := find_cached_search_result(query, revalidate=True)) is not None:
+                return jsonify(cached_payload) # Answered by the search we waited on
+            with admitted_generation():
+                ai_result = generate_content_from_ai_search(query)
+            payload, status_code = build_ai_search_response(query, ai_result)
+        return jsonify(payload), status_code
+    except AdmissionRejected as rejection:
+        return jsonify({"error": "The site is busy right now.", "details": "Please try your search again in a few seconds."}), 503, busy_headers(rejection)
     except Exception as e:
         print(f"app.py (AI Search) General exception for query '{query}': {e}", file=sys.stderr)
         return jsonify({"error": "An unexpected error occurred during AI search."}), 500
@@ -226,82 +913,48 @@ def ai_search_endpoint():
 @app.route('/<path:text>')
 def serve_index(text=None):
     path_param = text if text else '/'
-    normalized_path = ('/' + path_param.strip('/')) if path_param and path_param != '/' else '/'
+    normalized_path = normalize_path(path_param)
 
     if normalized_path in SKIPPED_PATHS:
         # print(f"app.py (SSR): Skipped path, returning 204 No Content: {normalized_path}", file=sys.stderr)
         return '', 204 # Return No Content for these specific asset paths
 
-    main_html_content = "" # Default to empty string
-    cache_content_filename = sanitize_path_to_cache_filename(normalized_path)
-    cache_content_filepath = os.path.join(CONTENT_CACHE_DIR, cache_content_filename)
-
-    if os.path.exists(cache_content_filepath):
-        try:
-            with open(cache_content_filepath, 'r', encoding='utf-8') as f:
-                main_html_content = f.read()
-            if normalized_path == '/': # Only replace for the index page content for SSR
-                main_html_content = main_html_content.replace("{{SITE_BASE_URL}}", APP_CONFIG.get("base_url", ""))
-            # print(f"app.py (SSR): Served content for '{normalized_path}' from cache: {cache_content_filepath}", file=sys.stderr)
-        except Exception as e:
-            print(f"app.py (SSR) Error reading content cache for '{normalized_path}': {e}. Will try to regenerate.", file=sys.stderr)
-            main_html_content = "" # Ensure it is empty before regeneration attempt
-            try:
-                main_html_content = generate_llm_content(normalized_path)
-                # If index page is regenerated by LLM, it should use {{SITE_BASE_URL}} as per updated prompt
-                # So, if it's the index page, replace placeholder after generation
-                if normalized_path == '/' and "{{SITE_BASE_URL}}" in main_html_content:
-                    main_html_content = main_html_content.replace("{{SITE_BASE_URL}}", APP_CONFIG.get("base_url", ""))
-                if main_html_content.strip(): # Check if content is not just whitespace
-                    with open(cache_content_filepath, 'w', encoding='utf-8') as f:
-                        f.write(main_html_content)
-                else:
-                    main_html_content = "" # Explicitly set to empty if LLM returns nothing
-            except Exception as gen_e:
-                print(f"app.py (SSR) Error during content regeneration: {gen_e}", file=sys.stderr)
-                main_html_content = "" # Empty on error
+    busy_rejection = None
+    if APP_CONFIG["stream_page_data"]:
+        # Don't hold up first paint on the LLM: serve the shell and let the client stream the content in
+        main_html_content = read_cached_content(normalized_path, log_prefix="app.py (SSR)")
     else:
-        # print(f"app.py (SSR): Content cache miss for '{normalized_path}'. Calling page.generate_llm_content.", file=sys.stderr)
         try:
-            main_html_content = generate_llm_content(normalized_path) 
-            # If index page is regenerated by LLM, it should use {{SITE_BASE_URL}} as per updated prompt
-            # So, if it's the index page, replace placeholder after generation
-            if normalized_path == '/' and "{{SITE_BASE_URL}}" in main_html_content:
-                main_html_content = main_html_content.replace("{{SITE_BASE_URL}}", APP_CONFIG.get("base_url", ""))
-            if main_html_content.strip(): # Check if content is not just whitespace
-                try:
-                    with open(cache_content_filepath, 'w', encoding='utf-8') as f:
-                        f.write(main_html_content)
-                    # print(f"app.py (SSR): Saved generated content for '{normalized_path}' to cache: {cache_content_filepath}", file=sys.stderr)
-                except Exception as e:
-                    print(f"app.py (SSR) Error writing content to cache for '{normalized_path}': {e}", file=sys.stderr)
-            else:
-                 main_html_content = "" # Explicitly set to empty if LLM returns nothing
-        except Exception as e:
-            print(f"app.py (SSR) Error generating content for '{normalized_path}': {e}", file=sys.stderr)
-            main_html_content = "" # Empty on error
+            main_html_content = get_or_generate_content(normalized_path, log_prefix="app.py (SSR)")
+        except AdmissionRejected as rejection:
+            busy_rejection, main_html_content = rejection, ""
+    has_content = bool(main_html_content.strip())
+    prefetch_linked_pages(normalized_path, main_html_content)
+    if not has_content and APP_CONFIG["stream_page_data"]:
+        main_html_content = STREAMING_PLACEHOLDER_HTML
+    elif busy_rejection is not None:
+        main_html_content = BUSY_HTML
 
     # The menu item generation should remain in get_page_data_endpoint, not here in serve_index for SSR.
     # For SSR, we only care about the main_html_content.
 
     try:
-        index_html_path = os.path.join(os.path.dirname(__file__), 'index.html')
-        with open(index_html_path, 'r', encoding='utf-8') as f:
-            index_html_template = f.read()
-        
-        # Replace placeholders with config values
-        company_name = APP_CONFIG.get("company_name", "Web App")
-        site_config_json = json.dumps({"companyName": company_name})
-
-        processed_html = index_html_template.replace("{{INITIAL_PAGE_TITLE}}", APP_CONFIG.get("company_name", "Web App") + " - " + path_to_display_name(normalized_path))
-        processed_html = processed_html.replace("{{COMPANY_NAME_H1}}", APP_CONFIG.get("company_name", "Web App"))
-        processed_html = processed_html.replace("{{COMPANY_NAME_FOOTER}}", APP_CONFIG.get("company_name", "Web App"))
-        processed_html = processed_html.replace("{{SITE_CONFIG_JSON}}", site_config_json)
-        
-        placeholder_with_fallback = "<!-- MAIN_CONTENT_SSR -->\n            <p>Loading page content...</p> <!-- This will be overwritten by SSR or client-side JS -->"
-        final_html = processed_html.replace(placeholder_with_fallback, main_html_content.strip())
-        
-        return final_html
+        if app.debug: # Dev mode: pick up edits to index.html without a restart
+            INDEX_TEMPLATE.reload_if_changed()
+        def render_body():
+            with span("template_render"):
+                return INDEX_TEMPLATE.render(
+                    page_title=page_title_for(normalized_path),
+                    main_content=main_html_content.strip()
+                )
+
+        if busy_rejection is not None:
+            return Response(render_body(), status=503, mimetype='text/html', headers=busy_headers(busy_rejection))
+        if not has_content: # Loading shell or failed generation: never let browsers or proxies keep it
+            return Response(render_body(), mimetype='text/html', headers={"Cache-Control": "no-cache"})
+        digest, last_modified = content_validators(normalized_path, main_html_content)
+        return cached_response(render_body, make_etag(normalized_path, digest, INDEX_TEMPLATE.version), COMPRESSED_BODIES,
+                               HTTP_CACHE_CONTROL, last_modified=last_modified)
     except Exception as e:
         print(f"app.py (SSR) Error reading or processing index.html template: {e}", file=sys.stderr)
         # Return the original template or a very basic error page if template processing fails, to avoid breaking site entirely
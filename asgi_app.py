@@ -0,0 +1,314 @@
+"""
+Async (ASGI) serving mode.
+
+Cache misses are generated with the async OpenAI client on the event loop, so an LLM
+call no longer pins a worker process for its whole duration. Everything else - cache
+hits, SSR, the menu, static files - is still served by the Flask app in app.py, run on a
+thread pool once the content it needs is in the cache.
+
+Run with:
+    gunicorn asgi_app:app -k uvicorn.workers.UvicornWorker
+"""
+import io
+import sys
+import json
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from werkzeug.exceptions import HTTPException
+
+import app as site # app.py: the Flask app plus its cache helpers
+from admission import AdmissionRejected
+from page import async_generate_llm_content, async_stream_llm_content, async_generate_content_from_ai_search, report_main_content
+from html_pipeline import ContentPipeline
+
+# Threads used to run the Flask app for cache hits; these never wait on the LLM
+WSGI_EXECUTOR = ThreadPoolExecutor(max_workers=site.config.get("asgi_wsgi_threads", 32), thread_name_prefix="wsgi")
+
+_event_loop_flight_locks = {} # cache_filename -> [lock, number of callers using it]
+
+@asynccontextmanager
+async def async_single_flight_lock(cache_filename, wait_seconds=None):
+    """Async counterpart of app.single_flight_lock: waits on the same lock files without blocking the loop."""
+    if wait_seconds is None:
+        wait_seconds = site.SINGLE_FLIGHT_WAIT_SECONDS
+    if site.fcntl is None:
+        entry = _event_loop_flight_locks.setdefault(cache_filename, [asyncio.Lock(), 0])
+        entry[1] += 1
+        lock, acquired = entry[0], False
+        try:
+            try:
+                await asyncio.wait_for(lock.acquire(), timeout=wait_seconds)
+                acquired = True
+            except asyncio.TimeoutError:
+                pass
+            yield acquired
+        finally:
+            if acquired:
+                lock.release()
+            entry[1] -= 1
+            if not entry[1]:
+                del _event_loop_flight_locks[cache_filename]
+        return
+
+    loop = asyncio.get_running_loop()
+    lock_path = site.single_flight_lock_path(cache_filename)
+    deadline = loop.time() + wait_seconds
+    while (lock_file := site.try_lock_file(lock_path)) is None and loop.time() < deadline:
+        await asyncio.sleep(site.SINGLE_FLIGHT_POLL_INTERVAL)
+    try:
+        yield lock_file is not None
+    finally:
+        if lock_file is not None:
+            site.release_lock_file(lock_file, lock_path)
+
+# Cache reads and writes can block on disk (fsync) or on the shared cache server, so they run in threads
+def read_or_restore_content(normalized_path, log_prefix):
+    """The re-read after acquiring a single-flight lock, revalidated so a page another process just generated is seen."""
+    return site.read_cached_content(normalized_path, log_prefix, revalidate=True) or site.restore_archived_generation(normalized_path, log_prefix)
+
+async def async_get_or_generate_content(normalized_path, log_prefix="asgi_app.py", client=None, deadline=None):
+    """Async version of app.get_or_generate_content, coalescing misses with sync workers too. Raises AdmissionRejected if shed."""
+    main_html_content = await asyncio.to_thread(site.read_cached_content, normalized_path, log_prefix)
+    if main_html_content.strip():
+        return main_html_content
+
+    async with async_single_flight_lock(site.sanitize_path_to_cache_filename(normalized_path)) as acquired:
+        if acquired:
+            main_html_content = await asyncio.to_thread(read_or_restore_content, normalized_path, log_prefix)
+            if main_html_content.strip():
+                return main_html_content
+        else:
+            print(f"{log_prefix} Timed out waiting for in-flight generation of '{normalized_path}'. Generating independently.", file=sys.stderr)
+
+        async with site.ADMISSION.async_admit(client, deadline):
+            main_html_content = site.apply_site_placeholders(normalized_path, await async_generate_llm_content(normalized_path))
+        if not main_html_content.strip():
+            return ""
+        try:
+            await asyncio.to_thread(site.save_content_to_cache, normalized_path, main_html_content)
+        except Exception as e:
+            print(f"{log_prefix} Error writing content to cache for '{normalized_path}': {e}", file=sys.stderr)
+    return main_html_content
+
+async def async_stream_page_events(normalized_path, log_prefix="asgi_app.py (Stream)", client=None, deadline=None):
+    """Async version of app.stream_page_events."""
+    main_html_content = await asyncio.to_thread(site.read_cached_content, normalized_path, log_prefix)
+    busy = False
+    if not main_html_content.strip():
+        async with async_single_flight_lock(site.sanitize_path_to_cache_filename(normalized_path), wait_seconds=0) as acquired:
+            if acquired:
+                main_html_content = await asyncio.to_thread(read_or_restore_content, normalized_path, log_prefix)
+                if not main_html_content.strip():
+                    pipeline = ContentPipeline()
+                    try:
+                        async with site.ADMISSION.async_admit(client, deadline):
+                            async for delta in async_stream_llm_content(normalized_path):
+                                chunk_event = site.cleaned_chunk_event(pipeline, delta)
+                                if chunk_event:
+                                    yield chunk_event
+                        pipeline.close()
+                    except AdmissionRejected:
+                        busy, pipeline = True, None
+                    except Exception as e:
+                        print(f"{log_prefix} Error streaming content for '{normalized_path}': {e}", file=sys.stderr)
+                        pipeline = None
+                    main_html_content = site.apply_site_placeholders(normalized_path, report_main_content(pipeline, normalized_path)) if pipeline else ""
+                    if main_html_content.strip():
+                        try:
+                            await asyncio.to_thread(site.save_content_to_cache, normalized_path, main_html_content,
+                                                    outline=(pipeline.title, pipeline.links))
+                        except Exception as e:
+                            print(f"{log_prefix} Error writing content to cache for '{normalized_path}': {e}", file=sys.stderr)
+        if not acquired:
+            try:
+                main_html_content = await async_get_or_generate_content(normalized_path, log_prefix, client, deadline)
+            except AdmissionRejected:
+                busy = True
+
+    if busy:
+        main_html_content = site.BUSY_HTML
+    else:
+        await asyncio.to_thread(site.prefetch_linked_pages, normalized_path, main_html_content)
+    yield site.format_sse_event("done", {
+        "main_content_html": main_html_content.strip(),
+        "menu_items": await asyncio.to_thread(site.get_menu_items_from_cache, normalized_path)
+    })
+
+async def async_ai_search(query, log_prefix="asgi_app.py (AI Search)", client=None, deadline=None):
+    """
+    Async version of app.ai_search_endpoint's dedup and single-flight logic. Returns (payload, status_code).
+    Raises AdmissionRejected if the generation is shed.
+    """
+    cached_payload = await asyncio.to_thread(site.find_cached_search_result, query, log_prefix)
+    if cached_payload is not None:
+        return cached_payload, 200
+    async with async_single_flight_lock(site.ai_search_lock_name(query)) as acquired:
+        if acquired:
+            cached_payload = await asyncio.to_thread(site.find_cached_search_result, query, log_prefix, True)
+            if cached_payload is not None:
+                return cached_payload, 200
+        async with site.ADMISSION.async_admit(client, deadline):
+            ai_result = await async_generate_content_from_ai_search(query)
+        return await asyncio.to_thread(site.build_ai_search_response, query, ai_result)
+
+def content_path_for_request(path, query_params):
+    """Returns the normalized page path a Flask route would generate content for, or None."""
+    try:
+        endpoint, _ = site.app.url_map.bind('').match(path)
+    except HTTPException:
+        return None
+    if endpoint == 'get_page_data_endpoint':
+        if query_params.get('cached_only') == ['1']:
+            return None # Never generates; a miss is answered with 204
+        return site.normalize_path(query_params.get('path', ['/'])[0])
+    if endpoint == 'serve_index' and not site.APP_CONFIG["stream_page_data"]:
+        return site.normalize_path(path)
+    return None
+
+# --- ASGI PLUMBING --- START ---
+async def send_json(send, payload, status_code=200, headers=None):
+    body = json.dumps(payload).encode('utf-8')
+    extra_headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in (headers or {}).items()]
+    await send({"type": "http.response.start", "status": status_code,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())] + extra_headers})
+    await send({"type": "http.response.body", "body": body})
+
+def request_header(scope, name):
+    """Returns the first value of a lower-case header name (bytes) as str, or None."""
+    for raw_name, raw_value in scope.get("headers", []):
+        if raw_name.lower() == name:
+            return raw_value.decode("latin-1")
+    return None
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+def build_wsgi_environ(scope, body, generation_deadline=None, generation_attempt=None):
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": scope["client"][0] if scope.get("client") else "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if generation_deadline is not None: # Time already spent queueing here counts against app.py's admission deadline
+        environ["site.generation_deadline"] = generation_deadline
+    if generation_attempt is not None: # Generated (or shed) on the event loop already; app.py must not call the LLM again
+        environ["site.generation_attempt"] = generation_attempt
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin-1").upper().replace("-", "_")
+        value = raw_value.decode("latin-1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+        else:
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+def run_wsgi_app(environ):
+    """Runs the Flask app to completion on a worker thread, returning (status, headers, body)."""
+    response_start = {}
+    def start_response(status, headers, exc_info=None):
+        response_start["status"] = int(status.split(" ", 1)[0])
+        response_start["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+    result = site.app(environ, start_response)
+    try:
+        body = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return response_start["status"], response_start["headers"], body
+
+async def call_flask(scope, receive, send, generation_deadline=None, generation_attempt=None):
+    body = await read_body(receive)
+    loop = asyncio.get_running_loop()
+    environ = build_wsgi_environ(scope, body, generation_deadline, generation_attempt)
+    status_code, headers, response_body = await loop.run_in_executor(WSGI_EXECUTOR, run_wsgi_app, environ)
+    await send({"type": "http.response.start", "status": status_code, "headers": headers})
+    await send({"type": "http.response.body", "body": response_body})
+
+async def handle_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            WSGI_EXECUTOR.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+# --- ASGI PLUMBING --- END ---
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await handle_lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    path = scope["path"]
+    query_params = parse_qs(scope["query_string"].decode("latin-1"))
+    client = site.client_address(scope["client"][0] if scope.get("client") else "", request_header(scope, b"x-forwarded-for"))
+    generation_deadline = time.monotonic() + site.ADMISSION.queue_timeout_seconds
+
+    if path == "/ai_search":
+        query = query_params.get("query", [""])[0]
+        if not query.strip():
+            await send_json(send, {"error": "Search query cannot be empty."}, 400)
+            return
+        try:
+            payload, status_code = await async_ai_search(query, client=client, deadline=generation_deadline)
+        except AdmissionRejected as rejection:
+            await send_json(send, {"error": "The site is busy right now.", "details": "Please try your search again in a few seconds."},
+                            503, site.busy_headers(rejection))
+            return
+        except Exception as e:
+            print(f"asgi_app.py (AI Search) General exception for query '{query}': {e}", file=sys.stderr)
+            payload, status_code = {"error": "An unexpected error occurred during AI search."}, 500
+        await send_json(send, payload, status_code)
+        return
+
+    if path == "/stream_page_data":
+        normalized_path = site.normalize_path(query_params.get("path", ["/"])[0])
+        await send({"type": "http.response.start", "status": 200, "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"), (b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")
+        ]})
+        if normalized_path in site.SKIPPED_PATHS:
+            menu_items = await asyncio.to_thread(site.get_menu_items_from_cache, normalized_path)
+            done_event = site.format_sse_event("done", {"main_content_html": "", "menu_items": menu_items})
+            await send({"type": "http.response.body", "body": done_event.encode("utf-8"), "more_body": True})
+        else:
+            async for event in async_stream_page_events(normalized_path, client=client, deadline=generation_deadline):
+                await send({"type": "http.response.body", "body": event.encode("utf-8"), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    # Generate any missing content here on the event loop, so the Flask handler below is a cache hit
+    content_path = content_path_for_request(path, query_params)
+    generation_attempt = None
+    if content_path is not None and content_path not in site.SKIPPED_PATHS:
+        try:
+            await async_get_or_generate_content(content_path, client=client, deadline=generation_deadline)
+            generation_attempt = True
+        except AdmissionRejected as rejection:
+            generation_attempt = rejection # The Flask handler serves the busy page for it
+    await call_flask(scope, receive, send, generation_deadline, generation_attempt)
@@ -0,0 +1,216 @@
+"""
+Latency/throughput benchmark for the site, run in-process against the mock LLM provider so it
+needs no API key and costs nothing. Drives serve_index (GET /<path>), /get_page_data,
+/stream_page_data and /ai_search with hit-heavy, miss-heavy and thundering-herd request mixes and
+reports p50/p99 latency and requests per second per endpoint. With stream_page_data enabled, an
+uncached page visit is the loading shell plus the /stream_page_data request that fills it in, as
+in a browser. Uses a throwaway cache directory by default.
+
+Examples:
+    python benchmark.py
+    python benchmark.py --scenario thundering-herd --concurrency 64 --latency 2
+    python benchmark.py --requests 2000 --error-rate 0.05 > bench_output.txt
+"""
+import os
+import sys
+import math
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from llm_providers import MockProvider
+
+SCENARIOS = ('hit-heavy', 'miss-heavy', 'thundering-herd')
+
+
+def load_site(cache_dir, provider):
+    """Imports app.py against cache_dir with provider as its LLM. Must run before anything else imports app."""
+    os.environ["CONTENT_CACHE_DIR"] = cache_dir
+    os.environ["LLM_PROVIDER"] = "mock" # Never fall back to the real API, even briefly
+    import app as site
+    import page
+    page.set_llm_provider(provider)
+    return site
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def page_request(path):
+    return ('serve_index', path)
+
+def page_data_request(path):
+    return ('get_page_data', f"/get_page_data?path={path}")
+
+def stream_page_data_request(path):
+    return ('stream_page_data', f"/stream_page_data?path={path}")
+
+def page_visit(path, streaming):
+    """Requests a browser makes for an uncached page: the SSR response, plus the stream filling in its loading shell."""
+    return [page_request(path), stream_page_data_request(path)] if streaming else [page_request(path)]
+
+def search_request(query):
+    return ('ai_search', f"/ai_search?query={query.replace(' ', '+')}")
+
+
+class Runner:
+    """Issues requests through per-thread Flask test clients and records (endpoint, seconds, status)."""
+
+    def __init__(self, site):
+        self.site = site
+        self._local = threading.local()
+
+    def _client(self):
+        if not hasattr(self._local, 'client'):
+            self._local.client = self.site.app.test_client()
+        return self._local.client
+
+    def issue(self, request_spec, barrier=None):
+        endpoint, url = request_spec
+        client = self._client()
+        if barrier is not None:
+            barrier.wait()
+        start = time.perf_counter()
+        try:
+            response = client.get(url)
+            response.get_data() # Drain streamed bodies, so /stream_page_data is timed to its last event
+            status_code = response.status_code
+            response.close()
+        except Exception as e:
+            print(f"benchmark.py Error requesting {url}: {e}", file=sys.stderr)
+            status_code = 599
+        return endpoint, time.perf_counter() - start, status_code
+
+    def run(self, requests, concurrency, barrier=None):
+        """Runs requests concurrently, returning (results, wall_seconds)."""
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(lambda spec: self.issue(spec, barrier), requests))
+        return results, time.perf_counter() - start
+
+
+def hot_paths(args):
+    return [f"/hot/page-{i}" for i in range(args.pages)]
+
+HOT_QUERIES = [f"hot search topic {i}" for i in range(5)]
+
+def warm_hit_heavy(runner, args):
+    """Caches the hit-heavy mix's pages and searches. Runs before the scenario's LLM calls are counted."""
+    warmup = [page_data_request(path) for path in hot_paths(args)] + [search_request(query) for query in HOT_QUERIES]
+    runner.run(warmup, args.concurrency)
+
+def hit_heavy(runner, args, rng):
+    """Mostly cached pages and repeat searches, with a trickle of misses."""
+    paths = hot_paths(args)
+    requests = []
+    for i in range(args.requests):
+        roll = rng.random()
+        if roll < 0.45:
+            requests.append(page_request(rng.choice(paths)))
+        elif roll < 0.90:
+            requests.append(page_data_request(rng.choice(paths)))
+        elif roll < 0.95:
+            requests.append(search_request(rng.choice(HOT_QUERIES)))
+        else:
+            requests.append(page_data_request(f"/hit-heavy/miss-{i}"))
+    return runner.run(requests, args.concurrency)
+
+def miss_heavy(runner, args, rng):
+    """Every request is for a page or search nobody has asked for before."""
+    streaming = runner.site.APP_CONFIG["stream_page_data"]
+    requests = []
+    for i in range(args.requests):
+        roll = rng.random()
+        if roll < 0.4:
+            requests += page_visit(f"/miss-heavy/page-{i}", streaming)
+        elif roll < 0.8:
+            requests.append(page_data_request(f"/miss-heavy/data-{i}"))
+        else:
+            # Random words, so the AI search dedup cannot match it to an earlier query
+            requests.append(search_request(" ".join(f"{rng.getrandbits(32):08x}" for _ in range(3))))
+    return runner.run(requests, args.concurrency)
+
+def thundering_herd(runner, args, rng):
+    """Rounds of `concurrency` clients released at once onto the same uncached page."""
+    streaming = runner.site.APP_CONFIG["stream_page_data"]
+    results, wall_seconds = [], 0.0
+    for round_number in range(max(1, args.requests // args.concurrency)):
+        path = f"/thundering-herd/round-{round_number}"
+        # Half the clients load the page (streaming it in, if enabled), the rest fetch its data
+        visit = page_visit(path, streaming)
+        requests = [visit[i // 2 % len(visit)] if i % 2 else page_data_request(path) for i in range(args.concurrency)]
+        round_results, round_seconds = runner.run(requests, args.concurrency, barrier=threading.Barrier(args.concurrency))
+        results += round_results
+        wall_seconds += round_seconds
+    return results, wall_seconds
+
+SCENARIO_RUNNERS = {'hit-heavy': hit_heavy, 'miss-heavy': miss_heavy, 'thundering-herd': thundering_herd}
+SCENARIO_WARMUPS = {'hit-heavy': warm_hit_heavy}
+
+def report_lines(scenario, results, wall_seconds, llm_calls, llm_errors):
+    lines = []
+    by_endpoint = {}
+    for endpoint, seconds, status_code in results:
+        by_endpoint.setdefault(endpoint, []).append((seconds, status_code))
+    by_endpoint['all'] = [(seconds, status_code) for _, seconds, status_code in results]
+    for endpoint in sorted(by_endpoint, key=lambda name: (name == 'all', name)):
+        samples = by_endpoint[endpoint]
+        latencies = sorted(seconds * 1000 for seconds, _ in samples)
+        errors = sum(1 for _, status_code in samples if status_code >= 500)
+        lines.append(f"{scenario:<16} {endpoint:<16} {len(samples):>8} {errors:>7} "
+                     f"{percentile(latencies, 0.50):>9.1f} {percentile(latencies, 0.99):>9.1f} {latencies[-1]:>9.1f} "
+                     f"{len(samples) / wall_seconds if wall_seconds else 0.0:>9.1f}")
+    lines.append(f"{scenario:<16} LLM calls: {llm_calls} ({llm_errors} injected failures), wall time {wall_seconds:.2f}s")
+    return lines
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the site against the mock LLM provider.")
+    parser.add_argument('--scenario', choices=SCENARIOS + ('all',), default='all', help="Request mix to run (default: all)")
+    parser.add_argument('--requests', type=int, default=500, help="Requests per scenario (default: 500)")
+    parser.add_argument('--concurrency', type=int, default=16, help="Concurrent clients (default: 16)")
+    parser.add_argument('--pages', type=int, default=50, help="Distinct cached pages in the hit-heavy mix (default: 50)")
+    parser.add_argument('--latency', type=float, default=0.2, help="Mock LLM time to first token in seconds (default: 0.2)")
+    parser.add_argument('--tokens-per-second', type=float, default=2000.0, help="Mock LLM token rate, 0 for instant (default: 2000)")
+    parser.add_argument('--response-tokens', type=int, default=300, help="Words per mock LLM response (default: 300)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of mock LLM calls that fail (default: 0)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the request mix and injected failures (default: 0)")
+    parser.add_argument('--cache-dir', help="Cache directory to use instead of a throwaway one (kept afterwards)")
+    args = parser.parse_args(argv)
+    args.concurrency = max(1, args.concurrency)
+
+    cache_dir = args.cache_dir or tempfile.mkdtemp(prefix="benchmark-cache-")
+    os.makedirs(cache_dir, exist_ok=True)
+    provider = MockProvider(latency_seconds=args.latency, tokens_per_second=args.tokens_per_second,
+                            error_rate=args.error_rate, response_tokens=args.response_tokens, seed=args.seed)
+    site = load_site(cache_dir, provider)
+    runner = Runner(site)
+    rng = random.Random(args.seed)
+
+    print(f"# benchmark.py: {args.requests} requests/scenario, concurrency {args.concurrency}, mock latency {args.latency}s, "
+          f"{args.tokens_per_second or 'unlimited'} tokens/s, error rate {args.error_rate}, "
+          f"stream_page_data={site.APP_CONFIG['stream_page_data']}")
+    print(f"{'scenario':<16} {'endpoint':<16} {'requests':>8} {'errors':>7} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'rps':>9}")
+    try:
+        for scenario in (SCENARIOS if args.scenario == 'all' else (args.scenario,)):
+            if scenario in SCENARIO_WARMUPS:
+                SCENARIO_WARMUPS[scenario](runner, args)
+            calls_before, errors_before = provider.calls, provider.errors
+            results, wall_seconds = SCENARIO_RUNNERS[scenario](runner, args, rng)
+            for line in report_lines(scenario, results, wall_seconds, provider.calls - calls_before, provider.errors - errors_before):
+                print(line)
+            sys.stdout.flush()
+    finally:
+        site.REFRESH_EXECUTOR.shutdown(wait=False)
+        if not args.cache_dir:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,276 @@
+"""
+Storage backends for generated page snippets, keyed by the name from
+app.sanitize_path_to_cache_filename (e.g. "services_ev-chargers_content.html").
+
+FileCacheStore keeps the original layout: one snippet file plus a .meta.json sidecar per page
+in cache/. SQLiteCacheStore keeps every page in a single database file, so a lookup is one
+indexed read and the whole cache can be backed up or shipped as one file.
+
+Both write crash-safely and store a checksum of each page's content, which is verified
+on every load: a torn or corrupted entry reads as a miss and is regenerated instead
+of being served forever.
+
+Copy an existing file cache into a database with:
+    python cache_store.py cache/ cache/cache.sqlite3
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import threading
+from collections import namedtuple
+
+CONTENT_SUFFIX = "_content.html"
+
+# content is the raw snippet; metadata is None for legacy entries written before metadata existed
+StoredEntry = namedtuple('StoredEntry', ['content', 'metadata', 'stored_at'])
+
+
+def content_checksum(content):
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+def checksum_matches(content, metadata):
+    """True unless the metadata records a checksum that the content does not match."""
+    expected = metadata.get("checksum") if metadata else None
+    return not expected or content_checksum(content) == expected
+
+def write_file_atomically(filepath, data):
+    """Writes via an fsynced temp file and rename, so readers and crashes never see a partial file."""
+    directory = os.path.dirname(filepath)
+    tmp_filepath = os.path.join(directory, f".{os.path.basename(filepath)}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_filepath, 'w', encoding='utf-8') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filepath, filepath)
+    finally:
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
+    try: # Persist the rename itself
+        directory_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return # e.g. Windows, where directories can't be opened
+    try:
+        os.fsync(directory_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(directory_fd)
+
+
+class FileCacheStore:
+    """One <name>_content.html snippet and <name>_content.meta.json sidecar per page."""
+    name = "files"
+
+    def __init__(self, cache_dir, generations_dir):
+        self.cache_dir = cache_dir
+        self.generations_dir = generations_dir # Superseded generations: <generations_dir>/<file>/<fingerprint>.html
+
+    def _content_path(self, cache_filename):
+        return os.path.join(self.cache_dir, cache_filename)
+
+    @staticmethod
+    def _metadata_path(content_path):
+        return content_path[:-len('.html')] + '.meta.json'
+
+    @staticmethod
+    def _read_metadata_file(metadata_path):
+        """Returns a metadata dict, None if the file does not exist, or {} if unreadable."""
+        try:
+            with open(metadata_path, 'r', encoding='utf-8') as f:
+                metadata = json.load(f)
+            return metadata if isinstance(metadata, dict) else {}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            return {}
+
+    def signature(self, cache_filename, revalidate=False):
+        """
+        Changes whenever the entry is rewritten; None if there is no entry. revalidate asks a
+        store that memoizes signatures to check the backing store now; this one always does.
+        """
+        try:
+            stat_result = os.stat(self._content_path(cache_filename))
+        except FileNotFoundError:
+            return None
+        return (stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino)
+
+    def read(self, cache_filename):
+        """Returns the StoredEntry, or None if it is missing or fails its checksum."""
+        content_path = self._content_path(cache_filename)
+        for attempt in range(2):
+            try:
+                with open(content_path, 'r', encoding='utf-8') as f:
+                    stored_at = os.fstat(f.fileno()).st_mtime
+                    content = f.read()
+            except FileNotFoundError:
+                return None
+            metadata = self._read_metadata_file(self._metadata_path(content_path))
+            if checksum_matches(content, metadata):
+                return StoredEntry(content, metadata, stored_at)
+            time.sleep(0.01) # A writer may be between its metadata and content renames
+        print(f"cache_store.py Checksum mismatch for {content_path}; treating it as missing.", file=sys.stderr)
+        return None
+
+    def read_metadata(self, cache_filename):
+        return self._read_metadata_file(self._metadata_path(self._content_path(cache_filename)))
+
+    def write(self, cache_filename, content, metadata, stored_at=None):
+        content_path = self._content_path(cache_filename)
+        if metadata is not None: # None keeps a legacy entry legacy
+            # Metadata first: the content rename is what tells other workers' PageCache to reload both
+            write_file_atomically(self._metadata_path(content_path), json.dumps({**metadata, "checksum": content_checksum(content)}))
+        write_file_atomically(content_path, content)
+        if stored_at is not None:
+            os.utime(content_path, (stored_at, stored_at))
+
+    def archive(self, cache_filename, new_fingerprint):
+        """
+        Keeps the entry about to be overwritten under its fingerprint if it came from a different
+        config, replacing any older generation archived for that fingerprint.
+        """
+        content_path = self._content_path(cache_filename)
+        previous_metadata = self.read_metadata(cache_filename)
+        if not previous_metadata or previous_metadata.get("fingerprint") in (None, new_fingerprint):
+            return
+        archive_dir = os.path.join(self.generations_dir, cache_filename)
+        os.makedirs(archive_dir, exist_ok=True)
+        archive_base = os.path.join(archive_dir, previous_metadata["fingerprint"])
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        for source_path, archive_path in ((content_path, archive_base + '.html'),
+                                          (self._metadata_path(content_path), archive_base + '.meta.json')):
+            try:
+                os.link(source_path, archive_path + suffix) # New content is renamed into place, so the old inode survives
+            except FileNotFoundError:
+                return
+            except OSError:
+                shutil.copy2(source_path, archive_path + suffix)
+            os.replace(archive_path + suffix, archive_path)
+
+    def read_archived(self, cache_filename, fingerprint):
+        """Returns the archived StoredEntry for a fingerprint, or None."""
+        archive_base = os.path.join(self.generations_dir, cache_filename, fingerprint)
+        try:
+            with open(archive_base + '.html', 'r', encoding='utf-8') as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        metadata = self._read_metadata_file(archive_base + '.meta.json')
+        if not metadata or not checksum_matches(content, metadata):
+            return None
+        return StoredEntry(content, metadata, metadata.get("generated_at", 0.0))
+
+    def filenames(self):
+        return sorted(filename for filename in os.listdir(self.cache_dir)
+                      if filename.endswith(CONTENT_SUFFIX) and not filename.startswith('.'))
+
+
+class SQLiteCacheStore:
+    """All pages, and their superseded generations, in one SQLite database in WAL mode."""
+    name = "sqlite"
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute("""CREATE TABLE IF NOT EXISTS pages (
+            filename TEXT PRIMARY KEY, content TEXT NOT NULL, metadata TEXT NOT NULL, checksum TEXT NOT NULL,
+            stored_at REAL NOT NULL, version INTEGER NOT NULL)""")
+        connection.execute("""CREATE TABLE IF NOT EXISTS generations (
+            filename TEXT NOT NULL, fingerprint TEXT NOT NULL, content TEXT NOT NULL, metadata TEXT NOT NULL,
+            PRIMARY KEY (filename, fingerprint))""")
+
+    def _connection(self):
+        """One connection per thread, reopened after a fork (connections must not cross processes)."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL") # Readers never block on the writer
+            connection.execute("PRAGMA synchronous=FULL")
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def signature(self, cache_filename, revalidate=False):
+        row = self._connection().execute("SELECT version FROM pages WHERE filename = ?", (cache_filename,)).fetchone()
+        return row
+
+    def read(self, cache_filename):
+        row = self._connection().execute(
+            "SELECT content, metadata, checksum, stored_at FROM pages WHERE filename = ?", (cache_filename,)).fetchone()
+        if row is None:
+            return None
+        content, metadata = row[0], json.loads(row[1]) # JSON null for legacy entries copied from files
+        if content_checksum(content) != row[2]:
+            print(f"cache_store.py Checksum mismatch for {cache_filename} in {self.db_path}; treating it as missing.", file=sys.stderr)
+            return None
+        return StoredEntry(content, metadata, row[3])
+
+    def read_metadata(self, cache_filename):
+        row = self._connection().execute("SELECT metadata FROM pages WHERE filename = ?", (cache_filename,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def write(self, cache_filename, content, metadata, stored_at=None):
+        checksum = content_checksum(content)
+        if metadata is not None:
+            metadata = {**metadata, "checksum": checksum}
+        self._connection().execute(
+            """INSERT INTO pages (filename, content, metadata, checksum, stored_at, version) VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT (filename) DO UPDATE SET content = excluded.content, metadata = excluded.metadata,
+               checksum = excluded.checksum, stored_at = excluded.stored_at, version = excluded.version""",
+            (cache_filename, content, json.dumps(metadata), checksum, stored_at or time.time(), time.time_ns()))
+
+    def archive(self, cache_filename, new_fingerprint):
+        row = self._connection().execute("SELECT content, metadata FROM pages WHERE filename = ?", (cache_filename,)).fetchone()
+        if row is None:
+            return
+        previous_fingerprint = (json.loads(row[1]) or {}).get("fingerprint")
+        if previous_fingerprint in (None, new_fingerprint):
+            return
+        self._connection().execute("INSERT OR REPLACE INTO generations (filename, fingerprint, content, metadata) VALUES (?, ?, ?, ?)",
+                                   (cache_filename, previous_fingerprint, row[0], row[1]))
+
+    def read_archived(self, cache_filename, fingerprint):
+        row = self._connection().execute("SELECT content, metadata FROM generations WHERE filename = ? AND fingerprint = ?",
+                                         (cache_filename, fingerprint)).fetchone()
+        if row is None:
+            return None
+        content, metadata = row[0], json.loads(row[1])
+        if not checksum_matches(content, metadata):
+            return None
+        return StoredEntry(content, metadata, metadata.get("generated_at", 0.0))
+
+    def is_empty(self):
+        return self._connection().execute("SELECT 1 FROM pages LIMIT 1").fetchone() is None
+
+    def filenames(self):
+        return [row[0] for row in self._connection().execute("SELECT filename FROM pages ORDER BY filename")]
+
+
+def copy_entries(source, target):
+    """Copies every current entry from one store to another. Returns the number copied."""
+    copied = 0
+    for cache_filename in source.filenames():
+        entry = source.read(cache_filename)
+        if entry is None:
+            continue
+        target.write(cache_filename, entry.content, entry.metadata, stored_at=entry.stored_at)
+        copied += 1
+    return copied
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Copy a file-per-page cache directory into a single SQLite cache file.")
+    parser.add_argument('cache_dir', help="Directory with <name>_content.html files, e.g. cache/")
+    parser.add_argument('db_path', help="SQLite file to create or update, e.g. cache/cache.sqlite3")
+    args = parser.parse_args(argv)
+    copied = copy_entries(FileCacheStore(args.cache_dir, os.path.join(args.cache_dir, '.generations')), SQLiteCacheStore(args.db_path))
+    print(f"cache_store.py: Copied {copied} pages into {args.db_path}.", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
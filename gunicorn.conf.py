@@ -0,0 +1,55 @@
+"""
+Gunicorn settings, read automatically by `gunicorn app:app` (see Procfile). Worker count,
+bind address and the like come from gunicorn's usual flags and environment variables
+(WEB_CONCURRENCY, PORT, GUNICORN_CMD_ARGS).
+
+Preload mode (on unless GUNICORN_PRELOAD=0) imports app.py once in the master and warms its
+in-memory caches before forking, so workers boot instantly and share the loaded pages
+copy-on-write. Everything that must not cross a fork (LLM clients, SQLite and shared cache
+connections, prefetch threads) is created lazily in each worker.
+
+Each scrape of /metrics reaches one worker, so workers write their metrics to SITE_METRICS_DIR
+(a fresh temporary directory unless set) and a scrape renders the sum over all of them (see
+metrics.py). The directory is emptied when gunicorn starts.
+"""
+import gc
+import os
+import sys
+import glob
+import shutil
+import tempfile
+
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") != "0"
+timeout = 120 # Uncached pages wait on the LLM
+
+# Set before the app is imported (by the preload or by each worker), so metrics.py sees it
+owns_metrics_dir = "SITE_METRICS_DIR" not in os.environ
+if owns_metrics_dir:
+    os.environ["SITE_METRICS_DIR"] = tempfile.mkdtemp(prefix="site-metrics-")
+metrics_dir = os.environ["SITE_METRICS_DIR"]
+os.makedirs(metrics_dir, exist_ok=True)
+
+def on_starting(server):
+    for snapshot_path in glob.glob(os.path.join(metrics_dir, "*.json")): # Left over from an earlier run
+        os.remove(snapshot_path)
+
+def on_exit(server):
+    if owns_metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+def post_fork(server, worker):
+    import metrics
+    metrics.start_flusher()
+
+def worker_exit(server, worker):
+    import metrics
+    metrics.write_snapshot() # Keep everything this worker counted in the totals
+
+def when_ready(server):
+    if not preload_app:
+        return
+    import app as site # Already imported by the preload
+    if site.config.get("preload_page_cache", True):
+        loaded = site.warm_process_caches()
+        print(f"gunicorn.conf.py: Loaded {loaded} cached pages into memory before forking workers.", file=sys.stderr)
+    gc.freeze() # Keep the warmed objects out of the collector, so workers don't touch (and copy) their pages
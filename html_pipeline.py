@@ -0,0 +1,284 @@
+"""
+Single-pass, incremental clean-up of LLM HTML output.
+
+ContentPipeline is fed the response as it arrives (one delta at a time when streaming) and
+emits sanitized HTML as soon as each piece is complete, so nothing is rescanned. It:
+  - keeps only the content of <main> (or, failing that, <body>) when the model wrapped its
+    answer in a whole document, dropping the head, header, nav and footer sections;
+  - enforces the prompt's tag policy: allowed tags and attributes pass, images, media,
+    scripts and styles are removed with their content, anything else is unwrapped to its text;
+  - enforces the link policy: internal links are rewritten to the canonical
+    href + navigateTo() form, mailto:/tel:/#fragment links pass, external links are unwrapped;
+  - repairs structure: stray end tags are dropped and unclosed tags are closed;
+  - records the page title (<title>, else the first <h1>, else the first <h2>) and its internal
+    links, in order.
+"""
+import re
+from html import escape
+from html.parser import HTMLParser
+
+ALLOWED_TAGS = {
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'p', 'br', 'hr', 'ul', 'ol', 'li', 'dl', 'dt', 'dd',
+    'a', 'strong', 'em', 'b', 'i', 'u', 'small', 'mark', 'sub', 'sup', 'code', 'pre', 'blockquote',
+    'q', 'cite', 'abbr', 'span', 'div', 'section', 'article', 'aside', 'address', 'time', 'details',
+    'summary', 'figure', 'figcaption', 'table', 'caption', 'thead', 'tbody', 'tfoot', 'tr', 'th', 'td',
+    'form', 'fieldset', 'legend', 'label', 'input', 'textarea', 'select', 'option', 'optgroup', 'button',
+}
+VOID_TAGS = {'br', 'hr', 'input'}
+# Removed together with everything inside them
+DROPPED_WITH_CONTENT = {
+    'title', 'script', 'style', 'noscript', 'template', 'iframe', 'object', 'embed', 'svg', 'math',
+    'canvas', 'video', 'audio', 'picture', 'map', 'header', 'nav', 'footer',
+}
+# <head> itself is unwrapped: everything it may hold is dropped on its own, and its <title> is kept for .title
+COMMON_ATTRIBUTES = {'class', 'id', 'title', 'role'}
+TAG_ATTRIBUTES = {
+    'label': {'for'},
+    'input': {'type', 'name', 'placeholder', 'value', 'required', 'checked', 'disabled', 'min', 'max', 'step', 'pattern', 'autocomplete'},
+    'textarea': {'name', 'rows', 'cols', 'placeholder', 'required'},
+    'select': {'name', 'required', 'multiple'},
+    'option': {'value', 'selected'},
+    'button': {'type', 'name', 'value'},
+    'form': {'method'},
+    'th': {'colspan', 'rowspan', 'scope'},
+    'td': {'colspan', 'rowspan'},
+    'ol': {'start', 'type'},
+    'time': {'datetime'},
+    'details': {'open'},
+}
+# Opening one of these closes an open element of the same family and everything inside it, as
+# browsers do, unless one of the boundary elements comes first: tag -> (family, boundaries)
+TABLE_SECTIONS = {'thead', 'tbody', 'tfoot'}
+IMPLIED_END = {
+    'li': ({'li'}, {'ul', 'ol'}),
+    'dt': ({'dt', 'dd'}, {'dl'}),
+    'dd': ({'dt', 'dd'}, {'dl'}),
+    'thead': (TABLE_SECTIONS, {'table'}),
+    'tbody': (TABLE_SECTIONS, {'table'}),
+    'tfoot': (TABLE_SECTIONS, {'table'}),
+    'tr': ({'tr'}, {'table'} | TABLE_SECTIONS),
+    'td': ({'td', 'th'}, {'tr', 'table'}),
+    'th': ({'td', 'th'}, {'tr', 'table'}),
+    'option': ({'option'}, {'select', 'optgroup'}),
+    'a': ({'a'}, {'td', 'th', 'caption'}), # Links never nest
+}
+CLOSES_PARAGRAPH = {'p', 'div', 'ul', 'ol', 'dl', 'li', 'dt', 'dd', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'table', 'section',
+                    'article', 'aside', 'blockquote', 'pre', 'form', 'fieldset', 'figure', 'details', 'hr', 'address'}
+PARAGRAPH_BOUNDARIES = {'table', 'td', 'th', 'caption', 'button'}
+
+NAVIGATE_TO_PATTERN = re.compile(r"""navigateTo\(\s*['"]([^'"]*)['"]\s*\)""")
+SAFE_PATH_PATTERN = re.compile(r'^/[A-Za-z0-9/_\-.~%]*$')
+SCHEME_PATTERN = re.compile(r'^[A-Za-z][A-Za-z0-9+.\-]*:')
+
+
+def internal_link_target(link):
+    """Returns the site path a link points to, or None if it is not a safe internal link."""
+    link = (link or "").strip()
+    if not link or link.startswith(('#', '//')) or SCHEME_PATTERN.match(link):
+        return None
+    path = re.split(r'[?#]', link, 1)[0]
+    if not path.startswith('/'):
+        path = '/' + path # Relative links resolve against the site root, where every page lives
+    return path if SAFE_PATH_PATTERN.match(path) else None
+
+
+class ContentPipeline(HTMLParser):
+    """
+    feed() each piece of a response, then close(). Both return the sanitized HTML completed by
+    that call, to be appended to what was returned before - unless `replaced` is True after
+    the call, in which case the returned HTML replaces everything so far (the response turned
+    out to be a whole document and its <main> or <body> just started). `html` is the result.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.links = [] # Internal paths linked to, in order, without duplicates
+        self._linked = set()
+        self.source = "fragment" # "main" or "body" if the content was extracted from one
+        self.replaced = False
+        self._document_title = None
+        self._headings = {} # 'h1'/'h2' -> text of the first one
+        self._title_parts = None # Collecting text for a title candidate while not None
+        self._title_tag = None # ... from this element
+        self._parts = []
+        self._returned = 0 # Number of _parts already handed to the caller
+        self._open = [] # Stack of emitted, still-open tags
+        self._skip = None # [tag, depth] while inside a DROPPED_WITH_CONTENT element
+        self._scope_depth = 0 # Nesting of the <main>/<body> element we extract from
+        self._finished = False # The extracted element has closed; ignore the rest
+
+    @property
+    def title(self):
+        return self._document_title or self._headings.get('h1') or self._headings.get('h2')
+
+    @property
+    def html(self):
+        return "".join(self._parts).strip()
+
+    def feed(self, data):
+        self.replaced = False
+        super().feed(data)
+        return self._take_new()
+
+    def close(self):
+        self.replaced = False
+        super().close()
+        self._close_open_tags()
+        return self._take_new()
+
+    def _take_new(self):
+        new_html = "".join(self._parts[self._returned:])
+        self._returned = len(self._parts)
+        return new_html
+
+    def _emit(self, html_text):
+        self._parts.append(html_text)
+
+    def _restart(self, source):
+        """Discards output so far: the content we want starts inside this element."""
+        self.source = source
+        self._parts, self._returned, self._open = [], 0, []
+        self.links, self._linked, self._headings = [], set(), {}
+        self.replaced = True
+
+    def _close_open_tags(self, down_to=0):
+        while len(self._open) > down_to:
+            self._emit(f"</{self._open.pop()}>")
+
+    def _close_implied(self, tags, boundaries):
+        """Closes the innermost open element in tags and everything inside it, unless a boundary element is nearer."""
+        for position in range(len(self._open) - 1, -1, -1):
+            if self._open[position] in tags:
+                self._close_open_tags(down_to=position)
+                return
+            if self._open[position] in boundaries:
+                return
+
+    def _attributes(self, tag, attrs):
+        allowed = COMMON_ATTRIBUTES | TAG_ATTRIBUTES.get(tag, set())
+        rendered = []
+        for name, value in attrs:
+            if name in allowed or name.startswith('aria-'):
+                rendered.append(f' {name}' if value is None else f' {name}="{escape(value)}"')
+        return "".join(rendered)
+
+    def _link_start(self, attrs):
+        """Returns the rewritten <a> start tag, or None to unwrap the link."""
+        attributes = dict(attrs)
+        href = (attributes.get('href') or "").strip()
+        navigate_match = NAVIGATE_TO_PATTERN.search(attributes.get('onclick') or "")
+        other_attributes = self._attributes('a', [(name, value) for name, value in attrs if name not in ('href', 'onclick')])
+        target = internal_link_target(navigate_match.group(1) if navigate_match else href)
+        if target:
+            if target not in self._linked:
+                self._linked.add(target)
+                self.links.append(target)
+            return f"<a href=\"{target}\" onclick=\"event.preventDefault(); navigateTo('{target}')\"{other_attributes}>"
+        if href.startswith('#') or href.lower().startswith(('mailto:', 'tel:')):
+            return f'<a href="{escape(href)}"{other_attributes}>'
+        return None
+
+    def handle_starttag(self, tag, attrs):
+        if self._skip is not None:
+            if tag == self._skip[0]:
+                self._skip[1] += 1
+            return
+        if self._finished:
+            return
+        if tag in ('main', 'body'):
+            if self.source == "fragment" or (tag == 'main' and self.source == "body"):
+                self._restart(tag)
+                self._scope_depth = 1
+            elif tag == self.source:
+                self._scope_depth += 1
+            return
+        if tag in DROPPED_WITH_CONTENT:
+            self._skip = [tag, 1]
+            if tag == 'title' and self._document_title is None:
+                self._title_parts, self._title_tag = [], 'title'
+            return
+        if tag not in ALLOWED_TAGS:
+            return # Unwrapped: its text is kept
+
+        # Before an unwrapped link returns too: its text must not stay inside an open link
+        if tag in IMPLIED_END:
+            self._close_implied(*IMPLIED_END[tag])
+        if tag in CLOSES_PARAGRAPH:
+            self._close_implied({'p'}, PARAGRAPH_BOUNDARIES)
+        if tag == 'a':
+            start_tag = self._link_start(attrs)
+            if start_tag is None:
+                return
+        else:
+            start_tag = f"<{tag}{self._attributes(tag, attrs)}>"
+        self._emit(start_tag)
+        if tag not in VOID_TAGS:
+            self._open.append(tag)
+            if tag in ('h1', 'h2') and tag not in self._headings and self._title_parts is None:
+                self._title_parts, self._title_tag = [], tag
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if self._skip is not None:
+            if tag == self._skip[0]:
+                self._skip[1] -= 1
+                if self._skip[1] == 0:
+                    self._skip = None
+                    self._finish_title('title')
+            return
+        if self._finished:
+            return
+        if tag in ('main', 'body') and tag == self.source:
+            self._scope_depth -= 1
+            if self._scope_depth == 0:
+                self._close_open_tags()
+                self._finished = True
+            return
+        if tag in VOID_TAGS or tag not in self._open:
+            return # Stray, unwrapped or dropped element
+        position = len(self._open) - 1 - self._open[::-1].index(tag)
+        self._close_open_tags(down_to=position)
+        if tag == self._title_tag:
+            self._finish_title(tag)
+
+    def _finish_title(self, source_tag):
+        if self._title_parts is None or source_tag != self._title_tag:
+            return
+        text = " ".join("".join(self._title_parts).split())
+        self._title_parts, self._title_tag = None, None
+        if text and source_tag == 'title':
+            self._document_title = text
+        elif text:
+            self._headings[source_tag] = text
+
+    def handle_data(self, data):
+        if self._title_parts is not None and (self._skip is None or self._skip[0] == 'title'):
+            self._title_parts.append(data)
+        if self._skip is not None or self._finished:
+            return
+        self._emit(escape(data, quote=False))
+
+    # Comments, doctypes and processing instructions are dropped
+    def handle_comment(self, data):
+        pass
+
+    def handle_decl(self, decl):
+        pass
+
+    def handle_pi(self, data):
+        pass
+
+    def unknown_decl(self, data):
+        pass
+
+
+def clean_html(raw_content):
+    """Runs a complete response through ContentPipeline. Returns the finished pipeline."""
+    pipeline = ContentPipeline()
+    pipeline.feed(raw_content or "")
+    pipeline.close()
+    return pipeline
@@ -0,0 +1,93 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from email.utils import formatdate
+
+from flask import request, Response
+
+try:
+    import brotli # Optional: enables br responses when installed
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this aren't worth the Content-Encoding overhead
+MIN_COMPRESS_BYTES = 512
+
+
+def make_etag(*parts):
+    """Strong validator derived from the given parts (content digests, versions, paths)."""
+    digest = hashlib.blake2b(digest_size=12)
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class CompressedBodyCache:
+    """
+    Byte-bounded LRU of compressed response bodies keyed by (etag, encoding). Each version
+    of a response is compressed once, at maximum compression levels, and then served as-is.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compress(self, etag, encoding, body):
+        key = (etag, encoding)
+        with self._lock:
+            compressed = self._entries.get(key)
+            if compressed is not None:
+                self._entries.move_to_end(key)
+                return compressed
+        if encoding == 'br':
+            compressed = brotli.compress(body, quality=11)
+        else:
+            compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        with self._lock:
+            if key not in self._entries and len(compressed) <= self.max_bytes:
+                self._entries[key] = compressed
+                self.current_bytes += len(compressed)
+                while self.current_bytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self.current_bytes -= len(evicted)
+        return compressed
+
+
+def negotiate_encoding():
+    """Picks the best Content-Encoding the client accepts: br (if available), then gzip."""
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return request.accept_encodings.best_match(offered)
+
+def cached_response(render_body, etag, compressed_cache, cache_control, mimetype='text/html', last_modified=None):
+    """
+    Builds a response with ETag/Last-Modified validators, answering conditional GETs with
+    304 before the body is rendered. render_body() returns the body as str and is only
+    called when the body is actually sent; compressed variants come from compressed_cache.
+    """
+    encoding = negotiate_encoding()
+    representation_etag = f"{etag}-{encoding}" if encoding else etag # Each encoding is its own strong representation
+    headers = {
+        "ETag": f'"{representation_etag}"',
+        "Cache-Control": cache_control,
+        "Vary": "Accept-Encoding"
+    }
+    if last_modified:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(representation_etag)
+    else:
+        not_modified = bool(last_modified and request.if_modified_since
+                            and int(last_modified) <= request.if_modified_since.timestamp())
+    if not_modified:
+        return Response(status=304, headers=headers)
+
+    body = render_body().encode('utf-8')
+    if encoding and len(body) >= MIN_COMPRESS_BYTES:
+        body = compressed_cache.get_or_compress(representation_etag, encoding, body)
+        headers["Content-Encoding"] = encoding
+    return Response(body, mimetype=mimetype, headers=headers)
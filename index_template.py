@@ -0,0 +1,62 @@
+import os
+import re
+
+
+class CompiledTemplate:
+    """
+    A template parsed once into static segments and named slots, so rendering is a
+    single join with no disk I/O and no whole-document str.replace passes.
+
+    markers maps each literal placeholder in the file to a slot name. Slots listed in
+    constants are folded into the static segments at compile time; the remaining slots
+    are filled per render.
+    """
+
+    def __init__(self, filepath, markers, constants=None):
+        self.filepath = filepath
+        self.markers = markers
+        self.constants = constants or {}
+        self._parts = None # Alternating [static, slot_name, static, ..., static]
+        self._mtime_ns = None
+
+    def compile(self):
+        with open(self.filepath, 'r', encoding='utf-8') as f:
+            mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+            source = f.read()
+
+        # Longest markers first so a marker containing another is matched whole
+        pattern = re.compile("|".join(re.escape(m) for m in sorted(self.markers, key=len, reverse=True)))
+        parts = [""]
+        position = 0
+        for match in pattern.finditer(source):
+            parts[-1] += source[position:match.start()]
+            slot_name = self.markers[match.group(0)]
+            if slot_name in self.constants:
+                parts[-1] += self.constants[slot_name]
+            else:
+                parts.append(slot_name)
+                parts.append("")
+            position = match.end()
+        parts[-1] += source[position:]
+
+        self._parts = parts
+        self._mtime_ns = mtime_ns
+
+    @property
+    def version(self):
+        """Changes whenever the template is recompiled from a modified file."""
+        return self._mtime_ns
+
+    def reload_if_changed(self):
+        """Recompiles if the template file changed on disk. Intended for dev mode."""
+        if self._parts is None or os.stat(self.filepath).st_mtime_ns != self._mtime_ns:
+            self.compile()
+
+    def render(self, **slot_values):
+        if self._parts is None:
+            self.compile()
+        parts = self._parts
+        pieces = parts[:]
+        for i in range(1, len(parts), 2):
+            pieces[i] = slot_values.get(parts[i], "")
+        return "".join(pieces)
@@ -0,0 +1,104 @@
+import os
+import sys
+import json
+import threading
+
+try:
+    import fcntl # Serializes appends and rewrites across gunicorn worker processes
+except ImportError:
+    fcntl = None
+
+
+class JsonLinesLog:
+    """
+    Append-only JSON-lines file shared by all worker processes. Each reader tails it:
+    read_new() stats the file and parses only the lines appended since its last call,
+    so keeping an in-memory view in sync costs one stat when nothing changed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self._offset = 0
+        self._inode = None
+        self._read_lock = threading.Lock()
+        self._write_lock = threading.Lock() # Stands in for the file lock where flock is unavailable
+
+    @property
+    def version(self):
+        """Identifies the contents read so far; changes whenever new lines are consumed."""
+        return f"{self._inode or 0:x}-{self._offset:x}"
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def read_new(self, revalidate=False):
+        """
+        Returns (entries, reset). entries are the complete lines appended since the last call;
+        reset is True if the file was replaced or truncated, in which case entries holds the
+        whole file and the caller should rebuild its view from scratch.
+        Raises FileNotFoundError if the log does not exist. revalidate is accepted for parity
+        with SharedLog; the file is always stat'ed.
+        """
+        stat_result = os.stat(self.path)
+        if stat_result.st_ino == self._inode and stat_result.st_size == self._offset:
+            return [], False
+
+        with self._read_lock:
+            reset = stat_result.st_ino != self._inode or stat_result.st_size < self._offset
+            if reset:
+                self._offset = 0
+            with open(self.path, 'rb') as f:
+                self._inode = os.fstat(f.fileno()).st_ino
+                f.seek(self._offset)
+                data = f.read()
+            complete_end = data.rfind(b"\n") + 1 # Ignore a trailing line still being written
+            entries = []
+            for raw_line in data[:complete_end].splitlines():
+                try:
+                    entries.append(json.loads(raw_line))
+                except ValueError as e:
+                    print(f"jsonl_log.py Skipping malformed line in {self.path} {raw_line[:80]!r}: {e}", file=sys.stderr)
+            self._offset += complete_end
+        return entries, reset
+
+    def append(self, entry):
+        line = json.dumps(entry) + "\n"
+        with self.lock():
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+    def rewrite(self, entries):
+        """Atomically replaces the whole log. Call while holding lock()."""
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(entry) + "\n" for entry in entries)
+        os.replace(tmp_path, self.path)
+
+    def lock(self):
+        """Exclusive lock across processes for appends and rewrites."""
+        return _FileLock(self.lock_path, self._write_lock if fcntl is None else None)
+
+
+class _FileLock:
+    """Exclusive flock on a lock file, or a plain thread lock where flock is unavailable."""
+
+    def __init__(self, path, fallback_lock):
+        self.path = path
+        self.fallback_lock = fallback_lock
+        self._file = None
+
+    def __enter__(self):
+        if self.fallback_lock is not None:
+            self.fallback_lock.acquire()
+            return self
+        self._file = open(self.path, 'a')
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.fallback_lock is not None:
+            self.fallback_lock.release()
+            return
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
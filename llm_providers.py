@@ -0,0 +1,248 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+
+from metrics import LLM_TOKENS, LLM_COST
+
+
+class LLMProvider:
+    """
+    Chat-completion backend used by page.py. messages are OpenAI-style role/content dicts;
+    json_response asks for a single JSON object. Errors propagate to the caller.
+    """
+    name = "base"
+    input_price = 0.0 # Dollars per million tokens, for the cost metric
+    output_price = 0.0
+
+    def record_usage(self, input_tokens, output_tokens):
+        """Adds a call's token usage, and its estimated cost, to the LLM metrics."""
+        LLM_TOKENS.inc(input_tokens, provider=self.name, direction="input")
+        LLM_TOKENS.inc(output_tokens, provider=self.name, direction="output")
+        LLM_COST.inc((input_tokens * self.input_price + output_tokens * self.output_price) / 1_000_000, provider=self.name)
+
+    def complete(self, messages, json_response=False):
+        """Returns the full response text."""
+        raise NotImplementedError
+
+    def stream(self, messages):
+        """Yields response text deltas as they arrive."""
+        raise NotImplementedError
+
+    async def async_complete(self, messages, json_response=False):
+        raise NotImplementedError
+
+    async def async_stream(self, messages):
+        raise NotImplementedError
+        yield # Makes this an async generator like the implementations
+
+
+class OpenAIProvider(LLMProvider):
+    """
+    OpenAI chat completions. The SDK is imported and the clients are created on first use, so
+    processes that only serve cached pages never pay for either, and need no API key.
+    """
+    name = "openai"
+
+    def __init__(self, model):
+        self.model = model
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from openai import OpenAI
+                    self._client = OpenAI() # Assumes OPENAI_API_KEY is in environment
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            with self._lock:
+                if self._async_client is None:
+                    from openai import AsyncOpenAI
+                    self._async_client = AsyncOpenAI()
+        return self._async_client
+
+    def _request(self, messages, json_response=False, stream=False):
+        request = {"model": self.model, "messages": messages}
+        if json_response:
+            request["response_format"] = {"type": "json_object"}
+        if stream:
+            request["stream"] = True
+            request["stream_options"] = {"include_usage": True} # Final chunk carries token usage
+        return request
+
+    def _record_response_usage(self, response):
+        if getattr(response, "usage", None):
+            self.record_usage(response.usage.prompt_tokens, response.usage.completion_tokens)
+
+    def complete(self, messages, json_response=False):
+        response = self.client.chat.completions.create(**self._request(messages, json_response))
+        self._record_response_usage(response)
+        return response.choices[0].message.content
+
+    def stream(self, messages):
+        for chunk in self.client.chat.completions.create(**self._request(messages, stream=True)):
+            self._record_response_usage(chunk)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def async_complete(self, messages, json_response=False):
+        response = await self.async_client.chat.completions.create(**self._request(messages, json_response))
+        self._record_response_usage(response)
+        return response.choices[0].message.content
+
+    async def async_stream(self, messages):
+        async for chunk in await self.async_client.chat.completions.create(**self._request(messages, stream=True)):
+            self._record_response_usage(chunk)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class MockProviderError(RuntimeError):
+    """Injected failure from MockProvider."""
+
+
+MOCK_VOCABULARY = (
+    "reliable installation service local team quality charging energy efficient home business "
+    "support certified fast safe modern solution customer experience trusted expert planning "
+    "maintenance upgrade schedule estimate project warranty performance network power"
+).split()
+
+class MockProvider(LLMProvider):
+    """
+    Deterministic offline stand-in for load testing and development: no API key, no spend.
+    Each call waits latency_seconds (time to first token), then emits response_tokens words at
+    tokens_per_second; error_rate is the fraction of calls that fail with MockProviderError.
+    The same prompt always produces the same page, including a few internal links.
+    """
+    name = "mock"
+
+    def __init__(self, latency_seconds=0.5, tokens_per_second=50.0, error_rate=0.0, response_tokens=300, seed=0):
+        self.latency_seconds = latency_seconds
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.response_tokens = response_tokens
+        self.calls = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _begin_call(self):
+        """Counts a call and decides up front whether it fails."""
+        with self._lock:
+            self.calls += 1
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        return failed
+
+    def _token_delay(self):
+        return 1.0 / self.tokens_per_second if self.tokens_per_second and self.tokens_per_second > 0 else 0.0
+
+    def _render(self, messages, json_response=False):
+        request_text = messages[-1]["content"] if messages else ""
+        topic_match = re.search(r"'([^']*)' page", request_text) or re.search(r"search: (.*)$", request_text, re.DOTALL)
+        topic = (topic_match.group(1) if topic_match else request_text).strip() or "homepage"
+        slug = re.sub(r'[^a-z0-9]+', '-', topic.lower()).strip('-') or "page"
+        rng = random.Random(hashlib.sha256(topic.encode('utf-8')).digest())
+
+        parts = [f"<h2>{topic.replace('-', ' ').replace('/', ' ').title()}</h2>"]
+        words_left = self.response_tokens
+        while words_left > 0:
+            sentence_count = min(words_left, 40)
+            parts.append("<p>" + " ".join(rng.choice(MOCK_VOCABULARY) for _ in range(sentence_count)).capitalize() + ".</p>")
+            words_left -= sentence_count
+        related = sorted({rng.choice(MOCK_VOCABULARY) for _ in range(3)})
+        parts.append("<ul>" + "".join(
+            f"<li><a href=\"/{slug}/{word}\" onclick=\"event.preventDefault(); navigateTo('/{slug}/{word}')\">{word.title()}</a></li>"
+            for word in related) + "</ul>")
+        html = "\n".join(parts)
+        if json_response:
+            return json.dumps({"url_path": f"/{slug}", "content": html})
+        return html
+
+    @staticmethod
+    def _tokens(text):
+        return re.findall(r'\S+\s*|\s+', text)
+
+    def _record_mock_usage(self, messages, tokens):
+        # Roughly four characters per token, as for English text with real tokenizers
+        self.record_usage(sum(len(message["content"]) for message in messages) // 4, len(tokens))
+
+    def complete(self, messages, json_response=False):
+        failed = self._begin_call()
+        time.sleep(self.latency_seconds)
+        if failed:
+            raise MockProviderError("Injected mock LLM failure")
+        text = self._render(messages, json_response)
+        tokens = self._tokens(text)
+        self._record_mock_usage(messages, tokens)
+        time.sleep(len(tokens) * self._token_delay())
+        return text
+
+    def stream(self, messages):
+        failed = self._begin_call()
+        time.sleep(self.latency_seconds)
+        if failed:
+            raise MockProviderError("Injected mock LLM failure")
+        token_delay = self._token_delay()
+        tokens = self._tokens(self._render(messages))
+        self._record_mock_usage(messages, tokens)
+        for token in tokens:
+            if token_delay:
+                time.sleep(token_delay)
+            yield token
+
+    async def async_complete(self, messages, json_response=False):
+        failed = self._begin_call()
+        await asyncio.sleep(self.latency_seconds)
+        if failed:
+            raise MockProviderError("Injected mock LLM failure")
+        text = self._render(messages, json_response)
+        tokens = self._tokens(text)
+        self._record_mock_usage(messages, tokens)
+        await asyncio.sleep(len(tokens) * self._token_delay())
+        return text
+
+    async def async_stream(self, messages):
+        failed = self._begin_call()
+        await asyncio.sleep(self.latency_seconds)
+        if failed:
+            raise MockProviderError("Injected mock LLM failure")
+        token_delay = self._token_delay()
+        tokens = self._tokens(self._render(messages))
+        self._record_mock_usage(messages, tokens)
+        for token in tokens:
+            if token_delay:
+                await asyncio.sleep(token_delay)
+            yield token
+
+
+def make_llm_provider(config, model):
+    """
+    Builds the provider named by the LLM_PROVIDER environment variable or config "llm_provider"
+    ("openai", the default, or "mock", configured by config "mock_llm"). Config
+    "llm_prices_per_million_tokens" ({"input": ..., "output": ...}) prices the cost metric.
+    """
+    provider_name = os.environ.get("LLM_PROVIDER") or config.get("llm_provider", "openai")
+    if provider_name == "mock":
+        provider = MockProvider(**config.get("mock_llm", {}))
+    else:
+        if provider_name != "openai":
+            print(f"llm_providers.py Warning: Unknown llm_provider '{provider_name}'. Using openai.", file=sys.stderr)
+        provider = OpenAIProvider(model)
+    prices = config.get("llm_prices_per_million_tokens", {})
+    provider.input_price = prices.get("input", 0.0)
+    provider.output_price = prices.get("output", 0.0)
+    return provider
@@ -0,0 +1,117 @@
+import os
+import sys
+import bisect
+import threading
+
+from jsonl_log import JsonLinesLog
+
+
+class MenuIndex:
+    """
+    Persistent, incrementally maintained index of cached pages for the navigation menu.
+
+    The index is an append-only log in the cache directory with one JSON line per cached
+    page. Each worker keeps the menu pre-sorted in memory and, per request, only stats the
+    log and parses lines appended since its last read, so building the menu no longer
+    lists the cache directory. Deleting the log file triggers a one-time rebuild from
+    list_files(), by default a directory scan. Pass `log` to keep the log elsewhere (e.g. a
+    shared_cache.SharedLog, so every node sees pages generated on the others).
+    """
+
+    def __init__(self, cache_dir, display_name, content_suffix="_content.html", log_filename=".menu_index.jsonl", list_files=None, log=None):
+        self.cache_dir = cache_dir
+        self.display_name = display_name
+        self.list_files = list_files or (lambda: os.listdir(cache_dir))
+        self.content_suffix = content_suffix
+        self.log = log or JsonLinesLog(os.path.join(cache_dir, log_filename))
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._files = set()
+        self._keys = [] # Sort keys, parallel to _items
+        self._items = [] # Menu item dicts, shared read-only between requests
+
+    @property
+    def version(self):
+        """Changes whenever a page is added to the menu; suitable for cache validators."""
+        self._refresh()
+        return self.log.version
+
+    def menu_for(self, current_path):
+        """Returns the sorted menu with current_path flagged, adding it if it is not cached yet."""
+        self._refresh()
+        key = self._sort_key(current_path)
+        with self._lock:
+            items = list(self._items)
+            position = bisect.bisect_left(self._keys, key)
+            while position < len(items) and self._keys[position] == key:
+                if items[position]["path"] == current_path:
+                    items[position] = {**items[position], "is_current": True}
+                    return items
+                position += 1
+            position = bisect.bisect_left(self._keys, key) # Current page sorts ahead of equal names
+        items.insert(position, {"name": self.display_name(current_path), "path": current_path, "is_current": True})
+        return items
+
+    def paths(self):
+        """Returns every indexed page path, in menu order."""
+        self._refresh()
+        with self._lock:
+            return [item["path"] for item in self._items]
+
+    def add(self, cache_filename, path):
+        """Records a newly written cache file. Cheap no-op if it is already indexed."""
+        self._refresh()
+        if cache_filename in self._files:
+            return
+        self.log.append({"file": cache_filename, "path": path})
+        self._refresh()
+
+    def _sort_key(self, path):
+        return (path != '/', self.display_name(path))
+
+    def _insert(self, cache_filename, path):
+        if cache_filename in self._files:
+            return
+        self._files.add(cache_filename)
+        key = self._sort_key(path)
+        position = bisect.bisect_right(self._keys, key)
+        self._keys.insert(position, key)
+        self._items.insert(position, {"name": self.display_name(path), "path": path, "is_current": False})
+
+    def _refresh(self):
+        """Tails the log, applying only lines appended since the last refresh."""
+        with self._lock:
+            try:
+                entries, reset = self.log.read_new()
+            except FileNotFoundError:
+                entries, reset = None, False
+            if reset:
+                self._reset() # Log was rebuilt or replaced; reload from the start
+            for entry in entries or ():
+                try:
+                    self._insert(entry["file"], entry["path"])
+                except (KeyError, TypeError) as e:
+                    print(f"menu_index.py Skipping malformed menu index entry {entry!r}: {e}", file=sys.stderr)
+        if entries is None:
+            self._rebuild()
+
+    def _path_from_filename(self, filename):
+        # Best-effort inverse of the cache filename sanitization, used only when rebuilding
+        original_path_base = filename[:-len(self.content_suffix)]
+        if original_path_base == 'index':
+            return '/'
+        return '/' + original_path_base.replace('_', '/')
+
+    def _rebuild(self):
+        with self.log.lock():
+            if self.log.exists():
+                return # Another worker rebuilt it while we waited
+            print(f"menu_index.py Rebuilding menu index from {self.cache_dir}.", file=sys.stderr)
+            self.log.rewrite(
+                {"file": filename, "path": self._path_from_filename(filename)}
+                for filename in sorted(self.list_files())
+                if filename.endswith(self.content_suffix) and not filename.startswith('.')
+            )
+        self._refresh()
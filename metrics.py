@@ -0,0 +1,251 @@
+"""
+Prometheus-style counters, histograms and gauges, rendered by render_metrics() for /metrics.
+
+Metrics live in each process's memory. Under gunicorn, which runs several worker processes
+and routes each scrape to any one of them, gunicorn.conf.py sets SITE_METRICS_DIR: every
+worker then writes a snapshot of its metrics to <SITE_METRICS_DIR>/<pid>.json every
+FLUSH_SECONDS and when it exits (gunicorn.conf.py's worker_exit), and render_metrics() returns the sum over all snapshots,
+like prometheus_client's multiprocess mode. Counters and histograms of exited workers keep
+counting towards the totals, so they never go backwards; gauges only sum live workers.
+"""
+import os
+import sys
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Upper bounds (seconds) for request-path timings, and for LLM calls, which run far longer
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LLM_BUCKETS = (0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+FLUSH_SECONDS = 1.0 # How stale another worker's figures can be in a scrape
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+    from_exited_workers = True # Whether snapshots of workers that have exited still count
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {} # label values tuple -> value
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def snapshot(self):
+        """This process's values: label values tuple -> value."""
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(total, value):
+        return value if total is None else total + value
+
+    def render(self, values):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for labelvalues, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Gauge whose value is read from a callable at scrape time."""
+    kind = "gauge"
+    from_exited_workers = False
+
+    def __init__(self, name, help_text, read_value):
+        super().__init__(name, help_text)
+        self.read_value = read_value
+
+    def snapshot(self):
+        return {(): self.read_value()}
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[position] += 1
+            self._values[key] = (counts, total + value)
+
+    def snapshot(self):
+        with self._lock:
+            return {labelvalues: (list(counts), total) for labelvalues, (counts, total) in self._values.items()}
+
+    @staticmethod
+    def merge(total, value):
+        if total is None:
+            return list(value[0]), value[1]
+        return [a + b for a, b in zip(total[0], value[0])], total[1] + value[1]
+
+    def render(self, values):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for labelvalues, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, [("le", _format_value(upper_bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+# --- MULTI-PROCESS AGGREGATION --- START ---
+def metrics_dir():
+    return os.environ.get("SITE_METRICS_DIR")
+
+def _snapshot_all():
+    return {metric.name: metric.snapshot() for metric in _registry}
+
+def write_snapshot():
+    """Writes this process's metrics to <SITE_METRICS_DIR>/<pid>.json, if aggregation is on."""
+    directory = metrics_dir()
+    if not directory:
+        return
+    payload = {name: [[list(labelvalues), value] for labelvalues, value in values.items()]
+               for name, values in _snapshot_all().items()}
+    snapshot_path = os.path.join(directory, f"{os.getpid()}.json")
+    tmp_path = f"{snapshot_path}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, snapshot_path)
+    except (OSError, TypeError, ValueError) as e:
+        print(f"metrics.py Error writing metrics snapshot {snapshot_path}: {e}", file=sys.stderr)
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _other_workers_snapshots():
+    """Yields (is_alive, {metric name: {label values tuple: value}}) for every other worker's snapshot."""
+    directory = metrics_dir()
+    if not directory:
+        return
+    try:
+        filenames = os.listdir(directory)
+    except OSError as e:
+        print(f"metrics.py Error listing metrics snapshots in {directory}: {e}", file=sys.stderr)
+        return
+    for filename in filenames:
+        pid_text, extension = os.path.splitext(filename)
+        if extension != ".json" or not pid_text.isdigit() or int(pid_text) == os.getpid():
+            continue
+        try:
+            with open(os.path.join(directory, filename), 'r', encoding='utf-8') as f:
+                payload = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"metrics.py Skipping unreadable metrics snapshot {filename}: {e}", file=sys.stderr)
+            continue
+        yield _is_alive(int(pid_text)), {name: {tuple(labelvalues): value for labelvalues, value in entries}
+                                          for name, entries in payload.items()}
+
+def start_flusher():
+    """Starts writing this process's snapshot every FLUSH_SECONDS. Call once in each worker, after forking."""
+    if not metrics_dir():
+        return
+    def flush_forever():
+        while True:
+            time.sleep(FLUSH_SECONDS)
+            write_snapshot()
+    threading.Thread(target=flush_forever, name="metrics-flusher", daemon=True).start()
+# --- MULTI-PROCESS AGGREGATION --- END ---
+
+
+def render_metrics():
+    """All registered metrics, summed over every worker's snapshot, in the Prometheus text exposition format."""
+    own_snapshot = _snapshot_all()
+    totals = {metric.name: {} for metric in _registry}
+    snapshots = [(True, own_snapshot)] + list(_other_workers_snapshots())
+    lines = []
+    for metric in _registry:
+        values = totals[metric.name]
+        for is_alive, snapshot in snapshots:
+            if not is_alive and not metric.from_exited_workers:
+                continue
+            for labelvalues, value in snapshot.get(metric.name, {}).items():
+                values[labelvalues] = metric.merge(values.get(labelvalues), value)
+        lines.extend(metric.render(values))
+    return "\n".join(lines) + "\n"
+
+
+# --- SITE METRICS --- START ---
+SPAN_SECONDS = Histogram("site_span_seconds", "Duration of instrumented hot-path steps.", ["span"])
+HTTP_REQUEST_SECONDS = Histogram("site_http_request_seconds", "Time to produce a response, by endpoint and status.", ["endpoint", "status"])
+CACHE_LOOKUPS = Counter("site_cache_lookups_total", "Content cache lookups by result (hit, stale, miss, error).", ["result"])
+LLM_REQUESTS = Counter("site_llm_requests_total", "LLM calls by kind (page, stream, search) and outcome (ok, error).", ["kind", "outcome"])
+LLM_SECONDS = Histogram("site_llm_seconds", "LLM call duration, including streaming the whole response.", ["kind"], buckets=LLM_BUCKETS)
+LLM_TOKENS = Counter("site_llm_tokens_total", "LLM tokens by provider and direction (input, output).", ["provider", "direction"])
+LLM_COST = Counter("site_llm_cost_dollars_total", "Estimated LLM spend from the configured per-token prices.", ["provider"])
+ADMISSIONS = Counter("site_admissions_total", "LLM generation admission outcomes (admitted, admitted_after_wait, rejected_<reason>).", ["outcome"])
+SEARCH_DEDUP = Counter("site_ai_search_dedup_total", "AI searches answered from an already-cached page instead of the LLM.")
+PREFETCHES = Counter("site_prefetch_total", "Speculative link prefetches by outcome (queued, generated, skipped_cached, dropped_queue_full, dropped_budget, failed).", ["outcome"])
+# --- SITE METRICS --- END ---
+
+
+@contextmanager
+def span(name):
+    """Times the enclosed block into site_span_seconds{span=name}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        SPAN_SECONDS.observe(time.perf_counter() - start, span=name)
+
+@contextmanager
+def llm_call(kind):
+    """Times an LLM call and counts its outcome; an exception escaping the block counts as an error."""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        LLM_SECONDS.observe(time.perf_counter() - start, kind=kind)
+        LLM_REQUESTS.inc(kind=kind, outcome=outcome)
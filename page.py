@@ -1,114 +1,150 @@
+import re
 import sys
-import os
 import json
-from openai import OpenAI
-import re
+import hashlib
+import random
+import functools
+from llm_providers import make_llm_provider
+from metrics import llm_call
+from html_pipeline import clean_html
+from site_config import config # Loaded and validated once per process, shared with app.py
 
 # --- CONFIGURATION LOADING --- START --- 
-CONFIG_FILE_PATH = os.path.join(os.path.dirname(__file__), 'config.json')
-
-
-config = CONFIG_FILE_PATH
-try:
-    with open(CONFIG_FILE_PATH, 'r') as f:
-        config = json.load(f)
-    # print(f"page.py: Successfully loaded configuration from {CONFIG_FILE_PATH}", file=sys.stderr)
-except FileNotFoundError:
-    print(f"page.py Warning: {CONFIG_FILE_PATH} not found. Using default configuration.", file=sys.stderr)
-except json.JSONDecodeError as e:
-    print(f"page.py Error decoding {CONFIG_FILE_PATH}: {e}. Using default configuration.", file=sys.stderr)
-except Exception as e:
-    print(f"page.py An unexpected error occurred loading {CONFIG_FILE_PATH}: {e}. Using default configuration.", file=sys.stderr)
-
 LLM_MODEL = config.get("llm_model")
-WEBSITE_PROFILE = config.get("website_profile")
+WEBSITE_PROFILE = config.get("website_profile", {})
 SYSTEM_PROMPT_TEMPLATE = config.get("system_prompt_template")
 BASE_URL_PLACEHOLDER = "{{SITE_BASE_URL}}" # Define the placeholder
+PROMPT_LOG_SAMPLE_RATE = config.get("prompt_log_sample_rate", 0.01) # Fraction of generations whose full prompt is logged
 # --- CONFIGURATION LOADING --- END --- 
 
-client = OpenAI() # Assumes OPENAI_API_KEY is in environment
+# Chat-completion backend: OpenAI by default, or the offline mock for load tests (see llm_providers.py)
+llm_provider = make_llm_provider(config, LLM_MODEL)
 
-def generate_llm_content(current_path_for_content):
-    """Generates only the main HTML content snippet for a given path using the LLM."""
-    
+def set_llm_provider(provider):
+    """Swaps the backend used by every generation function, e.g. for benchmarks."""
+    global llm_provider
+    llm_provider = provider
+
+def build_content_messages(formatted_system_prompt, user_request_llm):
+    return [
+        {"role": "system", "content": formatted_system_prompt},
+        {"role": "user", "content": user_request_llm}
+    ]
+
+def canonical_page_path(path):
+    """
+    The path a page is generated and cached for: each segment keeps only the characters its
+    cache filename keeps (see app.sanitize_path_to_cache_filename), so /services, /services.
+    and /services! are one page with one prompt and fingerprint.
+    """
+    segments = [re.sub(r'[^a-zA-Z0-9_\-]', '', segment) for segment in (path or '').split('/')]
+    return '/' + '/'.join(segment for segment in segments if segment)
+
+def build_content_prompt(current_path_for_content, log_prompt=True):
+    """Returns (llm_path_query, system_prompt, user_request) for generating a path's main content."""
+    current_path_for_content = canonical_page_path(current_path_for_content)
     llm_path_query = current_path_for_content.strip('/') if current_path_for_content != '/' else 'homepage'
     if not llm_path_query: # Handles cases where path might become empty after stripping, e.g. if original was just '/'
         llm_path_query = 'homepage'
 
+    basic_prompt = f"You are a content writer. Generate minimal HTML main content for a page about '{llm_path_query}'. No images or external links. Only p, h1, h2, h3, ul, ol, li tags."
     profile = WEBSITE_PROFILE
-    try:
-        formatted_system_prompt = SYSTEM_PROMPT_TEMPLATE.format(
-            company_name=profile.get("company_name", "Our Company"),
-            business_type=profile.get("business_type", "Our Business"),
-            location=profile.get("location", "Our Location"),
-            specialties_list=", ".join(profile.get("specialties", [])),
-            values_list=", ".join(profile.get("values", [])),
-            target_audience=profile.get("target_audience", "Our Customers"),
-            site_tone=profile.get("site_tone", "default"),
-            current_page_path_for_llm=llm_path_query,
-            base_url_placeholder=BASE_URL_PLACEHOLDER
-        )
-        # Manually add instruction for base URL if it's homepage for now
-        if llm_path_query == 'homepage' and '{{SITE_BASE_URL}}' not in formatted_system_prompt:
-            formatted_system_prompt += f"\n\nWhen referring to the site's main address (e.g., in a welcome message), use the placeholder: {BASE_URL_PLACEHOLDER}."
-
-        print(f"page.py DEBUG: Formatted System Prompt for path '{llm_path_query}':\\n---START PROMPT---\\n{formatted_system_prompt}\\n---END PROMPT---", file=sys.stderr) # DEBUG LINE
-    except KeyError as e:
-        print(f"page.py Error: Missing key in website_profile for system prompt formatting: {e}. Using basic prompt.", file=sys.stderr)
-        formatted_system_prompt = f"You are a content writer. Generate minimal HTML main content for a page about '{llm_path_query}'. No images or external links. Only p, h1, h2, h3, ul, ol, li tags."
+    if not SYSTEM_PROMPT_TEMPLATE: # site_config.py warned about it at startup
+        formatted_system_prompt = basic_prompt
+    else:
+        try:
+            formatted_system_prompt = SYSTEM_PROMPT_TEMPLATE.format(
+                company_name=profile.get("company_name", "Our Company"),
+                business_type=profile.get("business_type", "Our Business"),
+                location=profile.get("location", "Our Location"),
+                specialties_list=", ".join(profile.get("specialties", [])),
+                values_list=", ".join(profile.get("values", [])),
+                target_audience=profile.get("target_audience", "Our Customers"),
+                site_tone=profile.get("site_tone", "default"),
+                current_page_path_for_llm=llm_path_query,
+                base_url_placeholder=BASE_URL_PLACEHOLDER
+            )
+            # Manually add instruction for base URL if it's homepage for now
+            if llm_path_query == 'homepage' and '{{SITE_BASE_URL}}' not in formatted_system_prompt:
+                formatted_system_prompt += f"\n\nWhen referring to the site's main address (e.g., in a welcome message), use the placeholder: {BASE_URL_PLACEHOLDER}."
+
+            if log_prompt and random.random() < PROMPT_LOG_SAMPLE_RATE:
+                print(f"page.py DEBUG: Formatted System Prompt for path '{llm_path_query}':\\n---START PROMPT---\\n{formatted_system_prompt}\\n---END PROMPT---", file=sys.stderr) # Sampled DEBUG LINE
+        except (KeyError, IndexError, ValueError) as e:
+            if log_prompt: # Not when only fingerprinting
+                print(f"page.py Error: Can't format system_prompt_template ({type(e).__name__}: {e}). Using basic prompt.", file=sys.stderr)
+            formatted_system_prompt = basic_prompt
     
     user_request_llm = f"Provide the main HTML content for the '{llm_path_query}' page, adhering to all instructions in the system prompt."
+    return llm_path_query, formatted_system_prompt, user_request_llm
+
+def _fingerprint(*parts):
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()[:16]
+
+@functools.lru_cache(maxsize=4096)
+def content_fingerprint(current_path_for_content):
+    """
+    Hash of everything that determines a path's generated content: the model and the fully
+    formatted prompts (which embed the website profile and system prompt template).
+    Cached pages whose stored fingerprint differs were generated under an older config.
+    """
+    _, formatted_system_prompt, user_request_llm = build_content_prompt(current_path_for_content, log_prompt=False)
+    return _fingerprint(LLM_MODEL, formatted_system_prompt, user_request_llm)
+
+@functools.lru_cache(maxsize=4096)
+def ai_search_fingerprint(search_query):
+    """Like content_fingerprint, for a page generated from an AI search query."""
+    return _fingerprint(LLM_MODEL, build_ai_search_messages(search_query))
+
+def report_main_content(pipeline, llm_path_query):
+    """Returns a closed ContentPipeline's cleaned HTML, warning when the LLM ignored the snippet-only rules."""
+    if pipeline.source == "body":
+        print(f"page.py Warning: LLM returned content with <body> but no <main> for '{llm_path_query}'. Extracted from <body>.", file=sys.stderr)
+    main_content_html = pipeline.html
+    if not main_content_html:
+        print(f"page.py: Content for '{llm_path_query}' is empty after generation/cleanup. Returning empty string.", file=sys.stderr)
+    return main_content_html
+
+def extract_main_content(raw_content, llm_path_query):
+    """
+    Cleans a raw LLM response down to the snippet that goes inside <main id="page-content">:
+    the content of its <main> or <body> if it generated a whole page, restricted to the
+    allowed tags and internal links (see html_pipeline.py).
+    """
+    return report_main_content(clean_html(raw_content), llm_path_query)
+
+def extract_internal_links(html_content):
+    """Returns the internal paths a snippet links to (navigateTo targets and root-relative hrefs), in order, without duplicates."""
+    return clean_html(html_content).links
+
+def generate_llm_content(current_path_for_content):
+    """Generates only the main HTML content snippet for a given path using the LLM."""
+    llm_path_query, formatted_system_prompt, user_request_llm = build_content_prompt(current_path_for_content)
 
     main_content_html = ""
     try:
         # print(f"page.py: Sending request to LLM for path: '{llm_path_query}' with prompt: {formatted_system_prompt[:100]}...", file=sys.stderr)
-        response = client.chat.completions.create(
-            model=LLM_MODEL,
-            messages=[
-                {"role": "system", "content": formatted_system_prompt},
-                {"role": "user", "content": user_request_llm}
-            ]
-        )
-        main_content_html = response.choices[0].message.content
-        
-        # --- Start Content Extraction/Cleanup ---
-        # Attempt to remove any outer html/body/main tags to get only the inner content.
-        # This makes the LLM output more robust to accidental full-page generation.
-        temp_content = main_content_html.strip()
-        
-        # Try to find content within <main> tags first
-        main_match = re.search(r"<main[^>]*>(.*?)</main>", temp_content, re.IGNORECASE | re.DOTALL)
-        if main_match:
-            temp_content = main_match.group(1).strip()
-        else:
-            # If no <main>, try to find content within <body> tags
-            body_match = re.search(r"<body[^>]*>(.*?)</body>", temp_content, re.IGNORECASE | re.DOTALL)
-            if body_match:
-                print(f"page.py Warning: LLM returned content with <body> but no <main> for '{llm_path_query}'. Extracted from <body>.", file=sys.stderr)
-                temp_content = body_match.group(1).strip()
-            elif temp_content.lower().startswith("<!doctype html>") or temp_content.lower().startswith("<html>"):
-                print(f"page.py Warning: LLM returned full HTML document for '{llm_path_query}' but couldn't find <main> or <body>. Setting to empty.", file=sys.stderr)
-                temp_content = "" # Return empty string
-            # If it wasn't a full doc but some other structure we didn't want, it remains temp_content
-        
-        main_content_html = temp_content
-        # --- End Content Extraction/Cleanup ---
-
-        if not main_content_html.strip(): # If after all that, it's empty
-            print(f"page.py: Content for '{llm_path_query}' is empty after generation/cleanup. Returning empty string.", file=sys.stderr)
-            main_content_html = "" # Return empty string
-
+        with llm_call("page"):
+            raw_content = llm_provider.complete(build_content_messages(formatted_system_prompt, user_request_llm))
+        main_content_html = extract_main_content(raw_content, llm_path_query)
     except Exception as e:
-        print(f"page.py Error calling OpenAI API for path '{current_path_for_content}': {e}. Returning empty string.", file=sys.stderr)
+        print(f"page.py Error calling LLM ({llm_provider.name}) for path '{current_path_for_content}': {e}. Returning empty string.", file=sys.stderr)
         main_content_html = "" # Return empty string
     
     return main_content_html
 
-def generate_content_from_ai_search(search_query):
+def stream_llm_content(current_path_for_content):
     """
-    Generates a new URL path and HTML content based on a search query, 
-    returning a JSON object.
+    Yields raw text deltas from a streamed completion for a path as they arrive.
+    The caller feeds them through a ContentPipeline and finishes with report_main_content.
+    API errors propagate to the caller.
     """
+    _, formatted_system_prompt, user_request_llm = build_content_prompt(current_path_for_content)
+    with llm_call("stream"):
+        yield from llm_provider.stream(build_content_messages(formatted_system_prompt, user_request_llm))
+
+def build_ai_search_prompt(search_query):
+    """Returns the system prompt asking the LLM for a url_path and content JSON object for a search query."""
     profile = WEBSITE_PROFILE
     
     # Construct a system prompt instructing the AI.
@@ -142,35 +178,76 @@ Example JSON output:
   "content": "<h2>New Offering Title</h2><p>Details about the new offering based on the search query...</p>"
 }}
 """
+    return search_system_prompt
+
+def build_ai_search_messages(search_query):
+    return [
+        {"role": "system", "content": build_ai_search_prompt(search_query)},
+        {"role": "user", "content": f"Generate a new page URL and content for my search: {search_query}"}
+    ]
 
-    ai_response_json = {}
+def parse_ai_search_response(raw_response_content, search_query):
+    """Parses the LLM's JSON reply, returning the result dict or an {"error", "details"} dict."""
+    # print(f"page.py DEBUG: Raw AI search response: {raw_response_content}", file=sys.stderr)
+    try:
+        ai_response_json = json.loads(raw_response_content)
+        if not isinstance(ai_response_json, dict) or "url_path" not in ai_response_json or "content" not in ai_response_json:
+            print(f"page.py Error: AI search response is not the expected JSON object for query '{search_query}'. Response: {raw_response_content}", file=sys.stderr)
+            return {"error": "Invalid JSON structure from AI.", "details": raw_response_content}
+        if not isinstance(ai_response_json["content"], str):
+            print(f"page.py Error: AI search response content is not a string for query '{search_query}'. Response: {raw_response_content}", file=sys.stderr)
+            return {"error": "Invalid JSON structure from AI.", "details": raw_response_content}
+    except json.JSONDecodeError as e:
+        print(f"page.py Error: Failed to decode JSON from AI search response for query '{search_query}': {e}. Response: {raw_response_content}", file=sys.stderr)
+        return {"error": "JSON decode error from AI response.", "details": raw_response_content}
+    ai_response_json["content"] = extract_main_content(ai_response_json["content"], search_query)
+    return ai_response_json
+
+def generate_content_from_ai_search(search_query):
+    """
+    Generates a new URL path and HTML content based on a search query, 
+    returning a JSON object.
+    """
     try:
         # print(f"page.py: Sending AI search request for query: '{search_query}'", file=sys.stderr)
-        response = client.chat.completions.create(
-            model=LLM_MODEL,
-            response_format={"type": "json_object"},
-            messages=[
-                {"role": "system", "content": search_system_prompt},
-                {"role": "user", "content": f"Generate a new page URL and content for my search: {search_query}"}
-            ]
-        )
-        raw_response_content = response.choices[0].message.content
-        # print(f"page.py DEBUG: Raw AI search response: {raw_response_content}", file=sys.stderr)
+        with llm_call("search"):
+            raw_response_content = llm_provider.complete(build_ai_search_messages(search_query), json_response=True)
+    except Exception as e:
+        print(f"page.py Error calling LLM ({llm_provider.name}) for AI search query '{search_query}': {e}", file=sys.stderr)
+        return {"error": f"LLM call failed: {str(e)}"}
+    
+    return parse_ai_search_response(raw_response_content, search_query)
 
-        try:
-            ai_response_json = json.loads(raw_response_content)
-            if not isinstance(ai_response_json, dict) or "url_path" not in ai_response_json or "content" not in ai_response_json:
-                print(f"page.py Error: AI search response is not the expected JSON object for query '{search_query}'. Response: {raw_response_content}", file=sys.stderr)
-                return {"error": "Invalid JSON structure from AI.", "details": raw_response_content}
-        except json.JSONDecodeError as e:
-            print(f"page.py Error: Failed to decode JSON from AI search response for query '{search_query}': {e}. Response: {raw_response_content}", file=sys.stderr)
-            return {"error": "JSON decode error from AI response.", "details": raw_response_content}
+# --- ASYNC VARIANTS (used by asgi_app.py) --- START ---
+async def async_generate_llm_content(current_path_for_content):
+    """Async version of generate_llm_content; awaits the LLM without blocking a worker."""
+    llm_path_query, formatted_system_prompt, user_request_llm = build_content_prompt(current_path_for_content)
+    try:
+        with llm_call("page"):
+            raw_content = await llm_provider.async_complete(build_content_messages(formatted_system_prompt, user_request_llm))
+        return extract_main_content(raw_content, llm_path_query)
+    except Exception as e:
+        print(f"page.py Error calling LLM ({llm_provider.name}) for path '{current_path_for_content}': {e}. Returning empty string.", file=sys.stderr)
+        return ""
+
+async def async_stream_llm_content(current_path_for_content):
+    """Async version of stream_llm_content. API errors propagate to the caller."""
+    _, formatted_system_prompt, user_request_llm = build_content_prompt(current_path_for_content)
+    with llm_call("stream"):
+        async for delta in llm_provider.async_stream(build_content_messages(formatted_system_prompt, user_request_llm)):
+            yield delta
 
+async def async_generate_content_from_ai_search(search_query):
+    """Async version of generate_content_from_ai_search."""
+    try:
+        with llm_call("search"):
+            raw_response_content = await llm_provider.async_complete(build_ai_search_messages(search_query), json_response=True)
     except Exception as e:
-        print(f"page.py Error calling OpenAI API for AI search query '{search_query}': {e}", file=sys.stderr)
-        return {"error": f"OpenAI API call failed: {str(e)}"}
-    
-    return ai_response_json
+        print(f"page.py Error calling LLM ({llm_provider.name}) for AI search query '{search_query}': {e}", file=sys.stderr)
+        return {"error": f"LLM call failed: {str(e)}"}
+
+    return parse_ai_search_response(raw_response_content, search_query)
+# --- ASYNC VARIANTS --- END ---
 
 if __name__ == "__main__":
     path_arg = "/"
@@ -0,0 +1,90 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+def file_signature(filepath):
+    """(mtime, size, inode) of a file, or None if it does not exist."""
+    try:
+        stat_result = os.stat(filepath)
+    except FileNotFoundError:
+        return None
+    return (stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino)
+
+def read_text(filepath):
+    with open(filepath, 'r', encoding='utf-8') as f:
+        content = f.read()
+    return content, len(content.encode('utf-8'))
+
+
+class PageCache:
+    """
+    Bounded in-memory LRU of post-processed cache entries, keyed by normalized path.
+
+    Entries are revalidated on every lookup against a cheap signature of the backing entry,
+    by default one os.stat of the file: if its (mtime, size, inode) changed, the file is
+    re-loaded. A hit on an unchanged file therefore costs one stat instead of an open, a
+    read and the placeholder substitution.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict() # key -> (file_signature, value, size_bytes)
+        self._lock = threading.Lock()
+
+    def get(self, key, source, load=read_text, signature=file_signature):
+        """
+        Returns the value for key, re-loading source if it changed since it was cached.
+        load(source) returns (value, size_bytes) and runs once per change, so any
+        post-processing it does is cached too. signature(source) identifies the current
+        version of source, or is None if it does not exist, in which case None is returned.
+        """
+        signature = signature(source)
+        if signature is None:
+            self.invalidate(key)
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        value, size_bytes = load(source)
+        self._store(key, signature, value, size_bytes)
+        return value
+
+    def peek(self, key):
+        """Returns the value held for key without revalidating it, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] if entry is not None else None
+
+    def invalidate(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.current_bytes -= entry[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.current_bytes, "max_bytes": self.max_bytes}
+
+    def _store(self, key, signature, value, size_bytes):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= previous[2]
+            if size_bytes > self.max_bytes:
+                return # Too large to ever fit; always served from disk
+            self._entries[key] = (signature, value, size_bytes)
+            self.current_bytes += size_bytes
+            while self.current_bytes > self.max_bytes:
+                _, (_, _, evicted_bytes) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
@@ -0,0 +1,157 @@
+import os
+import sys
+import time
+import queue
+import threading
+from collections import OrderedDict
+
+from metrics import PREFETCHES
+
+
+class Prefetcher:
+    """
+    Speculative prefetch of the pages a served page links to, so the next click is usually a
+    cache hit. page_served() scans a page's internal links once per version of its content,
+    ranks them and queues the top_k uncached targets; background workers generate them.
+
+    Links rank by how many scanned pages link to them, then by their position on the page
+    (earlier first). The queue is bounded (extra targets are dropped, never waited for) and
+    generations are paid from a token bucket of budget_per_hour, so a burst of traffic cannot
+    turn into unbounded speculative spend.
+
+    The callables keep this independent of app.py: extract_links(path, content) -> paths in
+    page order, accept(path) -> normalized path or None to skip it, is_cached(path) -> bool, and
+    generate(path) -> True if it called the LLM (False refunds the budget).
+    """
+
+    def __init__(self, extract_links, accept, is_cached, generate, top_k=3, max_queue=32, workers=1,
+                 budget_per_hour=60, max_tracked=4096):
+        self.extract_links = extract_links
+        self.accept = accept
+        self.is_cached = is_cached
+        self.generate = generate
+        self.top_k = top_k
+        self.workers = max(1, workers)
+        self.budget_per_hour = budget_per_hour
+        self.max_tracked = max_tracked
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = set() # Paths queued or being generated
+        self._scanned = OrderedDict() # path -> hash of the content last scanned
+        self._inbound = {} # path -> number of scanned pages linking to it
+        self._tokens = float(budget_per_hour)
+        self._refilled_at = time.monotonic()
+        self._workers_pid = None
+        self._lock = threading.Lock()
+
+    def page_served(self, path, content):
+        """Queues the best uncached link targets of a served page. Cheap no-op for an already-scanned version."""
+        if not content or not self.budget_per_hour:
+            return
+        content_hash = hash(content) # Cached on the str, and served content is shared from PageCache
+        with self._lock:
+            if self._scanned.get(path) == content_hash or self._available_tokens() < 1:
+                return
+            self._scanned[path] = content_hash
+            self._scanned.move_to_end(path)
+            if len(self._scanned) > self.max_tracked:
+                self._scanned.popitem(last=False)
+
+        links = []
+        for link in self.extract_links(path, content):
+            target = self.accept(link)
+            if target and target != path and target not in links:
+                links.append(target)
+        with self._lock:
+            for target in links:
+                self._inbound[target] = self._inbound.get(target, 0) + 1
+            if len(self._inbound) > self.max_tracked: # Forget the least-linked half
+                keep = sorted(self._inbound.items(), key=lambda item: item[1], reverse=True)[:self.max_tracked // 2]
+                self._inbound = dict(keep)
+            ranked = sorted(links, key=lambda target: -self._inbound.get(target, 0)) # Stable: ties keep page order
+
+        queued = 0
+        for target in ranked:
+            if queued >= self.top_k:
+                break
+            with self._lock:
+                if target in self._pending:
+                    continue
+            if self.is_cached(target):
+                continue
+            if not self._enqueue(target):
+                break
+            queued += 1
+
+    def _enqueue(self, path):
+        self._start_workers()
+        with self._lock:
+            if path in self._pending:
+                return True
+            try:
+                self._queue.put_nowait(path)
+            except queue.Full:
+                PREFETCHES.inc(outcome="dropped_queue_full")
+                return False
+            self._pending.add(path)
+        PREFETCHES.inc(outcome="queued")
+        return True
+
+    def _start_workers(self):
+        """Starts the worker threads on first use, and again in a forked child, which has none."""
+        with self._lock:
+            if self._workers_pid == os.getpid():
+                return
+            self._workers_pid = os.getpid()
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f"prefetch-{i}", daemon=True).start()
+
+    def _available_tokens(self):
+        """Refills the budget bucket for the elapsed time. Call with self._lock held."""
+        now = time.monotonic()
+        self._tokens = min(float(self.budget_per_hour), self._tokens + (now - self._refilled_at) * self.budget_per_hour / 3600.0)
+        self._refilled_at = now
+        return self._tokens
+
+    def _take_token(self):
+        with self._lock:
+            if self._available_tokens() < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def _refund_token(self):
+        with self._lock:
+            self._tokens = min(float(self.budget_per_hour), self._tokens + 1)
+
+    def _work(self):
+        while True:
+            path = self._queue.get()
+            try:
+                self._prefetch(path)
+            finally:
+                with self._lock:
+                    self._pending.discard(path)
+                self._queue.task_done()
+
+    def _prefetch(self, path):
+        if self.is_cached(path): # Requested, or prefetched elsewhere, while it sat in the queue
+            PREFETCHES.inc(outcome="skipped_cached")
+            return
+        if not self._take_token():
+            PREFETCHES.inc(outcome="dropped_budget")
+            return
+        try:
+            spent = self.generate(path)
+        except Exception as e:
+            print(f"prefetch.py Error prefetching '{path}': {e}", file=sys.stderr)
+            PREFETCHES.inc(outcome="failed")
+            return
+        if spent:
+            PREFETCHES.inc(outcome="generated")
+        else:
+            self._refund_token()
+            PREFETCHES.inc(outcome="skipped_cached")
+
+    def join(self):
+        """Blocks until every queued prefetch has finished (for tests and benchmarks)."""
+        self._queue.join()
@@ -0,0 +1,146 @@
+import os
+import re
+import sys
+import math
+import zlib
+import hashlib
+import threading
+import unicodedata
+from collections import Counter
+
+from jsonl_log import JsonLinesLog
+
+# Hashed feature space for the similarity vectors; collisions at this size are negligible
+FEATURE_BUCKETS = 1 << 20
+# Words that carry no meaning for matching a search to a page
+STOPWORDS = frozenset("a an and are about for from how i in is it me my of on or the to what which with".split())
+
+
+def normalize_query(query):
+    """Case-, accent-, punctuation- and whitespace-insensitive form of a search query."""
+    text = unicodedata.normalize('NFKD', query).encode('ascii', 'ignore').decode('ascii').lower()
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', text).split())
+
+def query_key(query):
+    """Short stable key for a query, safe to use in file names (e.g. single-flight lock files)."""
+    return hashlib.sha256(normalize_query(query).encode('utf-8')).hexdigest()[:32]
+
+def text_vector(text):
+    """
+    L2-normalized sparse vector {feature: weight} of hashed word and character-trigram features.
+    Trigrams make near-duplicates (plurals, typos, reordered words) score close to each other.
+    """
+    words = [word for word in normalize_query(text).split() if word not in STOPWORDS]
+    features = Counter()
+    for word in words:
+        features[zlib.crc32(b'w:' + word.encode('utf-8')) % FEATURE_BUCKETS] += 1.0
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            features[zlib.crc32(b'c:' + padded[i:i + 3].encode('utf-8')) % FEATURE_BUCKETS] += 0.5
+    norm = math.sqrt(sum(weight * weight for weight in features.values()))
+    return {feature: weight / norm for feature, weight in features.items()} if norm else {}
+
+
+class SearchIndex:
+    """
+    Maps AI search queries to the cached pages that answer them, so repeat searches skip the LLM.
+
+    Exact repeats are matched on the normalized query text. Optionally, near-duplicates are
+    matched by cosine similarity of hashed n-gram vectors over past queries and the names of
+    cached pages, looked up through an inverted index so a search only scores documents that
+    share a feature with it. Query-to-page mappings persist in an append-only log in the cache
+    directory that every worker tails, like the menu index (and, like it, can take another `log`).
+    """
+
+    def __init__(self, cache_dir, page_text, similarity_threshold=0.0, log_filename=".search_index.jsonl", log=None):
+        self.page_text = page_text # path -> text the page is indexed under
+        self.similarity_threshold = similarity_threshold
+        self.log = log or JsonLinesLog(os.path.join(cache_dir, log_filename))
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._query_paths = {} # normalized query -> page path
+        self._documents = [] # document id -> page path
+        self._postings = {} # feature -> [(document id, weight)]
+        self._query_documents = {} # normalized query -> document id
+        self._indexed_pages = set()
+
+    def lookup(self, query, page_paths=(), revalidate=False):
+        """
+        Returns (path, score) for the page that best answers query, or None. An exact repeat
+        scores 1.0. page_paths are the currently cached pages, indexed on first sight.
+        revalidate reads mappings other workers just recorded, even from a memoizing log.
+        """
+        self._refresh(revalidate)
+        normalized = normalize_query(query)
+        with self._lock:
+            path = self._query_paths.get(normalized)
+            if path is not None:
+                return path, 1.0
+            if not self.similarity_threshold:
+                return None
+            self._index_pages(page_paths)
+
+            scores = Counter()
+            for feature, weight in text_vector(normalized).items():
+                for document_id, document_weight in self._postings.get(feature, ()):
+                    scores[document_id] += weight * document_weight
+        if not scores:
+            return None
+        document_id, score = scores.most_common(1)[0]
+        if score < self.similarity_threshold:
+            return None
+        return self._documents[document_id], score
+
+    def warm(self, page_paths=()):
+        """Loads the search log and indexes page_paths now instead of on the first search."""
+        self._refresh()
+        if self.similarity_threshold:
+            with self._lock:
+                self._index_pages(page_paths)
+
+    def _index_pages(self, page_paths):
+        """Call with self._lock held."""
+        for page_path in page_paths:
+            if page_path not in self._indexed_pages:
+                self._indexed_pages.add(page_path)
+                self._add_document(page_path, text_vector(self.page_text(page_path)))
+
+    def record(self, query, path):
+        """Remembers that path answers query, for every worker."""
+        normalized = normalize_query(query)
+        self._refresh()
+        with self._lock:
+            if self._query_paths.get(normalized) == path:
+                return
+        self.log.append({"query": normalized, "path": path})
+        self._refresh()
+
+    def _add_document(self, path, vector):
+        document_id = len(self._documents)
+        self._documents.append(path)
+        for feature, weight in vector.items():
+            self._postings.setdefault(feature, []).append((document_id, weight))
+        return document_id
+
+    def _refresh(self, revalidate=False):
+        """Tails the log, applying only mappings appended since the last refresh."""
+        with self._lock:
+            try:
+                entries, reset = self.log.read_new(revalidate)
+            except FileNotFoundError:
+                return # Nothing recorded yet
+            if reset:
+                self._reset()
+            for entry in entries:
+                try:
+                    normalized, path = entry["query"], entry["path"]
+                except (KeyError, TypeError) as e:
+                    print(f"search_index.py Skipping malformed search index entry {entry!r}: {e}", file=sys.stderr)
+                    continue
+                self._query_paths[normalized] = path # Later answers to the same query win
+                if normalized in self._query_documents:
+                    self._documents[self._query_documents[normalized]] = path
+                else:
+                    self._query_documents[normalized] = self._add_document(path, text_vector(normalized))
@@ -0,0 +1,453 @@
+"""
+Shared cache tier, so every app node serves pages any node has generated.
+
+SharedCacheStore is a cache store (see cache_store.py) and SharedLog an append-only log (see
+jsonl_log.py) that both talk JSON over HTTP to one shared cache server. Each node keeps its
+own in-memory tier in front: PageCache holds page content, and entry versions and the log
+position are only revalidated with the server every `revalidate_seconds`, so a cache hit
+normally makes no network round trip.
+
+This module also contains a stand-in server for testing and small deployments. It keeps
+pages in a SQLiteCacheStore and logs as JSON-lines files in its data directory:
+    python shared_cache.py --port 8765 --data-dir shared-cache/
+and point every node at it with "shared_cache_url": "http://<host>:8765" in config.json.
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+import http.client
+from urllib.parse import urlparse, quote, unquote, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cache_store import StoredEntry, SQLiteCacheStore, content_checksum
+from jsonl_log import JsonLinesLog
+from admission import SQLiteTokenBuckets
+
+
+class SharedCacheError(RuntimeError):
+    """The shared cache server rejected a request."""
+
+# What a request to an unreachable or failing server raises
+SHARED_CACHE_ERRORS = (OSError, http.client.HTTPException, SharedCacheError)
+
+
+class SharedCacheClient:
+    """JSON-over-HTTP client keeping one keep-alive connection per thread."""
+
+    def __init__(self, base_url, timeout=2.0):
+        parsed = urlparse(base_url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise ValueError(f"Shared cache URL must be http:// or https://<host>[:port], got {base_url!r}")
+        self.connection_class = http.client.HTTPSConnection if parsed.scheme == "https" else http.client.HTTPConnection
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        self.prefix = parsed.path.rstrip('/')
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = self.connection_class(self.host, self.port, timeout=self.timeout)
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def request(self, method, path, payload=None):
+        """Returns (status, decoded JSON body or None). 404 is returned; other 4xx/5xx raise SharedCacheError."""
+        body = json.dumps(payload).encode('utf-8') if payload is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        for attempt in range(2): # The server may have closed an idle keep-alive connection
+            connection = self._connection()
+            try:
+                connection.request(method, self.prefix + path, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+        if response.status == 404:
+            return 404, None
+        if response.status >= 400:
+            raise SharedCacheError(f"{method} {path} failed with {response.status}: {data[:200]!r}")
+        return response.status, json.loads(data) if data else None
+
+
+class SharedCacheStore:
+    """
+    Cache store backed by the shared cache server, with entry versions memoized locally.
+
+    `fallback` is a local store (FileCacheStore or SQLiteCacheStore) that takes over while the
+    server is unreachable: pages are written to it instead and read from it, so a page
+    generated during an outage is generated once, not on every request. A page that only
+    exists locally is uploaded the next time it is looked up with the server back.
+    """
+    name = "shared"
+
+    def __init__(self, client, revalidate_seconds=2.0, fallback=None):
+        self.client = client
+        self.revalidate_seconds = revalidate_seconds
+        self.fallback = fallback
+        self._signatures = {} # cache filename -> (signature, monotonic time checked)
+        self._lock = threading.Lock()
+
+    def _remember(self, cache_filename, signature):
+        with self._lock:
+            self._signatures[cache_filename] = (signature, time.monotonic())
+
+    def _local_signature(self, cache_filename):
+        local_signature = self.fallback.signature(cache_filename) if self.fallback is not None else None
+        return ("local", tuple(local_signature)) if local_signature is not None else None
+
+    def _upload_local(self, cache_filename):
+        """Returns the local-only entry for a file the server doesn't have (or None), uploading it."""
+        local_entry = self.fallback.read(cache_filename) if self.fallback is not None else None
+        if local_entry is None:
+            return None
+        try:
+            self._write_remote(cache_filename, local_entry.content, local_entry.metadata, local_entry.stored_at)
+        except SHARED_CACHE_ERRORS as e:
+            print(f"shared_cache.py Error uploading local copy of {cache_filename}: {e}. Serving it locally.", file=sys.stderr)
+            self._remember(cache_filename, self._local_signature(cache_filename))
+        return local_entry
+
+    def signature(self, cache_filename, revalidate=False):
+        """The entry's version, checked with the server at most every revalidate_seconds unless revalidate is set."""
+        with self._lock:
+            memo = self._signatures.get(cache_filename)
+        if memo is not None and not revalidate and time.monotonic() - memo[1] < self.revalidate_seconds:
+            return memo[0]
+        try:
+            status, body = self.client.request("GET", f"/entries/{quote(cache_filename)}/signature")
+        except SHARED_CACHE_ERRORS as e:
+            if memo is None and self.fallback is None:
+                raise
+            print(f"shared_cache.py Error revalidating {cache_filename}: {e}. Serving the last known or local version.", file=sys.stderr)
+            signature = memo[0] if memo is not None else self._local_signature(cache_filename)
+            self._remember(cache_filename, signature) # Back off until the next interval
+            return signature
+        if status != 404:
+            signature = tuple(body["signature"])
+            self._remember(cache_filename, signature)
+            return signature
+        if self._upload_local(cache_filename) is None:
+            self._remember(cache_filename, None)
+        with self._lock:
+            return self._signatures[cache_filename][0]
+
+    def read(self, cache_filename):
+        try:
+            status, body = self.client.request("GET", f"/entries/{quote(cache_filename)}")
+        except SHARED_CACHE_ERRORS as e:
+            if self.fallback is None:
+                raise
+            print(f"shared_cache.py Error reading {cache_filename}: {e}. Reading the local copy.", file=sys.stderr)
+            self._remember(cache_filename, self._local_signature(cache_filename))
+            return self.fallback.read(cache_filename)
+        if status == 404:
+            return self._upload_local(cache_filename)
+        if content_checksum(body["content"]) != body["checksum"]:
+            print(f"shared_cache.py Checksum mismatch for {cache_filename} from the shared cache; treating it as missing.", file=sys.stderr)
+            return None
+        self._remember(cache_filename, tuple(body["signature"]))
+        return StoredEntry(body["content"], body["metadata"], body["stored_at"])
+
+    def read_metadata(self, cache_filename):
+        entry = self.read(cache_filename)
+        return entry.metadata if entry else None
+
+    def _write_remote(self, cache_filename, content, metadata, stored_at):
+        _, body = self.client.request("PUT", f"/entries/{quote(cache_filename)}",
+                                      {"content": content, "metadata": metadata, "stored_at": stored_at})
+        self._remember(cache_filename, tuple(body["signature"]))
+
+    def write(self, cache_filename, content, metadata, stored_at=None):
+        try:
+            self._write_remote(cache_filename, content, metadata, stored_at)
+        except SHARED_CACHE_ERRORS as e:
+            if self.fallback is None:
+                raise
+            print(f"shared_cache.py Error writing {cache_filename}: {e}. Keeping it locally until the server is back.", file=sys.stderr)
+            self.fallback.write(cache_filename, content, metadata, stored_at)
+            self._remember(cache_filename, self._local_signature(cache_filename))
+
+    def archive(self, cache_filename, new_fingerprint):
+        try:
+            self.client.request("POST", f"/entries/{quote(cache_filename)}/archive", {"fingerprint": new_fingerprint})
+        except SHARED_CACHE_ERRORS:
+            if self.fallback is None:
+                raise
+            self.fallback.archive(cache_filename, new_fingerprint)
+
+    def read_archived(self, cache_filename, fingerprint):
+        try:
+            status, body = self.client.request("GET", f"/generations/{quote(cache_filename)}/{quote(fingerprint)}")
+        except SHARED_CACHE_ERRORS:
+            if self.fallback is None:
+                raise
+            return self.fallback.read_archived(cache_filename, fingerprint)
+        if status == 404 or content_checksum(body["content"]) != body["checksum"]:
+            return None
+        return StoredEntry(body["content"], body["metadata"], body["stored_at"])
+
+    def filenames(self):
+        local_filenames = self.fallback.filenames() if self.fallback is not None else []
+        try:
+            _, body = self.client.request("GET", "/entries")
+        except SHARED_CACHE_ERRORS:
+            if self.fallback is None:
+                raise
+            return local_filenames
+        return sorted(set(body["filenames"]) | set(local_filenames))
+
+
+class SharedLog:
+    """
+    Append-only log on the shared cache server, with the same interface as JsonLinesLog.
+    New lines are fetched at most every `revalidate_seconds`, right after this node appends, and
+    whenever read_new(revalidate=True) is called.
+    Lines appended while the server is unreachable are applied locally and sent once it is
+    back; readers (MenuIndex, SearchIndex) apply a repeated line idempotently.
+    """
+
+    def __init__(self, client, name, revalidate_seconds=2.0):
+        self.client = client
+        self.name = name
+        self.revalidate_seconds = revalidate_seconds
+        self._offset = 0
+        self._log_id = None
+        self._checked_at = None
+        self._pending = [] # Lines not yet accepted by the server
+        self._unread = [] # Pending lines not yet returned by read_new
+        self._read_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    @property
+    def version(self):
+        return f"{self._log_id or 0}-{self._offset:x}"
+
+    def exists(self):
+        try:
+            status, _ = self.client.request("GET", f"/logs/{quote(self.name)}?offset=0&limit=0")
+        except SHARED_CACHE_ERRORS:
+            return True # Unknown; don't rebuild over a log we can't see
+        return status != 404
+
+    def read_new(self, revalidate=False):
+        with self._read_lock:
+            if not revalidate and self._checked_at is not None and time.monotonic() - self._checked_at < self.revalidate_seconds:
+                return [], False
+            self._checked_at = time.monotonic()
+            try:
+                self._send_pending()
+                status, body = self.client.request("GET", f"/logs/{quote(self.name)}?offset={self._offset}&log_id={self._log_id or ''}")
+            except SHARED_CACHE_ERRORS as e:
+                print(f"shared_cache.py Error reading shared log '{self.name}': {e}. Keeping the local copy.", file=sys.stderr)
+                with self._write_lock:
+                    unread, self._unread = self._unread, []
+                return unread, False
+            if status == 404:
+                raise FileNotFoundError(self.name)
+            self._offset, self._log_id = body["offset"], body["log_id"]
+            return body["entries"], body["reset"]
+
+    def _send_pending(self):
+        with self._write_lock:
+            while self._pending:
+                self.client.request("POST", f"/logs/{quote(self.name)}", self._pending[0])
+                self._pending.pop(0)
+            self._unread = []
+
+    def append(self, entry):
+        with self._write_lock:
+            self._pending.append(entry)
+            self._unread.append(entry)
+        try:
+            self._send_pending()
+        except SHARED_CACHE_ERRORS as e:
+            print(f"shared_cache.py Error appending to shared log '{self.name}': {e}. Will retry.", file=sys.stderr)
+        self._checked_at = None # Pick up our own line on the next read
+
+    def rewrite(self, entries):
+        self.client.request("PUT", f"/logs/{quote(self.name)}", {"entries": list(entries)})
+        self._checked_at = None
+
+    def lock(self):
+        return self._write_lock
+
+
+class SharedTokenBuckets:
+    """
+    Admission rate-limit buckets held by the shared cache server, so per-client and global
+    generation limits apply across every node (same interface as admission.LocalTokenBuckets).
+    While the server is unreachable, `fallback` (this node's buckets) enforces them instead.
+    """
+
+    def __init__(self, client, fallback):
+        self.client = client
+        self.fallback = fallback
+
+    def take(self, limits):
+        try:
+            status, body = self.client.request("POST", "/buckets/take", {"limits": [list(limit) for limit in limits]})
+        except SHARED_CACHE_ERRORS as e:
+            print(f"shared_cache.py Error taking admission tokens: {e}. Limiting this node on its own.", file=sys.stderr)
+            return self.fallback.take(limits)
+        if status == 404: # A server without rate-limit support
+            return self.fallback.take(limits)
+        return tuple(body["rejection"]) if body["rejection"] else None
+
+
+# --- STAND-IN SERVER --- START ---
+LOG_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_.-]+$')
+
+def read_log_from(log_path, offset, log_id):
+    """Returns (entries, new_offset, log_id, reset) for the complete lines after offset."""
+    with open(log_path, 'rb') as f:
+        stat_result = os.fstat(f.fileno())
+        current_log_id = str(stat_result.st_ino)
+        reset = log_id != current_log_id or offset > stat_result.st_size
+        if reset:
+            offset = 0
+        f.seek(offset)
+        data = f.read()
+    complete_end = data.rfind(b"\n") + 1
+    entries = []
+    for raw_line in data[:complete_end].splitlines():
+        try:
+            entries.append(json.loads(raw_line))
+        except ValueError:
+            pass
+    return entries, offset + complete_end, current_log_id, reset
+
+
+class SharedCacheHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, so nodes reuse connections
+
+    def log_message(self, format, *args):
+        pass # One line per cache hit would drown the server's output
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_not_found(self):
+        self._send_json({"error": "not found"}, 404)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def _entry_payload(self, entry):
+        return {"content": entry.content, "metadata": entry.metadata, "stored_at": entry.stored_at,
+                "checksum": content_checksum(entry.content)}
+
+    def _log_path(self, name):
+        if not LOG_NAME_PATTERN.match(name):
+            return None
+        return os.path.join(self.server.data_dir, name + ".jsonl")
+
+    def do_GET(self):
+        store = self.server.store
+        parsed = urlparse(self.path)
+        parts = [unquote(part) for part in parsed.path.strip('/').split('/')]
+        if parts == ["entries"]:
+            self._send_json({"filenames": store.filenames()})
+        elif len(parts) == 3 and parts[0] == "entries" and parts[2] == "signature":
+            signature = store.signature(parts[1])
+            self._send_json({"signature": list(signature)}) if signature else self._send_not_found()
+        elif len(parts) == 2 and parts[0] == "entries":
+            signature = store.signature(parts[1])
+            entry = store.read(parts[1])
+            if entry is None or signature is None:
+                return self._send_not_found()
+            self._send_json({**self._entry_payload(entry), "signature": list(signature)})
+        elif len(parts) == 3 and parts[0] == "generations":
+            entry = store.read_archived(parts[1], parts[2])
+            self._send_json(self._entry_payload(entry)) if entry else self._send_not_found()
+        elif len(parts) == 2 and parts[0] == "logs" and self._log_path(parts[1]):
+            query = parse_qs(parsed.query)
+            try:
+                entries, offset, log_id, reset = read_log_from(self._log_path(parts[1]), int(query.get("offset", ["0"])[0]),
+                                                               query.get("log_id", [""])[0])
+            except FileNotFoundError:
+                return self._send_not_found()
+            if query.get("limit") == ["0"]:
+                entries = []
+            self._send_json({"entries": entries, "offset": offset, "log_id": log_id, "reset": reset})
+        else:
+            self._send_not_found()
+
+    def do_PUT(self):
+        parts = [unquote(part) for part in urlparse(self.path).path.strip('/').split('/')]
+        payload = self._read_json() or {}
+        if len(parts) == 2 and parts[0] == "entries":
+            self.server.store.write(parts[1], payload["content"], payload["metadata"], stored_at=payload.get("stored_at"))
+            self._send_json({"signature": list(self.server.store.signature(parts[1]))})
+        elif len(parts) == 2 and parts[0] == "logs" and self._log_path(parts[1]):
+            log = self.server.log(self._log_path(parts[1]))
+            with log.lock():
+                log.rewrite(payload.get("entries", []))
+            self._send_json({})
+        else:
+            self._send_not_found()
+
+    def do_POST(self):
+        parts = [unquote(part) for part in urlparse(self.path).path.strip('/').split('/')]
+        payload = self._read_json() or {}
+        if len(parts) == 3 and parts[0] == "entries" and parts[2] == "archive":
+            self.server.store.archive(parts[1], payload.get("fingerprint"))
+            self._send_json({})
+        elif len(parts) == 2 and parts[0] == "logs" and self._log_path(parts[1]):
+            self.server.log(self._log_path(parts[1])).append(payload)
+            self._send_json({})
+        elif parts == ["buckets", "take"]:
+            rejection = self.server.buckets.take([tuple(limit) for limit in payload.get("limits", [])])
+            self._send_json({"rejection": list(rejection) if rejection else None})
+        else:
+            self._send_not_found()
+
+
+class SharedCacheServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, data_dir):
+        super().__init__(address, SharedCacheHandler)
+        os.makedirs(data_dir, exist_ok=True)
+        self.data_dir = data_dir
+        self.store = SQLiteCacheStore(os.path.join(data_dir, "shared_cache.sqlite3"))
+        self.buckets = SQLiteTokenBuckets(os.path.join(data_dir, "admission_buckets.sqlite3"))
+        self._logs = {}
+        self._logs_lock = threading.Lock()
+
+    def log(self, log_path):
+        with self._logs_lock:
+            return self._logs.setdefault(log_path, JsonLinesLog(log_path))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a stand-in shared cache server for one or more app nodes.")
+    parser.add_argument('--host', default='127.0.0.1', help="Interface to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8765, help="Port to listen on (default: 8765)")
+    parser.add_argument('--data-dir', default='shared-cache', help="Where pages and logs are kept (default: shared-cache/)")
+    args = parser.parse_args(argv)
+    server = SharedCacheServer((args.host, args.port), args.data_dir)
+    print(f"shared_cache.py: Serving shared cache from {args.data_dir} on http://{args.host}:{args.port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
+# --- STAND-IN SERVER --- END ---
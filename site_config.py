@@ -0,0 +1,140 @@
+"""
+The site configuration, loaded from config.json once per process and shared by app.py,
+page.py and the tools built on them (`from site_config import config`).
+
+Settings are validated against CONFIG_SCHEMA when loaded: a setting of the wrong type is
+reported and dropped, so the code's default applies instead of failing on first use.
+Unknown keys are kept but reported, as they are usually typos. The SITE_CONFIG_PATH
+environment variable points at a different file.
+"""
+import os
+import sys
+import json
+
+CONFIG_FILE_PATH = os.environ.get("SITE_CONFIG_PATH") or os.path.join(os.path.dirname(__file__), 'config.json')
+
+NUMBER = (int, float)
+OPTIONAL_STRING = (str, type(None))
+
+# Setting name -> accepted types. Defaults live where each setting is used.
+CONFIG_SCHEMA = {
+    # Site and prompt (page.py)
+    "llm_model": str,
+    "website_profile": dict,
+    "base_url": str,
+    "openai_api_key": str,
+    "system_prompt_template": str,
+    "prompt_log_sample_rate": NUMBER,
+    "llm_provider": str,
+    "mock_llm": dict,
+    "llm_prices_per_million_tokens": dict,
+    # Serving and caching (app.py)
+    "stream_page_data": bool,
+    "page_cache_max_bytes": int,
+    "compressed_cache_max_bytes": int,
+    "http_cache_max_age": NUMBER,
+    "http_stale_while_revalidate": NUMBER,
+    "cache_ttl_seconds": NUMBER,
+    "page_ttl_seconds": dict,
+    "stale_while_revalidate": bool,
+    "refresh_retry_seconds": NUMBER,
+    "refresh_workers": int,
+    "keep_generations": bool,
+    "single_flight_wait_seconds": NUMBER,
+    "cache_store": str,
+    "cache_sqlite_path": OPTIONAL_STRING,
+    "shared_cache_url": OPTIONAL_STRING,
+    "shared_cache_revalidate_seconds": NUMBER,
+    "shared_cache_timeout_seconds": NUMBER,
+    "ai_search_dedup": bool,
+    "ai_search_similarity_threshold": NUMBER,
+    "metrics_endpoint": bool,
+    "metrics_token": OPTIONAL_STRING,
+    "preload_page_cache": bool,
+    # Prefetch and admission control (app.py)
+    "prefetch_links": bool,
+    "prefetch_top_k": int,
+    "prefetch_queue_size": int,
+    "prefetch_workers": int,
+    "prefetch_budget_per_hour": NUMBER,
+    "generation_max_concurrent": int,
+    "generation_queue_size": int,
+    "generation_queue_timeout_seconds": NUMBER,
+    "generation_client_rate_per_minute": NUMBER,
+    "generation_client_burst": NUMBER,
+    "generation_global_rate_per_minute": NUMBER,
+    "generation_global_burst": NUMBER,
+    "generation_retry_after_seconds": NUMBER,
+    "trust_forwarded_for": bool,
+    # Async serving mode (asgi_app.py)
+    "asgi_wsgi_threads": int,
+}
+# Settings holding an object whose values must all be of one type: setting name -> accepted value types
+CONFIG_VALUE_SCHEMA = {
+    "page_ttl_seconds": NUMBER,
+}
+# Without these, pages are generated from a generic fallback prompt
+RECOMMENDED_KEYS = ("website_profile", "system_prompt_template")
+
+
+def _type_names(expected_types):
+    expected_types = expected_types if isinstance(expected_types, tuple) else (expected_types,)
+    return " or ".join("null" if t is type(None) else t.__name__ for t in expected_types)
+
+def _is_instance(value, expected_types):
+    # bool is an int subclass, so true/false must not pass for numbers
+    return isinstance(value, expected_types) and (expected_types is bool or not isinstance(value, bool))
+
+def _validate_values(key, mapping, source):
+    """Returns the entries of an object-valued setting whose values have the right type, warning about the rest."""
+    expected_types = CONFIG_VALUE_SCHEMA[key]
+    valid = {}
+    for name, value in mapping.items():
+        if not _is_instance(value, expected_types):
+            print(f"site_config.py Warning: Setting '{key}' in {source} maps '{name}' to {type(value).__name__}, "
+                  f"should be {_type_names(expected_types)}. Ignoring that entry.", file=sys.stderr)
+            continue
+        valid[name] = value
+    return valid
+
+def validate_config(raw_config, source=CONFIG_FILE_PATH):
+    """Returns the config without settings of the wrong type, printing a warning for each problem found."""
+    if not isinstance(raw_config, dict):
+        print(f"site_config.py Error: {source} must contain a JSON object. Using empty config.", file=sys.stderr)
+        return {}
+    config = {}
+    for key, value in raw_config.items():
+        expected_types = CONFIG_SCHEMA.get(key)
+        if expected_types is None:
+            print(f"site_config.py Warning: Unknown setting '{key}' in {source}; check for a typo.", file=sys.stderr)
+            config[key] = value
+            continue
+        if not _is_instance(value, expected_types):
+            print(f"site_config.py Warning: Setting '{key}' in {source} should be {_type_names(expected_types)}, "
+                  f"got {type(value).__name__}. Using the default.", file=sys.stderr)
+            continue
+        config[key] = _validate_values(key, value, source) if key in CONFIG_VALUE_SCHEMA else value
+    missing_keys = [key for key in RECOMMENDED_KEYS if key not in config]
+    if missing_keys:
+        print(f"site_config.py Warning: {source} has no {', '.join(missing_keys)}. Pages will be generated from a generic prompt.", file=sys.stderr)
+    if "llm_model" not in config:
+        print(f"site_config.py Warning: {source} has no llm_model. Generation will fail unless llm_provider is \"mock\".", file=sys.stderr)
+    return config
+
+def load_config(config_file_path=CONFIG_FILE_PATH):
+    """Reads and validates a config file. Returns an empty config if it is missing or unreadable."""
+    try:
+        with open(config_file_path, 'r', encoding='utf-8') as f:
+            raw_config = json.load(f)
+    except FileNotFoundError:
+        print(f"site_config.py Warning: {config_file_path} not found. Using empty config.", file=sys.stderr)
+        return {}
+    except json.JSONDecodeError as e:
+        print(f"site_config.py Error decoding {config_file_path}: {e}. Using empty config.", file=sys.stderr)
+        return {}
+    except Exception as e:
+        print(f"site_config.py An unexpected error occurred loading {config_file_path}: {e}. Using empty config.", file=sys.stderr)
+        return {}
+    return validate_config(raw_config, config_file_path)
+
+config = load_config()
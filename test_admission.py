@@ -0,0 +1,83 @@
+"""Tests for admission.py's rate limits shared between processes. Run with: python -m pytest test_admission.py"""
+import os
+import sys
+import threading
+import subprocess
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, SQLiteTokenBuckets
+from shared_cache import SharedCacheClient, SharedCacheServer, SharedTokenBuckets
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Stands in for a gunicorn worker: tries five generations for one client, prints how many were admitted
+WORKER_SCRIPT = """
+import sys
+from admission import AdmissionController, AdmissionRejected, SQLiteTokenBuckets
+controller = AdmissionController(client_rate_per_minute=1, client_burst=4, buckets=SQLiteTokenBuckets(sys.argv[1]))
+admitted = 0
+for _ in range(5):
+    try:
+        with controller.admit(client="203.0.113.9"):
+            admitted += 1
+    except AdmissionRejected:
+        pass
+print(admitted)
+"""
+
+
+def admitted_count(controller, attempts, client="203.0.113.9"):
+    admitted = 0
+    for _ in range(attempts):
+        try:
+            with controller.admit(client=client):
+                admitted += 1
+        except AdmissionRejected as rejection:
+            assert rejection.reason in ("client_rate", "global_rate") and rejection.retry_after_seconds >= 1
+    return admitted
+
+
+def test_client_burst_is_shared_by_worker_processes(tmp_path):
+    db_path = str(tmp_path / "buckets.sqlite3")
+    environment = dict(os.environ, PYTHONPATH=REPO_DIR)
+    workers = [subprocess.Popen([sys.executable, "-c", WORKER_SCRIPT, db_path], env=environment,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True) for _ in range(3)]
+    results = []
+    for worker in workers:
+        stdout, stderr = worker.communicate(timeout=60)
+        assert worker.returncode == 0, stderr
+        results.append(int(stdout))
+    assert sum(results) == 4 # One burst for the client across all three workers, not three
+
+
+def test_buckets_are_per_client_and_global(tmp_path):
+    buckets = SQLiteTokenBuckets(str(tmp_path / "buckets.sqlite3"))
+    controller = AdmissionController(client_rate_per_minute=1, client_burst=2, global_rate_per_minute=1, global_burst=3, buckets=buckets)
+    assert admitted_count(controller, 3, client="a") == 2
+    assert admitted_count(controller, 3, client="b") == 1 # Only the global bucket's last token was left
+
+
+@pytest.fixture
+def shared_cache_url(tmp_path):
+    server = SharedCacheServer(("127.0.0.1", 0), str(tmp_path / "shared"))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_shared_cache_server_holds_buckets_for_every_node(tmp_path, shared_cache_url):
+    nodes = [AdmissionController(global_rate_per_minute=1, global_burst=3,
+                                 buckets=SharedTokenBuckets(SharedCacheClient(shared_cache_url),
+                                                            fallback=SQLiteTokenBuckets(str(tmp_path / f"node{i}.sqlite3"))))
+             for i in range(2)]
+    assert admitted_count(nodes[0], 2) + admitted_count(nodes[1], 2) == 3
+
+
+def test_unreachable_server_falls_back_to_node_buckets(tmp_path):
+    controller = AdmissionController(global_rate_per_minute=1, global_burst=2,
+                                     buckets=SharedTokenBuckets(SharedCacheClient("http://127.0.0.1:9", timeout=0.5),
+                                                                fallback=SQLiteTokenBuckets(str(tmp_path / "node.sqlite3"))))
+    assert admitted_count(controller, 3) == 2
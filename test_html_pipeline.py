@@ -0,0 +1,67 @@
+"""Regression table for html_pipeline.ContentPipeline. Run with: python -m pytest test_html_pipeline.py"""
+import pytest
+
+from html_pipeline import ContentPipeline, clean_html
+
+NAVIGATE = "onclick=\"event.preventDefault(); navigateTo('{0}')\""
+
+CASES = [
+    # Omitted end tags are closed where browsers close them
+    ("<table><tr><td>1<td>2<tr><td>3</table>",
+     "<table><tr><td>1</td><td>2</td></tr><tr><td>3</td></tr></table>"),
+    ("<ul><li><p>a<li>b</ul>", "<ul><li><p>a</p></li><li>b</li></ul>"),
+    ("<ul><li>a<ul><li>b</ul><li>c</ul>", "<ul><li>a<ul><li>b</li></ul></li><li>c</li></ul>"),
+    ("<table><tr><td><table><tr><td>in</table><td>out</table>",
+     "<table><tr><td><table><tr><td>in</td></tr></table></td><td>out</td></tr></table>"),
+    ("<table><thead><tr><th>h<tbody><tr><td>1</table>",
+     "<table><thead><tr><th>h</th></tr></thead><tbody><tr><td>1</td></tr></tbody></table>"),
+    ("<dl><dt>t<dd>d<dt>t2</dl>", "<dl><dt>t</dt><dd>d</dd><dt>t2</dt></dl>"),
+    ("<p>a<span>b<div>c</div>", "<p>a<span>b</span></p><div>c</div>"),
+    ("<p>a</p></span></div><p>b", "<p>a</p><p>b</p>"),
+    # Tag and attribute policy
+    ("<p onclick=\"x()\" style=\"color:red\" class=\"lead\">Hi <img src=\"a.png\">there</p>", "<p class=\"lead\">Hi there</p>"),
+    ("<p>a<script>alert(1)</script><iframe src=\"x\">f</iframe>b</p>", "<p>ab</p>"),
+    ("<p><font>kept</font> a &lt; b</p>", "<p>kept a &lt; b</p>"),
+    # Link policy
+    ("<a href=\"/services\">S</a>", "<a href=\"/services\" " + NAVIGATE.format("/services") + ">S</a>"),
+    ("<a onclick=\"navigateTo('/about-us')\">A</a>", "<a href=\"/about-us\" " + NAVIGATE.format("/about-us") + ">A</a>"),
+    ("<a href=\"contact?x=1\">C</a>", "<a href=\"/contact\" " + NAVIGATE.format("/contact") + ">C</a>"),
+    ("<a href=\"https://example.com\">E</a> <a href=\"javascript:alert(1)\">J</a>", "E J"),
+    ("<a href=\"mailto:a@b.c\">M</a>", "<a href=\"mailto:a@b.c\">M</a>"),
+    ("<a href='/x'>a<a href='/y'>b</a>",
+     "<a href=\"/x\" " + NAVIGATE.format("/x") + ">a</a><a href=\"/y\" " + NAVIGATE.format("/y") + ">b</a>"),
+    ("<a href='/x'>a<a href='https://example.com'>b</a>c", "<a href=\"/x\" " + NAVIGATE.format("/x") + ">a</a>bc"),
+    ("<a href='/x'><table><tr><td><a href='/y'>b</a></td></tr></table></a>",
+     "<a href=\"/x\" " + NAVIGATE.format("/x") + "><table><tr><td><a href=\"/y\" " + NAVIGATE.format("/y") + ">b</a></td></tr></table></a>"),
+    # Main content extraction
+    ("<!DOCTYPE html><html><head><title>T</title></head><body><nav>n</nav><main><h2>x</h2></main><footer>f</footer></body></html>",
+     "<h2>x</h2>"),
+    ("<html><body><header>h</header><p>b</p></body></html>", "<p>b</p>"),
+]
+
+
+@pytest.mark.parametrize("raw_html, expected_html", CASES)
+def test_cleaned_html(raw_html, expected_html):
+    assert clean_html(raw_html).html == expected_html
+
+
+@pytest.mark.parametrize("raw_html, expected_html", CASES)
+def test_streaming_matches_whole_input(raw_html, expected_html):
+    pipeline = ContentPipeline()
+    streamed_html = ""
+    for start in range(0, len(raw_html), 3):
+        chunk_html = pipeline.feed(raw_html[start:start + 3])
+        streamed_html = chunk_html if pipeline.replaced else streamed_html + chunk_html
+    streamed_html += pipeline.close()
+    assert streamed_html.strip() == expected_html
+
+
+@pytest.mark.parametrize("raw_html, title, links", [
+    ("<html><head><title>Solar &amp; Co</title></head><body><main><h1>H</h1></main></body></html>", "Solar & Co", []),
+    ("<h2>Sub</h2><h1>Main <em>one</em></h1>", "Main one", []),
+    ("<h2>Only</h2><a href=\"/a\">1</a><a href=\"/b#x\">2</a><a onclick=\"navigateTo('/a')\">3</a>", "Only", ["/a", "/b"]),
+    ("<nav><a href=\"/hidden\">h</a></nav><p>none</p>", None, []),
+])
+def test_title_and_links(raw_html, title, links):
+    pipeline = clean_html(raw_html)
+    assert (pipeline.title, pipeline.links) == (title, links)
@@ -0,0 +1,42 @@
+"""Tests for metrics.py's aggregation over gunicorn workers. Run with: python -m pytest test_metrics.py"""
+import os
+import sys
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Stands in for a gunicorn worker: counts and times some requests, writes its snapshot, then
+# prints a scrape answered by this worker while `keep_alive` workers are still running
+WORKER_SCRIPT = """
+import sys
+import metrics
+for _ in range(int(sys.argv[1])):
+    metrics.CACHE_LOOKUPS.inc(result="hit")
+    metrics.HTTP_REQUEST_SECONDS.observe(0.002, endpoint="serve_index", status="200")
+metrics.write_snapshot()
+if sys.argv[2] == "scrape":
+    print(metrics.render_metrics())
+"""
+
+
+def run_worker(metrics_dir, requests, action):
+    environment = dict(os.environ, SITE_METRICS_DIR=str(metrics_dir), PYTHONPATH=REPO_DIR)
+    return subprocess.run([sys.executable, "-c", WORKER_SCRIPT, str(requests), action], env=environment,
+                          capture_output=True, text=True, check=True, timeout=60).stdout
+
+
+def test_scrape_sums_every_worker_including_exited_ones(tmp_path):
+    run_worker(tmp_path, 3, "exit")
+    run_worker(tmp_path, 4, "exit")
+    scrape = run_worker(tmp_path, 5, "scrape")
+    assert 'site_cache_lookups_total{result="hit"} 12' in scrape.splitlines()
+    assert 'site_http_request_seconds_count{endpoint="serve_index",status="200"} 12' in scrape.splitlines()
+    assert 'pid=' not in scrape
+
+
+def test_without_metrics_dir_only_this_process_is_reported(tmp_path):
+    environment = dict(os.environ, PYTHONPATH=REPO_DIR)
+    environment.pop("SITE_METRICS_DIR", None)
+    scrape = subprocess.run([sys.executable, "-c", WORKER_SCRIPT, "2", "scrape"], env=environment, cwd=str(tmp_path),
+                            capture_output=True, text=True, check=True, timeout=60).stdout
+    assert 'site_cache_lookups_total{result="hit"} 2' in scrape.splitlines()
@@ -0,0 +1,28 @@
+"""Tests for search_index.SearchIndex matching. Run with: python -m pytest test_search_index.py"""
+import pytest
+
+from search_index import SearchIndex
+
+PAGES = ["/installation", "/panel-upgrade", "/services/ev-chargers"]
+
+
+def page_name(path):
+    return path.strip('/').split('/')[-1].replace('-', ' ').title()
+
+
+@pytest.fixture
+def index(tmp_path):
+    search_index = SearchIndex(str(tmp_path), page_text=page_name) # Default threshold: exact repeats only
+    search_index.record("How much does a panel upgrade cost?", "/panel-upgrade-cost")
+    return search_index
+
+
+@pytest.mark.parametrize("query", ["how much does a panel upgrade cost", "HOW MUCH does a panel-upgrade cost?!"])
+def test_exact_repeats_match(index, query):
+    assert index.lookup(query, PAGES) == ("/panel-upgrade-cost", 1.0)
+
+
+# Lexically close, but asking for something else: never redirected unless a deployment opts in
+@pytest.mark.parametrize("query", ["not installation", "panel upgrade cost", "ev charger rebates"])
+def test_near_duplicates_do_not_match_by_default(index, query):
+    assert index.lookup(query, PAGES) is None
@@ -0,0 +1,71 @@
+"""Regression tests for the shared cache tier. Run with: python -m pytest test_shared_cache.py"""
+import os
+import sys
+import json
+import time
+import threading
+import subprocess
+
+import pytest
+
+from shared_cache import SharedCacheClient, SharedCacheServer, SharedCacheStore
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Imports the app against the given cache and config, then requests one page once every worker is up
+WORKER_SCRIPT = """
+import sys, time
+import app, page
+start_at = float(sys.argv[1])
+time.sleep(max(0.0, start_at - time.time()))
+content = app.get_or_generate_content("/single-flight/page")
+print("RESULT", page.llm_provider.calls, bool(content.strip()))
+"""
+
+
+@pytest.fixture
+def shared_cache_url(tmp_path):
+    server = SharedCacheServer(("127.0.0.1", 0), str(tmp_path / "shared"))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_revalidate_skips_memoized_signature(shared_cache_url):
+    reader = SharedCacheStore(SharedCacheClient(shared_cache_url), revalidate_seconds=60)
+    writer = SharedCacheStore(SharedCacheClient(shared_cache_url), revalidate_seconds=60)
+    assert reader.signature("page_content.html") is None
+    writer.write("page_content.html", "<p>x</p>", {"path": "/page"})
+    assert reader.signature("page_content.html") is None # Memoized until revalidate_seconds pass
+    assert reader.signature("page_content.html", revalidate=True) == writer.signature("page_content.html")
+
+
+def test_single_flight_across_processes_with_shared_cache(tmp_path, shared_cache_url):
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({
+        "llm_provider": "mock",
+        "mock_llm": {"latency_seconds": 0.5, "tokens_per_second": 0, "response_tokens": 40},
+        "llm_model": "mock-model",
+        "website_profile": {"company_name": "Test Co"},
+        "system_prompt_template": "Write the page for {current_page_path_for_llm}.",
+        "shared_cache_url": shared_cache_url,
+        "shared_cache_revalidate_seconds": 60,
+    }))
+    environment = dict(os.environ, CONTENT_CACHE_DIR=str(tmp_path / "cache"), SITE_CONFIG_PATH=str(config_path),
+                       LLM_PROVIDER="mock", PYTHONPATH=REPO_DIR)
+    environment.pop("SHARED_CACHE_URL", None)
+    # The cache directory must exist before the workers race to create their lock directory in it
+    os.makedirs(tmp_path / "cache")
+    start_at = time.time() + 5
+    workers = [subprocess.Popen([sys.executable, "-c", WORKER_SCRIPT, str(start_at)], cwd=str(tmp_path), env=environment,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True) for _ in range(3)]
+    llm_calls = 0
+    for worker in workers:
+        stdout, stderr = worker.communicate(timeout=60)
+        assert worker.returncode == 0, stderr
+        result = [line.split() for line in stdout.splitlines() if line.startswith("RESULT")][0]
+        llm_calls += int(result[1])
+        assert result[2] == "True"
+    assert llm_calls == 1
@@ -0,0 +1,49 @@
+"""Tests for app.py's single-flight lock files. Run with: python -m pytest test_single_flight.py"""
+import os
+import sys
+import json
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Imports the app against the given cache and config, then checks the lock files it leaves behind
+WORKER_SCRIPT = """
+import os, time, threading
+import app, page
+holders, overlaps = [], []
+def contend():
+    for _ in range(20):
+        with app.single_flight_lock("contended") as acquired:
+            assert acquired
+            holders.append(1)
+            if len(holders) > 1:
+                overlaps.append(1)
+            time.sleep(0.001)
+            holders.pop()
+threads = [threading.Thread(target=contend) for _ in range(8)]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+for path in ("/a", "/b/c", "/d"):
+    app.get_or_generate_content(path)
+print("RESULT", len(overlaps), page.llm_provider.calls, len(os.listdir(app.SINGLE_FLIGHT_LOCK_DIR)))
+"""
+
+
+def test_lock_files_are_removed_without_breaking_mutual_exclusion(tmp_path):
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({
+        "llm_provider": "mock",
+        "mock_llm": {"latency_seconds": 0, "tokens_per_second": 0, "response_tokens": 20},
+        "llm_model": "mock-model",
+        "website_profile": {"company_name": "Test Co"},
+        "system_prompt_template": "Write the page for {current_page_path_for_llm}.",
+    }))
+    environment = dict(os.environ, CONTENT_CACHE_DIR=str(tmp_path / "cache"), SITE_CONFIG_PATH=str(config_path),
+                       LLM_PROVIDER="mock", PYTHONPATH=REPO_DIR)
+    environment.pop("SHARED_CACHE_URL", None)
+    stdout = subprocess.run([sys.executable, "-c", WORKER_SCRIPT], cwd=str(tmp_path), env=environment,
+                            capture_output=True, text=True, check=True, timeout=60).stdout
+    result = [line.split() for line in stdout.splitlines() if line.startswith("RESULT")][0]
+    assert result[1:] == ["0", "3", "0"] # No overlapping holders, one generation per page, no lock files left
@@ -0,0 +1,132 @@
+"""
+Bulk pre-generation of cached pages, so a deploy can warm the site before it takes traffic.
+
+Examples:
+    python warm_cache.py /services /about-us /contact-us
+    python warm_cache.py --paths-file paths.txt --workers 8 --rate 2
+    python warm_cache.py --sitemap https://example.com/sitemap.xml
+    python warm_cache.py --from-cache-links
+"""
+import sys
+import time
+import argparse
+import threading
+import urllib.request
+import xml.etree.ElementTree as ET
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import app as site # Reuses the server's cache layout, single-flight locks, atomic writes and menu index
+from admission import AdmissionController
+
+
+class RateLimiter:
+    """Spaces calls evenly so at most `rate` generations start per second across all workers."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def read_paths_file(paths_file):
+    with open(paths_file, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+def read_sitemap(sitemap_location):
+    """Returns the URL paths of every <loc> in a sitemap file or URL."""
+    if sitemap_location.startswith(('http://', 'https://')):
+        with urllib.request.urlopen(sitemap_location, timeout=30) as response:
+            root = ET.fromstring(response.read())
+    else:
+        root = ET.parse(sitemap_location).getroot()
+    return [urlparse(loc.text.strip()).path or '/' for loc in root.iter() if loc.tag.endswith('loc') and loc.text]
+
+def links_from_cached_pages():
+    """Returns internal link targets found in already-cached pages."""
+    links = []
+    for cached_path in site.MENU_INDEX.paths():
+        cached_content, _ = site.lookup_cached_page(cached_path, log_prefix="warm_cache.py")
+        links.extend(site.page_links(cached_path, cached_content)) # Recorded at save time; older pages are parsed
+    return links
+
+def warm_path(normalized_path, rate_limiter):
+    """Generates one path, or regenerates it if its cached copy is stale. Returns 'skipped', 'generated' or 'failed'."""
+    cached_content, is_fresh = site.lookup_cached_page(normalized_path, log_prefix="warm_cache.py")
+    if cached_content.strip() and is_fresh:
+        return 'skipped'
+    rate_limiter.wait()
+    if cached_content.strip():
+        refreshed = site.refresh_cached_page(normalized_path, wait_seconds=None, log_prefix="warm_cache.py")
+        return 'generated' if refreshed else 'failed'
+    content = site.get_or_generate_content(normalized_path, log_prefix="warm_cache.py")
+    return 'generated' if content.strip() else 'failed'
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-generate pages into the content cache.")
+    parser.add_argument('paths', nargs='*', help="URL paths to generate, e.g. /services/ev-chargers")
+    parser.add_argument('--paths-file', help="File with one URL path per line")
+    parser.add_argument('--sitemap', help="Sitemap XML file or URL whose <loc> paths should be generated")
+    parser.add_argument('--from-cache-links', action='store_true', help="Generate the internal links found in already-cached pages")
+    parser.add_argument('--workers', type=int, default=4, help="Concurrent generations (default: 4)")
+    parser.add_argument('--rate', type=float, default=1.0, help="Max generations started per second, 0 for unlimited (default: 1)")
+    args = parser.parse_args(argv)
+
+    requested_paths = list(args.paths)
+    if args.paths_file:
+        requested_paths += read_paths_file(args.paths_file)
+    if args.sitemap:
+        requested_paths += read_sitemap(args.sitemap)
+    if args.from_cache_links:
+        requested_paths += links_from_cached_pages()
+
+    # Normalize and de-duplicate by cache file, since several paths can share one
+    targets = {}
+    for path in requested_paths:
+        normalized_path = site.normalize_path(path)
+        if normalized_path not in site.SKIPPED_PATHS:
+            targets.setdefault(site.sanitize_path_to_cache_filename(normalized_path), normalized_path)
+    if not targets:
+        parser.error("no paths to warm; pass paths, --paths-file, --sitemap or --from-cache-links")
+
+    print(f"warm_cache.py: Warming {len(targets)} paths with {args.workers} workers at up to {args.rate or 'unlimited'} generations/s.", file=sys.stderr)
+    rate_limiter = RateLimiter(args.rate)
+    # --workers and --rate are the limits here, not the server's per-visitor admission settings
+    site.ADMISSION = AdmissionController(max_concurrent=max(1, args.workers), max_queue=0)
+    counts = {'generated': 0, 'skipped': 0, 'failed': 0}
+    failed_paths = []
+    start_time = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = {executor.submit(warm_path, path, rate_limiter): path for path in targets.values()}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                outcome = future.result()
+            except Exception as e:
+                print(f"warm_cache.py Error generating '{path}': {e}", file=sys.stderr)
+                outcome = 'failed'
+            counts[outcome] += 1
+            if outcome == 'failed':
+                failed_paths.append(path)
+            print(f"warm_cache.py [{sum(counts.values())}/{len(targets)}] {outcome}: {path}", file=sys.stderr)
+    elapsed = time.monotonic() - start_time
+
+    throughput = counts['generated'] / elapsed if elapsed > 0 else 0.0
+    print(f"warm_cache.py: Done in {elapsed:.1f}s. Generated {counts['generated']}, skipped {counts['skipped']} already cached, "
+          f"failed {counts['failed']} ({throughput:.2f} pages/s).", file=sys.stderr)
+    for path in failed_paths:
+        print(f"warm_cache.py: FAILED {path}", file=sys.stderr)
+    return 1 if failed_paths else 0
+
+if __name__ == "__main__":
+    sys.exit(main())